@@ -0,0 +1,212 @@
+"""
+Reproducible benchmark of the pipeline stages on synthetic ARCHS4-shaped matrices.
+
+For each matrix size of the sweep, a deterministic synthetic matrix is generated (see synthetic_utils)
+and each stage is timed in a fresh process, so that its peak memory (RSS) is measured in isolation:
+
+- load           : load_matrix (single process, no binary cache)
+- load_parallel  : load_matrix with all CPU cores
+- load_cached    : load_matrix from the binary cache (memory-mapped)
+- streaming      : single-pass streaming aggregation
+- totals         : total_count_gene + total_count_tissue on a loaded matrix
+- summary        : compute_summary on a loaded matrix (dense storage)
+- summary_sparse : compute_summary on a loaded matrix in sparse (CSR) storage
+- plots          : rendering of the two bar plots
+
+Reported for each stage : wall time, CPU time, rows/sec (count rows), MB/s (input file size) and peak RSS.
+Results are saved as JSON ; '--compare' compares them with a previous result file and exits with
+status 1 if a stage became slower than the given tolerance.
+
+Run
+---
+PYTHONPATH=src python benchmarks/bench_pipeline.py --sizes 1000x50,5000x200 --output bench.json
+PYTHONPATH=src python benchmarks/bench_pipeline.py --compare bench_old.json --output bench_new.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from synthetic_utils import generate_matrix
+
+# Default size sweep (genes x tissues/cells)
+DEFAULT_SIZES = "1000x50,5000x200,20000x500,60000x1000"
+
+STAGES = ["load", "load_parallel", "load_cached", "streaming", "totals", "summary", "summary_sparse", "plots"]
+
+def peak_rss_mb():
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_stage(stage, path, work_dir):
+
+    """
+    Run one stage in the current (fresh) process and measure it.
+    """
+
+    from cache_utils import write_cache
+    from io_utils import load_matrix, stream_matrix
+    from plotting import gene_total_spec, tissue_total_spec, render_figures
+    from stats_utils import StreamingAggregator, compute_summary, total_count_gene, total_count_tissue
+
+    # Inputs prepared before the measurement
+    matrix = None
+    if stage in ("totals", "summary", "plots"):
+        matrix = load_matrix(path, cache=False, storage="dense")
+    if stage == "summary_sparse":
+        matrix = load_matrix(path, cache=False, storage="sparse")
+    if stage == "plots":
+        result = compute_summary(matrix.tissues, matrix)
+    if stage == "load_cached":
+        write_cache(path, load_matrix(path, cache=False), cache_dir=work_dir)
+
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    if stage == "load":
+        matrix = load_matrix(path, cache=False)
+    elif stage == "load_parallel":
+        matrix = load_matrix(path, workers=None, cache=False)
+    elif stage == "load_cached":
+        matrix = load_matrix(path, cache_dir=work_dir)
+    elif stage == "streaming":
+        tissues, rows = stream_matrix(path)
+        result = StreamingAggregator(tissues).consume(rows).result()
+    elif stage == "totals":
+        total_count_gene(matrix)
+        total_count_tissue(matrix.tissues, matrix)
+    elif stage in ("summary", "summary_sparse"):
+        compute_summary(matrix.tissues, matrix)
+    elif stage == "plots":
+        specs = [tissue_total_spec(result, output_path=os.path.join(work_dir, "tissues.png")),
+                 gene_total_spec(result, output_path=os.path.join(work_dir, "genes.png"))]
+        render_figures(specs, force=True)
+
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    n_rows = matrix.n_genes if matrix is not None else result.n_genes
+
+    return {"seconds": wall, "cpu_seconds": cpu, "rows": n_rows,
+            "peak_rss_mb": peak_rss_mb(), "rss_increase_mb": peak_rss_mb() - rss_before}
+
+def measure(stage, path, work_dir):
+
+    """
+    Run one stage in a new process ('spawn'), so that peak RSS is not polluted by previous stages.
+    """
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_stage, stage, path, work_dir).result()
+
+def run_benchmarks(sizes, stages, sparsity, compress, data_dir, seed=0):
+    results = []
+
+    for n_genes, n_tissues in sizes:
+        suffix = ".tsv.gz" if compress else ".tsv"
+        path = os.path.join(data_dir, f"synthetic_{n_genes}x{n_tissues}_s{sparsity}_{compress or 'plain'}{suffix}")
+
+        # Generated files are deterministic, so they are reused between runs
+        if not os.path.exists(path):
+            print(f"Generating {path} ...", flush=True)
+            generate_matrix(path, n_genes, n_tissues, sparsity=sparsity, seed=seed, compress=compress)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+
+        for stage in stages:
+            with tempfile.TemporaryDirectory() as work_dir:
+                measured = measure(stage, path, work_dir)
+
+            record = {
+                "stage": stage,
+                "genes": n_genes,
+                "tissues": n_tissues,
+                "file_mb": size_mb,
+                **measured,
+                "rows_per_sec": measured["rows"] / measured["seconds"] if measured["seconds"] else None,
+                "mb_per_sec": size_mb / measured["seconds"] if measured["seconds"] else None,
+            }
+            results.append(record)
+            print(f"{n_genes:>7}x{n_tissues:<5} {stage:<14} {record['seconds']:9.4f} s "
+                  f"{record['rows_per_sec'] or 0:12.0f} rows/s {record['mb_per_sec'] or 0:9.1f} MB/s "
+                  f"{record['peak_rss_mb']:9.1f} MB peak", flush=True)
+
+    return results
+
+def compare(results, previous, tolerance):
+
+    """
+    Compare results with a previous run ; return the list of regressions (slower than 1 + tolerance).
+    """
+
+    old = {(r["stage"], r["genes"], r["tissues"]): r for r in previous["results"]}
+    regressions = []
+
+    for r in results:
+        before = old.get((r["stage"], r["genes"], r["tissues"]))
+        if before is None or not before["seconds"]:
+            continue
+        ratio = r["seconds"] / before["seconds"]
+        print(f"{r['genes']:>7}x{r['tissues']:<5} {r['stage']:<14} {ratio:6.2f}x vs previous")
+        if ratio > 1 + tolerance:
+            regressions.append({**r, "ratio": ratio})
+
+    return regressions
+
+def parse_sizes(text):
+    sizes = []
+    for item in text.split(","):
+        genes, tissues = item.lower().split("x")
+        sizes.append((int(genes), int(tissues)))
+    return sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the pipeline stages on synthetic matrices")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"size sweep, GENESxTISSUES (default {DEFAULT_SIZES})")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--sparsity", type=float, default=0.5, help="fraction of zero counts (default 0.5)")
+    parser.add_argument("--compress", choices=["gzip", "bgzf"], default=None, help="compression of the generated files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "bench_matrices"),
+                        help="directory of the generated matrices (reused between runs)")
+    parser.add_argument("--output", default="bench_results.json", help="JSON result file")
+    parser.add_argument("--compare", default=None, help="previous JSON result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted slowdown before a regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(",")
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage}")
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = run_benchmarks(parse_sizes(args.sizes), stages, args.sparsity, args.compress, args.data_dir, args.seed)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {"sparsity": args.sparsity, "compress": args.compress, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print("Results saved to", args.output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.tolerance:.0%}")
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
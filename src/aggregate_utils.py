@@ -0,0 +1,259 @@
+"""
+Persisted aggregate state of a growing count matrix, updated from delta files.
+
+Matrices grow : new tissues/cells are added as extra columns, new genes as extra rows.
+Instead of recomputing the totals over the full file, an AggregateState keeps
+
+- the gene and tissue/cell names, the total count of each gene and of each tissue/cell
+- the number of nonzero counts (density)
+- the files already folded in (with their fingerprint, see cache_utils)
+
+and 'fold' adds the counts of a delta file only : the cost is proportional to the delta, not to the full matrix.
+The min/max tie sets and the rankings are derived from the totals when the summary is built ('result').
+
+A delta file has the usual matrix layout (see io_utils) and may hold :
+- new tissues/cells (columns) for existing or new genes
+- new genes (rows) for existing or new tissues/cells
+Counts of an existing gene in an existing tissue/cell were already counted : a nonzero value there is rejected,
+as well as a gene appearing twice in the delta and a file folded twice.
+
+A fold either applies completely or leaves the state unchanged.
+
+The state is saved as a single .npz file (names and totals arrays, metadata as JSON), written atomically.
+
+Example
+-------
+state = AggregateState.build("data/ARCHS4.tsv.gz")       # first full pass
+state.save("archs4_state.npz")
+
+state = AggregateState.load("archs4_state.npz")
+state.fold("data/new_tissues.tsv")                      # weekly refresh : reads the delta only
+state.save("archs4_state.npz")
+result = state.result()                                 # SummaryResult for the console, figures and report
+
+The json module stores the metadata of the state.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from cache_utils import file_fingerprint
+from io_utils import is_regular_file, stream_matrix
+from stats_utils import SummaryResult
+
+# Version of the state layout, stored in its metadata
+STATE_VERSION = 1
+
+class AggregateState:
+
+    """
+    Totals of a matrix built from a base file and delta files.
+
+    Attributes
+    ----------
+    - tissues, genes : list[str]
+    - tissue_totals, gene_totals : numpy.ndarray (float64)
+      Totals aligned with 'tissues' and 'genes'
+    - nnz : int
+      Number of nonzero counts
+    - sources : list[dict]
+      Files folded in, in order : {"name", "fingerprint" (None for standard input and pipes), "genes", "tissues",
+      "new_genes", "new_tissues"}
+    """
+
+    def __init__(self, tissues=(), genes=(), tissue_totals=None, gene_totals=None, nnz=0, sources=()):
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.tissue_totals = np.zeros(0) if tissue_totals is None else np.asarray(tissue_totals, dtype=np.float64)
+        self.gene_totals = np.zeros(0) if gene_totals is None else np.asarray(gene_totals, dtype=np.float64)
+        self.nnz = int(nnz)
+        self.sources = list(sources)
+
+        if len(self.tissue_totals) != len(self.tissues) or len(self.gene_totals) != len(self.genes):
+            raise ValueError("Totals length does not match number of genes or tissues/cells")
+
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.tissue_index = {tissue: j for j, tissue in enumerate(self.tissues)}
+
+    @classmethod
+    def build(cls, path, counters=None):
+
+        """
+        State of a full matrix file (a fold into an empty state).
+        """
+
+        state = cls()
+        state.fold(path, counters)
+        return state
+
+    @property
+    def n_genes(self):
+        return len(self.genes)
+
+    @property
+    def n_tissues(self):
+        return len(self.tissues)
+
+    @property
+    def density(self):
+        size = self.n_genes * self.n_tissues
+        return self.nnz / size if size else 0.0
+
+    def is_folded(self, path):
+
+        """
+        True if the file was already folded into the state (same fingerprint).
+        """
+
+        if not is_regular_file(path):
+            return False
+        fingerprint = file_fingerprint(path)
+        return any(source["fingerprint"] == fingerprint for source in self.sources)
+
+    # ---------------------------------------------------------------------
+    # Delta folding
+    # ---------------------------------------------------------------------
+
+    def fold(self, path, counters=None):
+
+        """
+        Add the counts of a delta file ("-", named pipes and file objects are accepted, see io_utils.stream_matrix).
+
+        Returns
+        -------
+        dict : the entry added to 'sources' (numbers of genes and tissues/cells read and added)
+        """
+
+        if self.is_folded(path):
+            raise ValueError(f"{path} was already folded into the state")
+
+        fingerprint = file_fingerprint(path) if is_regular_file(path) else None
+        tissues, rows = stream_matrix(path, counters)
+        return self.fold_rows(tissues, rows, name=str(path), fingerprint=fingerprint)
+
+    def fold_rows(self, tissues, rows, name="<rows>", fingerprint=None):
+
+        """
+        Add (gene, counts) rows whose counts are aligned with 'tissues' (see 'fold').
+        """
+
+        if len(set(tissues)) != len(tissues):
+            raise ValueError(f"Duplicate tissue/cell names in {name}")
+
+        # Column of each delta tissue/cell in the state, new tissues/cells appended
+        n_tissues = self.n_tissues
+        new_tissues = [tissue for tissue in tissues if tissue not in self.tissue_index]
+        tissue_index = dict(self.tissue_index)
+        tissue_index.update((tissue, n_tissues + k) for k, tissue in enumerate(new_tissues))
+        columns = np.array([tissue_index[tissue] for tissue in tissues], dtype=np.intp)
+        old_columns = columns < n_tissues
+
+        # Work on copies : the state is only changed once the whole delta has been read
+        n_genes = self.n_genes
+        gene_totals = self.gene_totals.copy()
+        new_genes, new_totals = [], []
+        seen = set()
+        tissue_sums = np.zeros(len(tissues), dtype=np.float64)
+        nnz = 0
+
+        for gene, counts in rows:
+            if len(counts) != len(tissues):
+                raise ValueError(f"Counts length does not match number of tissues/cells for gene {gene} in {name}")
+            if gene in seen:
+                raise ValueError(f"Duplicate gene {gene} in {name}")
+            seen.add(gene)
+
+            total = float(counts.sum())
+            i = self.gene_index.get(gene)
+            if i is None:
+                new_genes.append(gene)
+                new_totals.append(total)
+            else:
+                if np.any(counts[old_columns]):
+                    raise ValueError(f"Counts of gene {gene} in tissues/cells already in the state ({name}) : "
+                                     f"only new genes or new tissues/cells can be folded")
+                gene_totals[i] += total
+
+            tissue_sums += counts
+            nnz += int(np.count_nonzero(counts))
+
+        tissue_totals = np.concatenate([self.tissue_totals, np.zeros(len(new_tissues))])
+        tissue_totals[columns] += tissue_sums
+
+        self.tissues += new_tissues
+        self.tissue_index = tissue_index
+        self.tissue_totals = tissue_totals
+        self.genes += new_genes
+        self.gene_index.update((gene, n_genes + k) for k, gene in enumerate(new_genes))
+        self.gene_totals = np.concatenate([gene_totals, np.asarray(new_totals, dtype=np.float64)])
+        self.nnz += nnz
+
+        source = {"name": name, "fingerprint": fingerprint, "genes": len(seen), "tissues": len(tissues),
+                  "new_genes": len(new_genes), "new_tissues": len(new_tissues)}
+        self.sources.append(source)
+        return source
+
+    # ---------------------------------------------------------------------
+    # Summary and persistence
+    # ---------------------------------------------------------------------
+
+    def result(self, max_limit=10):
+
+        """
+        Returns
+        -------
+        SummaryResult : the same result object as 'compute_summary' on the merged matrix
+        """
+
+        return SummaryResult(self.tissues, self.genes, self.tissue_totals, self.gene_totals, max_limit,
+                             density=self.density)
+
+    def save(self, path):
+
+        """
+        Write the state to a .npz file (through a temporary file, so a failed write keeps the previous state).
+        """
+
+        meta = {"version": STATE_VERSION, "nnz": self.nnz, "sources": self.sources,
+                "summary": self.result().to_dict() if self.genes and self.tissues else None}
+
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(f, tissues=np.array(self.tissues, dtype=str), genes=np.array(self.genes, dtype=str),
+                     tissue_totals=self.tissue_totals, gene_totals=self.gene_totals,
+                     meta=np.array(json.dumps(meta)))
+        os.replace(temporary, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            if meta.get("version") != STATE_VERSION:
+                raise ValueError(f"Unsupported aggregate state version in {path}")
+            return cls(arrays["tissues"].tolist(), arrays["genes"].tolist(), arrays["tissue_totals"],
+                       arrays["gene_totals"], meta["nnz"], meta["sources"])
+
+    def __repr__(self):
+        return (f"AggregateState(genes={self.n_genes}, tissues={self.n_tissues}, "
+                f"sources={len(self.sources)})")
+
+def update_state(state_path, paths, counters=None):
+
+    """
+    Load the state saved in 'state_path' (an empty state if the file does not exist), fold every file of 'paths'
+    that was not folded yet, and save the state if it changed.
+
+    Returns
+    -------
+    tuple: (AggregateState, list of the entries of the folded files)
+    """
+
+    state = AggregateState.load(state_path) if os.path.exists(state_path) else AggregateState()
+
+    folded = [state.fold(path, counters) for path in paths if not state.is_folded(path)]
+    if folded or not os.path.exists(state_path):
+        state.save(state_path)
+    return state, folded
@@ -0,0 +1,202 @@
+"""
+Persistent binary cache of loaded count matrices.
+
+Parsing a large .tsv/.tsv.gz file is slow, while the same file is often analyzed many times.
+After a first load, the matrix is saved in a cache directory:
+
+    data/ARCHS4.tsv.cache/
+        meta.json            fingerprint of the input file, dtype and shape
+        names.json           gene and tissue/cell names
+        counts-float64.npy   count array (one file per dtype)
+
+A matrix loaded in sparse storage (see matrix_utils.SparseCountMatrix) is saved as its CSR arrays instead:
+
+        csr-indptr.npy, csr-indices.npy    row pointers and column indices of the nonzero counts
+        csr-values-float64.npy             nonzero counts (one file per dtype)
+
+Later loads memory-map the arrays (no parsing, no copy) and only read the name tables.
+
+The cache is keyed on the fingerprint of the input file: size, modification time and a hash of its content.
+To keep the fingerprint cheap on multi-GB files, the hash covers the first and last megabytes of the file
+together with its size ; any change in size or mtime also invalidates the cache.
+
+By default the cache directory is created next to the input file. A different root directory
+can be given (for example when the data directory is mounted read-only).
+
+The json module is used to store metadata and names, the hashlib module to fingerprint the input file,
+and the shutil module to remove stale caches.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from matrix_utils import CountMatrix, SparseCountMatrix, resolve_dtype
+
+# Version of the cache layout, stored in meta.json
+CACHE_VERSION = 1
+
+# Number of bytes hashed at the start and at the end of the input file
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+def file_fingerprint(path):
+
+    """
+    Compute the fingerprint of a file : size, modification time and a hash of its first and last megabytes.
+
+    Returns
+    -------
+    dict : {"size": int, "mtime_ns": int, "hash": str}
+    """
+
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(stat.st_size).encode())
+
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_SAMPLE_SIZE))
+        if stat.st_size > 2 * HASH_SAMPLE_SIZE:
+            f.seek(-HASH_SAMPLE_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+def cache_location(path, cache_dir=None):
+
+    """
+    Return the cache directory of an input file.
+
+    Without 'cache_dir', the cache is stored next to the input file ('<file>.cache').
+    With 'cache_dir', it is stored in that directory, under a name derived from the absolute path of the input file.
+    """
+
+    if cache_dir is None:
+        return path + ".cache"
+
+    abs_path = os.path.abspath(path)
+    key = hashlib.blake2b(abs_path.encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f"{os.path.basename(path)}-{key}.cache")
+
+def read_cache(path, dtype="float64", cache_dir=None, sparse=False):
+
+    """
+    Load a matrix from its cache if the cache exists and matches the current input file.
+
+    The arrays are memory-mapped in read-only mode : nothing is parsed or copied.
+    When the cache holds both storages for this dtype, the sparse one is returned if 'sparse' is True.
+
+    Returns
+    -------
+    CountMatrix, SparseCountMatrix or None : None if there is no valid cache for this file and dtype
+    """
+
+    location = cache_location(path, cache_dir)
+    dtype = resolve_dtype(dtype)
+    counts_file = os.path.join(location, f"counts-{dtype.name}.npy")
+    values_file = os.path.join(location, f"csr-values-{dtype.name}.npy")
+
+    try:
+        with open(os.path.join(location, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("version") != CACHE_VERSION or meta.get("fingerprint") != file_fingerprint(path):
+        return None
+
+    has_dense = dtype.name in meta.get("dtypes", []) and os.path.exists(counts_file)
+    has_sparse = dtype.name in meta.get("sparse_dtypes", []) and os.path.exists(values_file)
+    if not has_dense and not has_sparse:
+        return None
+
+    with open(os.path.join(location, "names.json"), encoding="utf-8") as f:
+        names = json.load(f)
+
+    if has_sparse and (sparse or not has_dense):
+        return SparseCountMatrix(names["tissues"], names["genes"],
+                                 np.load(os.path.join(location, "csr-indptr.npy"), mmap_mode="r"),
+                                 np.load(os.path.join(location, "csr-indices.npy"), mmap_mode="r"),
+                                 np.load(values_file, mmap_mode="r"))
+
+    counts = np.load(counts_file, mmap_mode="r")
+    return CountMatrix(names["tissues"], names["genes"], counts)
+
+def save_array(filename, array):
+    with open(filename + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(filename + ".tmp", filename)
+
+def write_cache(path, matrix, cache_dir=None):
+
+    """
+    Save a loaded matrix in the cache of its input file.
+
+    Files are written under temporary names and renamed, and meta.json is written last,
+    so an interrupted write never leaves a cache that looks valid.
+    If the cache directory cannot be written (read-only mount), the cache is silently skipped.
+
+    Returns
+    -------
+    str or None : cache directory, or None if the cache could not be written
+    """
+
+    location = cache_location(path, cache_dir)
+    fingerprint = file_fingerprint(path)
+    meta_file = os.path.join(location, "meta.json")
+
+    try:
+        os.makedirs(location, exist_ok=True)
+
+        # Keep the count arrays of other dtypes/storages if the cache already matches the input file
+        dtypes, sparse_dtypes = [], []
+        try:
+            with open(meta_file, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == CACHE_VERSION and meta.get("fingerprint") == fingerprint:
+                dtypes = meta.get("dtypes", [])
+                sparse_dtypes = meta.get("sparse_dtypes", [])
+        except (OSError, ValueError):
+            pass
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+
+        names_file = os.path.join(location, "names.json")
+        with open(names_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"tissues": matrix.tissues, "genes": matrix.genes}, f)
+        os.replace(names_file + ".tmp", names_file)
+
+        if isinstance(matrix, SparseCountMatrix):
+            save_array(os.path.join(location, "csr-indptr.npy"), matrix.indptr)
+            save_array(os.path.join(location, "csr-indices.npy"), matrix.indices)
+            save_array(os.path.join(location, f"csr-values-{matrix.dtype.name}.npy"), matrix.values)
+            sparse_dtypes = set(sparse_dtypes) | {matrix.dtype.name}
+        else:
+            save_array(os.path.join(location, f"counts-{matrix.dtype.name}.npy"), matrix.counts)
+            dtypes = set(dtypes) | {matrix.dtype.name}
+
+        meta = {
+            "version": CACHE_VERSION,
+            "fingerprint": fingerprint,
+            "shape": [matrix.n_genes, matrix.n_tissues],
+            "dtypes": sorted(dtypes),
+            "sparse_dtypes": sorted(sparse_dtypes),
+        }
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    except OSError:
+        return None
+
+    return location
+
+def clear_cache(path, cache_dir=None):
+
+    """
+    Remove the cache of an input file, if any.
+    """
+
+    shutil.rmtree(cache_location(path, cache_dir), ignore_errors=True)
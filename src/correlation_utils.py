@@ -0,0 +1,340 @@
+"""
+Tissue-by-tissue correlation of the counts of a gene expression matrix, and hierarchical clustering of the tissues.
+
+Pearson correlation
+-------------------
+The correlation of two tissues/cells (columns) is the normalized dot product of their centered counts over all genes.
+The matrix of all the dot products is accumulated block of rows by block of rows :
+each block of genes is centered with the column means and multiplied by itself (X_b^T X_b, a BLAS matrix product),
+so memory stays bounded by one block of rows and the (tissues x tissues) result, whatever the number of genes.
+With thousands of tissues/cells, the result is computed tile by tile (blocks of columns) and the
+tiles are distributed over a pool of threads (NumPy releases the GIL in the matrix products).
+
+Spearman correlation
+--------------------
+Pearson correlation of the ranks of the counts of each tissue/cell (ties get their average rank).
+Ranks are computed by blocks of columns into a temporary memory-mapped file, so the ranked matrix is not held in memory.
+
+Clustering
+----------
+Tissues/cells are grouped by average-linkage agglomerative clustering on the distance 1 - r,
+whose leaf order is used to draw the clustered heatmap (see plotting.correlation_heatmap_spec).
+
+Example
+-------
+correlation = tissue_correlation(matrix, method="spearman", workers=4)
+correlation.values, correlation.order, correlation.most_correlated(10)
+
+The concurrent.futures module provides the thread pool and the tempfile module the temporary file of the ranks.
+"""
+
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from matrix_utils import CountMatrix, SparseCountMatrix
+from stats_utils import top_k_indices
+
+# Correlation methods
+METHODS = ("pearson", "spearman")
+
+# Default number of genes (rows) per block and of tissues/cells (columns) per tile
+BLOCK_ROWS = 4096
+BLOCK_COLUMNS = 1024
+
+def dense_rows(matrix, start, end, dtype=np.float64):
+
+    """
+    Rows [start, end) of a CountMatrix or SparseCountMatrix as a dense array.
+    """
+
+    if isinstance(matrix, SparseCountMatrix):
+        low, high = matrix.indptr[start], matrix.indptr[end]
+        block = np.zeros((end - start, matrix.n_tissues), dtype=dtype)
+        block[np.repeat(np.arange(end - start), np.diff(matrix.indptr[start:end + 1])),
+              matrix.indices[low:high]] = matrix.values[low:high]
+        return block
+    if isinstance(matrix, CountMatrix):
+        return np.asarray(matrix.counts[start:end], dtype=dtype)
+    raise TypeError(f"Expected a CountMatrix or SparseCountMatrix, got {type(matrix).__name__}")
+
+# ---------------------------------------------------------------------
+# PART 1 : Ranks (Spearman)
+# ---------------------------------------------------------------------
+
+def average_ranks(block):
+
+    """
+    Rank the values of each column of a 2-D array (1 = smallest), ties getting their average rank.
+    """
+
+    # Columns are ranked as contiguous rows ; ties are averaged, so the sort need not be stable
+    rows = np.ascontiguousarray(block.T)
+    n = rows.shape[1]
+    order = np.argsort(rows, axis=1)
+    ordered = np.take_along_axis(rows, order, axis=1)
+
+    # Groups of equal values in each sorted row (a row always starts a new group) : average of ranks start+1..end
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    group_starts = np.flatnonzero(starts)
+    lengths = np.diff(np.append(group_starts, starts.size))
+    average = group_starts % n + (lengths + 1) / 2
+
+    ranks = np.empty(rows.shape, dtype=np.float64)
+    np.put_along_axis(ranks, order, np.repeat(average, lengths).reshape(rows.shape), axis=1)
+    return ranks.T
+
+def rank_matrix(matrix, directory=None, block_columns=256, workers=1):
+
+    """
+    Ranks of the counts of each tissue/cell, as a CountMatrix backed by a temporary memory-mapped float32 file
+    (ranks up to 2^24 are exact in float32). Blocks of columns are ranked by 'workers' threads.
+    """
+
+    f = tempfile.TemporaryFile(dir=directory)
+    ranks = np.memmap(f, dtype=np.float32, mode="w+", shape=(matrix.n_genes, max(matrix.n_tissues, 1)))
+    ranks = ranks[:, :matrix.n_tissues]
+
+    def rank_columns(start):
+        end = min(start + block_columns, matrix.n_tissues)
+        if isinstance(matrix, SparseCountMatrix):
+            columns = np.vstack([dense_rows(matrix, s, min(s + BLOCK_ROWS, matrix.n_genes))[:, start:end]
+                                 for s in range(0, matrix.n_genes, BLOCK_ROWS)] or [np.empty((0, end - start))])
+        else:
+            columns = matrix.counts[:, start:end]
+        ranks[:, start:end] = average_ranks(columns)
+
+    starts = range(0, matrix.n_tissues, block_columns)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(rank_columns, starts))
+    else:
+        for start in starts:
+            rank_columns(start)
+
+    return CountMatrix(matrix.tissues, matrix.genes, ranks)
+
+# ---------------------------------------------------------------------
+# PART 2 : Blocked correlation
+# ---------------------------------------------------------------------
+
+def column_means(matrix, block_rows=BLOCK_ROWS):
+    sums = np.zeros(matrix.n_tissues, dtype=np.float64)
+    for start in range(0, matrix.n_genes, block_rows):
+        sums += dense_rows(matrix, start, min(start + block_rows, matrix.n_genes)).sum(axis=0)
+    return sums / max(matrix.n_genes, 1)
+
+def tile_products(matrix, means, rows, columns, block_rows, dtype):
+
+    """
+    Sum over the blocks of genes in 'rows' of the products of the centered columns of two tiles.
+    """
+
+    (a, b), (c, d) = columns
+    product = np.zeros((b - a, d - c), dtype=np.float64)
+    for start, end in rows:
+        block = dense_rows(matrix, start, end)
+        left = (block[:, a:b] - means[a:b]).astype(dtype, copy=False)
+        right = left if (a, b) == (c, d) else (block[:, c:d] - means[c:d]).astype(dtype, copy=False)
+        product += left.T @ right
+    return product
+
+def centered_products(matrix, means, block_rows=BLOCK_ROWS, block_columns=BLOCK_COLUMNS, workers=1,
+                      dtype=np.float64):
+
+    """
+    (tissues x tissues) matrix of the dot products of the centered columns, accumulated by blocks of rows.
+
+    The upper tiles (blocks of columns) are computed independently, by 'workers' threads ;
+    with a single tile, the blocks of rows are split between the threads instead.
+    """
+
+    n_tissues = matrix.n_tissues
+    rows = [(start, min(start + block_rows, matrix.n_genes)) for start in range(0, matrix.n_genes, block_rows)]
+    spans = [(start, min(start + block_columns, n_tissues)) for start in range(0, n_tissues, block_columns)]
+    tiles = [(spans[i], spans[j]) for i in range(len(spans)) for j in range(i, len(spans))]
+    products = np.zeros((n_tissues, n_tissues), dtype=np.float64)
+
+    if len(tiles) == 1 and workers > 1:
+        # One tile : each thread accumulates its own share of the blocks of rows
+        tasks = [(rows[k::workers], tiles[0]) for k in range(workers)]
+    else:
+        tasks = [(rows, tile) for tile in tiles]
+
+    def run(task):
+        task_rows, tile = task
+        return tile, tile_products(matrix, means, task_rows, tile, block_rows, dtype)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, tasks))
+    else:
+        results = [run(task) for task in tasks]
+
+    for ((a, b), (c, d)), product in results:
+        products[a:b, c:d] += product
+        if (a, b) != (c, d):
+            products[c:d, a:b] += product.T
+
+    return products
+
+class CorrelationResult:
+
+    """
+    Tissue-by-tissue correlation matrix and hierarchical clustering of the tissues/cells.
+
+    Attributes
+    ----------
+    - tissues : list[str]
+    - values : numpy.ndarray (float64), shape (n, n)
+      Correlation of each pair of tissues/cells (NaN when a tissue/cell has constant counts)
+    - method : str
+      "pearson" or "spearman"
+    - linkage : numpy.ndarray of shape (n - 1, 4)
+      Merges of the clustering : (cluster a, cluster b, distance, size), as in scipy.cluster.hierarchy
+    - order : numpy.ndarray (int)
+      Leaf order of the clustering : order of the rows and columns of the clustered heatmap
+    """
+
+    def __init__(self, tissues, values, method, linkage=None, order=None):
+        self.tissues = list(tissues)
+        self.values = values
+        self.method = method
+        if linkage is None:
+            linkage = average_linkage(1 - np.nan_to_num(values, nan=0.0))
+        self.linkage = linkage
+        self.order = leaf_order(linkage, len(self.tissues)) if order is None else order
+
+    def clustered(self):
+
+        """
+        Returns
+        -------
+        tuple: (tissues, values) with rows and columns in the leaf order of the clustering
+        """
+
+        return [self.tissues[i] for i in self.order], self.values[np.ix_(self.order, self.order)]
+
+    def most_correlated(self, n=10):
+
+        """
+        list[tuple[str, str, float]] : The 'n' most correlated pairs of distinct tissues/cells, in decreasing order.
+        """
+
+        rows, columns = np.triu_indices(len(self.tissues), k=1)
+        values = self.values[rows, columns]
+        defined = np.flatnonzero(~np.isnan(values))
+        best = defined[top_k_indices(values[defined], n)]
+        return [(self.tissues[rows[i]], self.tissues[columns[i]], float(values[i])) for i in best]
+
+    def __repr__(self):
+        return f"CorrelationResult(tissues={len(self.tissues)}, method={self.method})"
+
+def tissue_correlation(matrix, method="pearson", block_rows=BLOCK_ROWS, block_columns=BLOCK_COLUMNS, workers=1,
+                       dtype="float64", temp_dir=None):
+
+    """
+    Correlation of every pair of tissues/cells over the genes of a CountMatrix or SparseCountMatrix.
+
+    Parameters
+    ----------
+    - method : "pearson" or "spearman"
+    - block_rows, block_columns : int
+      Number of genes per block of rows and of tissues/cells per tile : memory holds one block of rows
+      and the result
+    - workers : int
+      Number of threads
+    - dtype : str
+      Precision of the matrix products ("float32" is about twice as fast ; sums are always kept in float64)
+    - temp_dir : str or None
+      Directory of the temporary file of the ranks (Spearman)
+
+    Returns
+    -------
+    CorrelationResult
+    """
+
+    if method not in METHODS:
+        raise ValueError(f"Unknown correlation method: {method} (expected one of {', '.join(METHODS)})")
+
+    if method == "spearman":
+        matrix = rank_matrix(matrix, temp_dir, workers=max(workers, 1))
+        # Mean rank of a column of n values
+        means = np.full(matrix.n_tissues, (matrix.n_genes + 1) / 2)
+    else:
+        means = column_means(matrix, block_rows)
+
+    products = centered_products(matrix, means, block_rows, block_columns, max(workers, 1), np.dtype(dtype))
+
+    norms = np.sqrt(np.diag(products))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = products / np.outer(norms, norms)
+    np.clip(values, -1.0, 1.0, out=values)
+    values[np.arange(len(norms)), np.arange(len(norms))] = np.where(norms > 0, 1.0, np.nan)
+
+    return CorrelationResult(matrix.tissues, values, method)
+
+# ---------------------------------------------------------------------
+# PART 3 : Hierarchical clustering
+# ---------------------------------------------------------------------
+
+def average_linkage(distances):
+
+    """
+    Average-linkage agglomerative clustering of a symmetric distance matrix.
+
+    At each step the two closest clusters are merged ; the distance of the new cluster to another one
+    is the size-weighted average of the distances of its two parts (UPGMA).
+
+    Returns
+    -------
+    numpy.ndarray of shape (n - 1, 4) : (cluster a, cluster b, distance, size) of each merge ; clusters 0..n-1
+    are the leaves, cluster n + i is the one created by merge i
+    """
+
+    n = len(distances)
+    linkage = np.zeros((max(n - 1, 0), 4), dtype=np.float64)
+    if n < 2:
+        return linkage
+
+    d = np.array(distances, dtype=np.float64)
+    np.fill_diagonal(d, np.inf)
+    sizes = np.ones(n)
+    ids = np.arange(n)
+
+    for step in range(n - 1):
+        a, b = np.unravel_index(np.argmin(d), d.shape)
+        a, b = min(a, b), max(a, b)
+        linkage[step] = (min(ids[a], ids[b]), max(ids[a], ids[b]), d[a, b], sizes[a] + sizes[b])
+
+        # The merged cluster takes slot a, slot b is removed
+        merged = (sizes[a] * d[a] + sizes[b] * d[b]) / (sizes[a] + sizes[b])
+        d[a], d[:, a] = merged, merged
+        d[a, a] = np.inf
+        d[b], d[:, b] = np.inf, np.inf
+        sizes[a] += sizes[b]
+        ids[a] = n + step
+
+    return linkage
+
+def leaf_order(linkage, n):
+
+    """
+    Order of the leaves of a clustering (left to right in its dendrogram).
+    """
+
+    if n < 2:
+        return np.arange(n)
+
+    children = {n + i: (int(a), int(b)) for i, (a, b, _, _) in enumerate(linkage)}
+    order, stack = [], [n + len(linkage) - 1]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            order.append(node)
+        else:
+            left, right = children[node]
+            stack.extend((right, left))
+    return np.array(order, dtype=np.intp)
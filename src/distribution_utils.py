@@ -0,0 +1,512 @@
+"""
+One-pass distribution statistics of the counts of each gene and of each tissue/cell.
+
+For quality control, 'stats_utils' totals are completed by, on both axes:
+- mean and variance (population variance, ddof=0) and standard deviation
+- detection rate (fraction of nonzero counts)
+- minimum and maximum
+- quantiles (by default the quartiles)
+
+Everything is computed in a single traversal of the matrix, block of rows by block of rows,
+from an in-memory CountMatrix / SparseCountMatrix or from the row stream of 'stream_matrix':
+
+- Per gene : all the counts of a gene arrive together (one row), so its statistics are exact
+  (two-pass mean/variance and exact quantiles within the row).
+- Per tissue/cell : counts arrive one block of rows at a time. Means and variances are updated with
+  numerically stable accumulators (Welford / Chan : the mean and the sum of squared deviations of each block
+  are merged into the running ones, no sum of squares is ever subtracted), and quantiles come from a
+  log-bucket sketch (QuantileSketch, relative accuracy 1 % by default).
+
+Partial results computed on separate chunks of rows (e.g. by worker processes) are combined with 'merge' :
+bucket counts, detection counts, extremes and per-gene statistics merge exactly (the merged sketch is the sketch
+of all the rows, whatever the chunking), and means/variances with Chan's pairwise formula.
+
+Example
+-------
+stats = compute_distribution(matrix).result()
+stats.tissues["mean"], stats.tissues["quantiles"]      # arrays aligned with stats.tissue_names
+
+tissues, rows = stream_matrix(path)
+stats = DistributionStats(tissues).consume(rows).result()
+
+The math module gives the bucket boundaries of the quantile sketch.
+"""
+
+import math
+
+import numpy as np
+
+from matrix_utils import CountMatrix, SparseCountMatrix
+
+# Default quantiles (quartiles)
+QUANTILES = (0.25, 0.5, 0.75)
+
+# Default relative accuracy of the tissue/cell quantile sketches
+RELATIVE_ACCURACY = 0.01
+
+# Number of streamed rows accumulated before a block is processed
+BLOCK_ROWS = 4096
+
+# ---------------------------------------------------------------------
+# PART 1 : Mergeable quantile sketch
+# ---------------------------------------------------------------------
+
+class QuantileSketch:
+
+    """
+    Approximate quantiles of several columns of values, with a bounded relative error.
+
+    Values are counted in logarithmic buckets : bucket k holds the values in (gamma^(k-1), gamma^k],
+    with gamma = (1 + accuracy) / (1 - accuracy), and is represented by a value within 'accuracy' (relative) of
+    all of them. Zeros are counted exactly, negative values in mirrored buckets.
+
+    Sketches of the same columns and accuracy merge by adding their bucket counts : the result
+    does not depend on how the values were split between sketches.
+
+    Attributes
+    ----------
+    - n_columns : int
+    - accuracy : float
+    - count : numpy.ndarray (int64), number of values of each column
+    - zeros : numpy.ndarray (int64), number of zeros of each column
+    """
+
+    def __init__(self, n_columns, accuracy=RELATIVE_ACCURACY):
+        if not 0 < accuracy < 1:
+            raise ValueError("Relative accuracy must be between 0 and 1")
+
+        self.n_columns = n_columns
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.zeros = np.zeros(n_columns, dtype=np.int64)
+
+        # Bucket counts of the positive and (negated) negative values : (n_columns, width) arrays
+        # whose first column is bucket 'offset'
+        self._buckets = {"positive": None, "negative": None}
+        self._offsets = {"positive": 0, "negative": 0}
+
+    def _keys(self, values):
+        return np.ceil(np.log(values) / math.log(self.gamma)).astype(np.int64)
+
+    def _grow(self, sign, low, high):
+
+        # Extend the bucket range of one sign to [low, high]
+        buckets, offset = self._buckets[sign], self._offsets[sign]
+        if buckets is None:
+            self._buckets[sign] = np.zeros((self.n_columns, high - low + 1), dtype=np.int64)
+            self._offsets[sign] = low
+            return
+
+        start, end = min(low, offset), max(high, offset + buckets.shape[1] - 1)
+        if start == offset and end == offset + buckets.shape[1] - 1:
+            return
+
+        grown = np.zeros((self.n_columns, end - start + 1), dtype=np.int64)
+        grown[:, offset - start:offset - start + buckets.shape[1]] = buckets
+        self._buckets[sign], self._offsets[sign] = grown, start
+
+    def _add_keys(self, sign, columns, keys):
+        if not len(keys):
+            return
+
+        self._grow(sign, int(keys.min()), int(keys.max()))
+        buckets = self._buckets[sign]
+        flat = columns * buckets.shape[1] + (keys - self._offsets[sign])
+        buckets += np.bincount(flat, minlength=buckets.size).reshape(buckets.shape)
+
+    def add_values(self, n_rows, columns, values):
+
+        """
+        Add the nonzero values of 'n_rows' rows, given by their columns ; every other cell of these rows is a zero.
+        """
+
+        columns = np.asarray(columns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if np.isnan(values).any():
+            raise ValueError("Cannot sketch NaN values")
+
+        nonzero = np.bincount(columns, minlength=self.n_columns)
+        self.count += n_rows
+        self.zeros += n_rows - nonzero
+
+        positive = values > 0
+        self._add_keys("positive", columns[positive], self._keys(values[positive]))
+        self._add_keys("negative", columns[~positive], self._keys(-values[~positive]))
+
+    def add_block(self, block):
+
+        """
+        Add a dense block of rows, of shape (rows, n_columns).
+        """
+
+        rows, columns = np.nonzero(block)
+        self.add_values(block.shape[0], columns, block[rows, columns])
+
+    def merge(self, other):
+
+        """
+        Add the values of another sketch of the same columns and accuracy.
+        """
+
+        if other.n_columns != self.n_columns or other.accuracy != self.accuracy:
+            raise ValueError("Only sketches of the same columns and accuracy can be merged")
+
+        self.count += other.count
+        self.zeros += other.zeros
+        for sign, buckets in other._buckets.items():
+            if buckets is None:
+                continue
+            offset = other._offsets[sign]
+            self._grow(sign, offset, offset + buckets.shape[1] - 1)
+            start = offset - self._offsets[sign]
+            self._buckets[sign][:, start:start + buckets.shape[1]] += buckets
+        return self
+
+    def quantiles(self, q=QUANTILES):
+
+        """
+        Approximate quantiles of every column.
+
+        The q-quantile is the value of rank q * (count - 1) in sorted order (lower rank), returned as the
+        representative value of its bucket (exact for zeros).
+
+        Returns
+        -------
+        numpy.ndarray of shape (n_columns, len(q)) : NaN for the columns without values
+        """
+
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if ((q < 0) | (q > 1)).any():
+            raise ValueError("Quantiles must be between 0 and 1")
+
+        # Buckets in increasing order of value : negative (reversed), zero, positive
+        parts, values = [], []
+        for sign in ("negative", "positive"):
+            buckets = self._buckets[sign]
+            if buckets is None:
+                buckets = np.zeros((self.n_columns, 0), dtype=np.int64)
+            keys = np.arange(buckets.shape[1]) + self._offsets[sign]
+            representative = 2 * self.gamma ** keys / (self.gamma + 1)
+            if sign == "negative":
+                parts.append(buckets[:, ::-1])
+                values.append(-representative[::-1])
+                parts.append(self.zeros[:, None])
+                values.append(np.zeros(1))
+            else:
+                parts.append(buckets)
+                values.append(representative)
+
+        cumulative = np.cumsum(np.hstack(parts), axis=1)
+        values = np.concatenate(values)
+
+        result = np.full((self.n_columns, len(q)), np.nan)
+        filled = self.count > 0
+        for j, quantile in enumerate(q):
+            ranks = np.floor(quantile * (self.count - 1))
+            # First bucket whose cumulative count exceeds the rank
+            position = (cumulative <= ranks[:, None]).sum(axis=1)
+            result[filled, j] = values[position[filled]]
+        return result
+
+# ---------------------------------------------------------------------
+# PART 2 : One-pass accumulator
+# ---------------------------------------------------------------------
+
+class DistributionResult:
+
+    """
+    Distribution statistics of the genes and of the tissues/cells of a matrix.
+
+    Attributes
+    ----------
+    - gene_names, tissue_names : list[str]
+    - quantile_levels : tuple[float]
+    - genes, tissues : dict[str, numpy.ndarray]
+      Statistics aligned with the names : "mean", "var", "std", "detection", "min", "max" (float64 arrays)
+      and "quantiles" (array of shape (n, len(quantile_levels)))
+    """
+
+    def __init__(self, gene_names, tissue_names, genes, tissues, quantile_levels=QUANTILES):
+        self.gene_names = list(gene_names)
+        self.tissue_names = list(tissue_names)
+        self.genes = genes
+        self.tissues = tissues
+        self.quantile_levels = tuple(quantile_levels)
+
+    def _rows(self, axis):
+        names, stats = (self.gene_names, self.genes) if axis == "genes" else (self.tissue_names, self.tissues)
+        for i, name in enumerate(names):
+            row = {"name": name}
+            for key in ("mean", "var", "std", "detection", "min", "max"):
+                row[key] = float(stats[key][i])
+            row["quantiles"] = dict(zip((f"{q:g}" for q in self.quantile_levels), stats["quantiles"][i].tolist()))
+            yield row
+
+    def to_dict(self):
+
+        """
+        Returns
+        -------
+        dict : {"quantile_levels": [...], "genes": [row, ...], "tissues": [row, ...]}, one row per gene or tissue/cell
+        """
+
+        return {
+            "quantile_levels": list(self.quantile_levels),
+            "genes": list(self._rows("genes")),
+            "tissues": list(self._rows("tissues")),
+        }
+
+    def __repr__(self):
+        return f"DistributionResult(genes={len(self.gene_names)}, tissues={len(self.tissue_names)})"
+
+class DistributionStats:
+
+    """
+    Single-pass accumulator of the distribution statistics of genes and tissues/cells.
+
+    Rows are added by blocks (dense or CSR) or one by one (buffered into blocks of BLOCK_ROWS rows).
+    Accumulators of disjoint sets of genes merge with 'merge'.
+
+    Example
+    -------
+    tissues, rows = stream_matrix(path)
+    stats = DistributionStats(tissues).consume(rows).result()
+    """
+
+    def __init__(self, tissues, quantiles=QUANTILES, accuracy=RELATIVE_ACCURACY):
+        self.tissue_names = list(tissues)
+        self.quantile_levels = tuple(quantiles)
+        n_tissues = len(self.tissue_names)
+
+        # Per tissue/cell : Welford/Chan accumulators, detection counts, extremes and quantile sketch
+        self.n = 0
+        self.mean = np.zeros(n_tissues, dtype=np.float64)
+        self.m2 = np.zeros(n_tissues, dtype=np.float64)
+        self.nonzero = np.zeros(n_tissues, dtype=np.int64)
+        self.min = np.full(n_tissues, np.inf)
+        self.max = np.full(n_tissues, -np.inf)
+        self.sketch = QuantileSketch(n_tissues, accuracy)
+
+        # Per gene : exact statistics of each block of rows
+        self.gene_names = []
+        self._gene_blocks = []
+        self._pending = ([], [])
+
+    @property
+    def n_genes(self):
+        return len(self.gene_names) + len(self._pending[0])
+
+    def _update_tissues(self, n_rows, block_mean, block_m2):
+
+        # Chan et al. : combine (n, mean, M2) of the running values and of the block
+        total = self.n + n_rows
+        delta = block_mean - self.mean
+        self.mean += delta * (n_rows / total)
+        self.m2 += block_m2 + delta ** 2 * (self.n * n_rows / total)
+        self.n = total
+
+    def add_block(self, genes, block):
+
+        """
+        Add a dense block of count rows, of shape (len(genes), n_tissues).
+        """
+
+        self._flush()
+        self._add_dense(list(genes), np.asarray(block, dtype=np.float64))
+        return self
+
+    def _add_dense(self, genes, block):
+        if block.ndim != 2 or block.shape != (len(genes), len(self.tissue_names)):
+            raise ValueError("Counts length does not match number of tissues/cells")
+        if not len(genes):
+            return
+
+        block_mean = block.mean(axis=0)
+        self._update_tissues(len(genes), block_mean, ((block - block_mean) ** 2).sum(axis=0))
+        self.nonzero += np.count_nonzero(block, axis=0)
+        np.minimum(self.min, block.min(axis=0), out=self.min)
+        np.maximum(self.max, block.max(axis=0), out=self.max)
+        self.sketch.add_block(block)
+        self._add_genes(genes, block)
+
+    def _add_genes(self, genes, block):
+
+        # Each row holds all the counts of its gene : exact statistics
+        n_tissues = block.shape[1]
+        self.gene_names += genes
+        if not n_tissues:
+            undefined = np.full(len(genes), np.nan)
+            self._gene_blocks.append({"mean": undefined, "var": undefined, "detection": undefined,
+                                      "min": undefined, "max": undefined,
+                                      "quantiles": np.full((len(genes), len(self.quantile_levels)), np.nan)})
+            return
+
+        self._gene_blocks.append({
+            "mean": block.mean(axis=1),
+            "var": block.var(axis=1),
+            "detection": np.count_nonzero(block, axis=1) / n_tissues,
+            "min": block.min(axis=1),
+            "max": block.max(axis=1),
+            "quantiles": np.quantile(block, self.quantile_levels, axis=1, method="lower").T.reshape(len(genes), -1),
+        })
+
+    def add_sparse_block(self, genes, indptr, indices, values):
+
+        """
+        Add a block of count rows in CSR layout (see matrix_utils.SparseCountMatrix) : only the nonzero
+        counts are read for the tissue/cell statistics, each row is made dense for its gene statistics.
+        """
+
+        self._flush()
+        genes = list(genes)
+        indptr = np.asarray(indptr, dtype=np.int64) - indptr[0]
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        n_rows, n_tissues = len(genes), len(self.tissue_names)
+        if not n_rows:
+            return self
+
+        # Tissue/cell moments of the block from the nonzero counts : the zeros add n_zero * mean^2 to M2
+        nonzero = np.bincount(indices, minlength=n_tissues)
+        block_mean = np.bincount(indices, weights=values, minlength=n_tissues) / n_rows
+        block_m2 = (np.bincount(indices, weights=(values - block_mean[indices]) ** 2, minlength=n_tissues)
+                    + (n_rows - nonzero) * block_mean ** 2)
+        self._update_tissues(n_rows, block_mean, block_m2)
+        self.nonzero += nonzero
+
+        has_zero = nonzero < n_rows
+        block_min = np.full(n_tissues, np.inf)
+        block_max = np.full(n_tissues, -np.inf)
+        np.minimum.at(block_min, indices, values)
+        np.maximum.at(block_max, indices, values)
+        block_min[has_zero] = np.minimum(block_min[has_zero], 0.0)
+        block_max[has_zero] = np.maximum(block_max[has_zero], 0.0)
+        np.minimum(self.min, block_min, out=self.min)
+        np.maximum(self.max, block_max, out=self.max)
+        self.sketch.add_values(n_rows, indices, values)
+
+        # Gene statistics on the dense rows of the block
+        dense = np.zeros((n_rows, n_tissues), dtype=np.float64)
+        dense[np.repeat(np.arange(n_rows), np.diff(indptr)), indices] = values
+        self._add_genes(genes, dense)
+        return self
+
+    def add(self, gene, counts):
+
+        """
+        Add one count row ; rows are processed by blocks of BLOCK_ROWS.
+        """
+
+        if len(counts) != len(self.tissue_names):
+            raise ValueError("Counts length does not match number of tissues/cells")
+
+        genes, rows = self._pending
+        genes.append(gene)
+        rows.append(counts)
+        if len(genes) >= BLOCK_ROWS:
+            self._flush()
+        return self
+
+    def _flush(self):
+        genes, rows = self._pending
+        if genes:
+            self._pending = ([], [])
+            self._add_dense(genes, np.array(rows, dtype=np.float64).reshape(len(genes), len(self.tissue_names)))
+
+    def consume(self, rows):
+
+        """
+        Add every (gene, counts) pair of an iterable (typically the generator returned by 'stream_matrix').
+        """
+
+        for gene, counts in rows:
+            self.add(gene, counts)
+        self._flush()
+        return self
+
+    def merge(self, other):
+
+        """
+        Add the statistics of another accumulator (same tissues/cells and options, other genes).
+
+        Genes of 'other' are placed after the genes of this accumulator.
+        """
+
+        if (other.tissue_names != self.tissue_names or other.quantile_levels != self.quantile_levels):
+            raise ValueError("Only statistics of the same tissues/cells and quantiles can be merged")
+
+        self._flush()
+        other._flush()
+        if other.n:
+            self._update_tissues(other.n, other.mean, other.m2)
+        self.nonzero += other.nonzero
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self.sketch.merge(other.sketch)
+        self.gene_names += other.gene_names
+        self._gene_blocks += other._gene_blocks
+        return self
+
+    def result(self):
+
+        """
+        Returns
+        -------
+        DistributionResult
+        """
+
+        self._flush()
+        n_levels = len(self.quantile_levels)
+
+        genes = {}
+        for key in ("mean", "var", "detection", "min", "max"):
+            genes[key] = (np.concatenate([block[key] for block in self._gene_blocks]) if self._gene_blocks
+                          else np.empty(0))
+        genes["quantiles"] = (np.vstack([block["quantiles"] for block in self._gene_blocks]) if self._gene_blocks
+                              else np.empty((0, n_levels)))
+        genes["std"] = np.sqrt(genes["var"])
+
+        empty = self.n == 0
+        tissues = {
+            "mean": np.full_like(self.mean, np.nan) if empty else self.mean.copy(),
+            "var": np.full_like(self.m2, np.nan) if empty else self.m2 / self.n,
+            "detection": np.full(len(self.tissue_names), np.nan) if empty else self.nonzero / self.n,
+            "min": np.where(empty, np.nan, self.min),
+            "max": np.where(empty, np.nan, self.max),
+            "quantiles": self.sketch.quantiles(self.quantile_levels),
+        }
+        tissues["std"] = np.sqrt(tissues["var"])
+
+        return DistributionResult(self.gene_names, self.tissue_names, genes, tissues, self.quantile_levels)
+
+# ---------------------------------------------------------------------
+# PART 3 : In-memory matrices
+# ---------------------------------------------------------------------
+
+def compute_distribution(matrix, quantiles=QUANTILES, accuracy=RELATIVE_ACCURACY, block_rows=BLOCK_ROWS):
+
+    """
+    Distribution statistics of a CountMatrix or SparseCountMatrix, in one traversal by blocks of rows
+    (a memory-mapped count array is never fully loaded, a sparse matrix is never made dense).
+
+    Returns
+    -------
+    DistributionStats : accumulator holding the statistics ('result()' gives the DistributionResult) ;
+    it can be merged with the accumulators of other matrices with the same tissues/cells
+    """
+
+    stats = DistributionStats(matrix.tissues, quantiles, accuracy)
+
+    for start in range(0, matrix.n_genes, block_rows):
+        genes = matrix.genes[start:start + block_rows]
+        if isinstance(matrix, SparseCountMatrix):
+            low, high = matrix.indptr[start], matrix.indptr[start + len(genes)]
+            stats.add_sparse_block(genes, matrix.indptr[start:start + len(genes) + 1],
+                                   matrix.indices[low:high], matrix.values[low:high])
+        elif isinstance(matrix, CountMatrix):
+            stats.add_block(genes, matrix.counts[start:start + block_rows])
+        else:
+            raise TypeError(f"Expected a CountMatrix or SparseCountMatrix, got {type(matrix).__name__}")
+
+    return stats
@@ -0,0 +1,387 @@
+"""
+Random access to the count rows of a matrix file through a gene index.
+
+Reading the counts of a few genes with 'load_matrix' requires a scan of the whole file.
+A gene index records, for each gene, the offset of its 'count' row in the (uncompressed) file,
+so that 'get_gene' / 'get_genes' can seek directly to the requested rows:
+
+- plain .tsv           : the offset is a byte offset in the file (seek + readline)
+- block-gzipped (BGZF) : the index also stores the access points of the file (compressed offset and
+                         uncompressed start of each block) : only the blocks holding the rows are decompressed
+- plain gzip .tsv.gz   : a gzip stream cannot be entered in the middle, so rows are read in offset order
+                         in a single forward pass that skips (decompresses without parsing) everything else ;
+                         convert the file to BGZF (parallel_utils.bgzf_compress) for true random access
+
+The index is stored next to the binary cache of the file (see cache_utils):
+
+    data/ARCHS4.tsv.cache/
+        gene_index.json      size and mtime of the indexed file, tissues/cells, genes (sorted) and offsets
+
+It is rebuilt automatically when the size or modification time of the file changes.
+Genes are kept sorted, so names sharing a prefix (e.g. "MT-") are found with a binary search.
+
+Example
+-------
+counts = get_gene("data/ARCHS4.tsv.gz", "TP53")                 # array, one value per tissue/cell
+matrix = get_genes("data/ARCHS4.tsv.gz", ["TP53", "BRCA1"])      # CountMatrix of the requested genes
+matrix = get_genes("data/ARCHS4.tsv.gz", prefix="MT-")           # every gene whose name starts with "MT-"
+
+The bisect module is used for the sorted lookups and the json module to store the index.
+"""
+
+import bisect
+import gzip
+import json
+import os
+import zlib
+
+import numpy as np
+
+from cache_utils import cache_location
+from io_utils import is_gzip, parse_counts, parse_header
+from matrix_utils import CountMatrix, resolve_dtype
+from parallel_utils import bgzf_blocks, is_bgzf
+
+# Version of the index layout
+INDEX_VERSION = 2
+
+# Name of the index file in the cache directory of the matrix file
+INDEX_NAME = "gene_index.json"
+
+class GeneIndex:
+
+    """
+    Offsets of the 'count' rows of a matrix file.
+
+    Attributes
+    ----------
+    - path : str
+      Indexed file
+    - kind : str
+      "plain", "gzip" or "bgzf"
+    - tissues : list[str]
+    - genes : list[str]
+      Gene names, sorted
+    - offsets : list[int]
+      Offset of the 'count' row of each gene in the uncompressed file, aligned with 'genes'
+    - blocks : list[tuple[int, int]] or None
+      For BGZF files, (compressed offset, uncompressed start) of each block
+    """
+
+    def __init__(self, path, kind, tissues, genes, offsets, blocks=None, size=None, mtime_ns=None):
+        self.path = path
+        self.kind = kind
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.offsets = list(offsets)
+        self.blocks = [tuple(block) for block in blocks] if blocks is not None else None
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self._positions = {gene: i for i, gene in enumerate(self.genes)}
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __contains__(self, gene):
+        return gene in self._positions
+
+    def offset(self, gene):
+
+        """
+        Offset of the 'count' row of a gene (KeyError if the gene is not in the file).
+        """
+
+        return self.offsets[self._positions[gene]]
+
+    def with_prefix(self, prefix):
+
+        """
+        Sorted list of the genes whose name starts with 'prefix'.
+        """
+
+        start = bisect.bisect_left(self.genes, prefix)
+        end = start
+        while end < len(self.genes) and self.genes[end].startswith(prefix):
+            end += 1
+        return self.genes[start:end]
+
+    def is_valid(self):
+
+        """
+        True if the indexed file has not changed (same size and modification time).
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "kind": self.kind,
+            "tissues": self.tissues,
+            "genes": self.genes,
+            "offsets": self.offsets,
+            "blocks": self.blocks,
+        }
+
+    def __repr__(self):
+        return f"GeneIndex({self.path!r}, kind={self.kind}, genes={len(self.genes)})"
+
+# ---------------------------------------------------------------------
+# PART 1 : Building, storing and loading the index
+# ---------------------------------------------------------------------
+
+def file_kind(path):
+    if not is_gzip(path):
+        return "plain"
+    return "bgzf" if is_bgzf(path) else "gzip"
+
+def bgzf_access_points(path):
+
+    """
+    (compressed offset, uncompressed start) of every block of a BGZF file.
+
+    The uncompressed size of each block is read from its gzip trailer, nothing is decompressed.
+    """
+
+    points = []
+    start = 0
+
+    with open(path, "rb") as f:
+        for offset, size in bgzf_blocks(path):
+            points.append((offset, start))
+            f.seek(offset + size - 4)
+            start += int.from_bytes(f.read(4), "little")
+
+    return points
+
+def build_gene_index(path):
+
+    """
+    Scan a matrix file once and record the offset of the 'count' row of each gene.
+
+    If a gene has several 'count' rows, the last one is kept (as in 'load_matrix').
+
+    Returns
+    -------
+    GeneIndex
+    """
+
+    stat = os.stat(path)
+    kind = file_kind(path)
+    opener = open if kind == "plain" else gzip.open
+    offsets = {}
+
+    with opener(path, "rb") as f:
+        # Same header normalization as the serial loader (CRLF line endings removed)
+        header = f.readline()
+        tissues = parse_header(header.decode("utf-8"))
+        offset = len(header)
+
+        for line in f:
+            # Same test of the stat field as io_utils.iter_stat_rows, on bytes
+            first = line.find(b"\t")
+            second = line.find(b"\t", first + 1) if first >= 0 else -1
+            if second >= 0 and line[first + 1:second].strip() == b"count":
+                offsets[line[:first].decode("utf-8")] = offset
+            offset += len(line)
+
+    genes = sorted(offsets)
+    blocks = bgzf_access_points(path) if kind == "bgzf" else None
+    return GeneIndex(path, kind, tissues, genes, [offsets[gene] for gene in genes], blocks,
+                     size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+def write_gene_index(index, cache_dir=None):
+
+    """
+    Store an index in the cache directory of its file (see cache_utils.cache_location).
+
+    Returns
+    -------
+    str or None : path of the index file, or None if it could not be written (read-only directory)
+    """
+
+    location = cache_location(index.path, cache_dir)
+    index_file = os.path.join(location, INDEX_NAME)
+
+    try:
+        os.makedirs(location, exist_ok=True)
+        with open(index_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(index_file + ".tmp", index_file)
+    except OSError:
+        return None
+
+    return index_file
+
+def read_gene_index(path, cache_dir=None):
+
+    """
+    Read the stored index of a file.
+
+    Returns
+    -------
+    GeneIndex or None : None if there is no index or if the file changed since it was indexed
+    """
+
+    try:
+        with open(os.path.join(cache_location(path, cache_dir), INDEX_NAME), encoding="utf-8") as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if content.get("version") != INDEX_VERSION:
+        return None
+
+    index = GeneIndex(path, content["kind"], content["tissues"], content["genes"], content["offsets"],
+                      content["blocks"], size=content["size"], mtime_ns=content["mtime_ns"])
+    return index if index.is_valid() else None
+
+def load_gene_index(path, cache_dir=None, rebuild=False):
+
+    """
+    Return the index of a file, building and storing it if it is missing or out of date.
+    """
+
+    index = None if rebuild else read_gene_index(path, cache_dir)
+    if index is None:
+        index = build_gene_index(path)
+        write_gene_index(index, cache_dir)
+    return index
+
+# ---------------------------------------------------------------------
+# PART 2 : Reading rows at indexed offsets
+# ---------------------------------------------------------------------
+
+def read_plain_lines(path, offsets):
+    lines = {}
+    with open(path, "rb") as f:
+        for offset in sorted(set(offsets)):
+            f.seek(offset)
+            lines[offset] = f.readline()
+    return lines
+
+def read_gzip_lines(path, offsets):
+    # Forward pass : GzipFile.seek decompresses and discards the data before each offset
+    lines = {}
+    with gzip.open(path, "rb") as f:
+        for offset in sorted(set(offsets)):
+            f.seek(offset)
+            lines[offset] = f.readline()
+    return lines
+
+def read_bgzf_lines(path, offsets, blocks):
+    starts = [start for _, start in blocks]
+    cache = {}
+    lines = {}
+
+    def block_data(i, f):
+        # Decompressed blocks are kept for the other rows of the same lookup
+        if i not in cache:
+            offset = blocks[i][0]
+            end = blocks[i + 1][0] if i + 1 < len(blocks) else os.path.getsize(path)
+            f.seek(offset)
+            cache[i] = zlib.decompress(f.read(end - offset), 31)
+        return cache[i]
+
+    with open(path, "rb") as f:
+        for offset in sorted(set(offsets)):
+            i = bisect.bisect_right(starts, offset) - 1
+            data, start = block_data(i, f), offset - starts[i]
+            end = data.find(b"\n", start)
+
+            # The row may continue in the next blocks : only the blocks up to its newline are read
+            parts = []
+            while end < 0 and i + 1 < len(blocks):
+                parts.append(data[start:])
+                i += 1
+                data, start = block_data(i, f), 0
+                end = data.find(b"\n")
+            parts.append(data[start:end + 1] if end >= 0 else data[start:])
+            lines[offset] = b"".join(parts)
+
+    return lines
+
+def read_lines(index, offsets):
+
+    """
+    Read the lines starting at the given uncompressed offsets.
+
+    Returns
+    -------
+    dict[int, bytes] : Dictionary mapping each offset to its line
+    """
+
+    if index.kind == "plain":
+        return read_plain_lines(index.path, offsets)
+    if index.kind == "bgzf":
+        return read_bgzf_lines(index.path, offsets, index.blocks)
+    return read_gzip_lines(index.path, offsets)
+
+def parse_count_line(line, n_tissues):
+    parts = line.decode("utf-8").rstrip("\r\n").split("\t")
+    counts = parse_counts(parts[2:])
+    if len(counts) != n_tissues:
+        raise ValueError(f"Counts length does not match number of tissues/cells for gene {parts[0]}")
+    return counts
+
+# ---------------------------------------------------------------------
+# PART 3 : Gene lookups
+# ---------------------------------------------------------------------
+
+def get_genes(path, names=(), prefix=None, dtype="float64", cache_dir=None):
+
+    """
+    Read the counts of some genes without loading the whole matrix.
+
+    The gene index of the file is built on first use (one scan of the file) and reused afterwards.
+    Rows are read in file order, whatever the order of 'names'.
+
+    Parameters
+    ----------
+    - names : iterable of str
+      Names of the genes to read (KeyError if a gene is not in the file)
+    - prefix : str or None
+      Also read every gene whose name starts with 'prefix'
+    - dtype : str
+      Storage type of the returned counts
+
+    Returns
+    -------
+    CountMatrix : requested genes in the order of 'names', followed by the genes matching 'prefix' (sorted)
+    """
+
+    index = load_gene_index(path, cache_dir)
+    names = list(dict.fromkeys(names))
+
+    for name in names:
+        if name not in index:
+            raise KeyError(f"Gene not found in {path}: {name}")
+    if prefix is not None:
+        requested = set(names)
+        names += [gene for gene in index.with_prefix(prefix) if gene not in requested]
+
+    lines = read_lines(index, [index.offset(name) for name in names])
+
+    counts = np.empty((len(names), len(index.tissues)), dtype=resolve_dtype(dtype))
+    for i, name in enumerate(names):
+        counts[i] = parse_count_line(lines[index.offset(name)], len(index.tissues))
+
+    return CountMatrix(index.tissues, names, counts)
+
+def get_gene(path, name, dtype="float64", cache_dir=None):
+
+    """
+    Read the counts of one gene without loading the whole matrix.
+
+    Returns
+    -------
+    numpy.ndarray : counts of the gene, one value per tissue/cell (KeyError if the gene is not in the file)
+    """
+
+    return get_genes(path, [name], dtype=dtype, cache_dir=cache_dir).counts[0]
@@ -16,19 +16,55 @@ GENE1   50%       21
 GENE1   75%       99
 GENE2   ...       ...
 
-Only rows with stat == "count" are retained.
-All other statistics are ignored.
+Only rows with stat == "count" are retained by 'load_matrix'.
+All other statistics are ignored. 'load_stats' keeps any subset of the statistics
+(e.g. mean, std and quartiles) in a single read of the file.
+
+After a first load, the matrix is saved in a binary cache next to the input file
+(see cache_utils) and memory-mapped by later loads of the same, unchanged file.
+
+Filters (pushdown)
+------------------
+A LoadFilter restricts the matrix while it is read : a gene allowlist and/or a regular expression on the gene names,
+a subset of the tissue/cell columns and a minimum total count per gene.
+Rows of excluded genes are rejected on their first field, before the line is split, and only the selected
+columns are converted to float, so a small subset costs a fraction of the parsing time and memory of the full matrix.
+A filtered load never writes the binary cache (it holds the full matrix) ; if the cache already exists,
+the subset is taken from the memory-mapped cache instead of parsing the file.
+
+Input sources
+-------------
+The input can be a file path, "-" (standard input), a named pipe (FIFO) or an open binary file object,
+so that matrices can be streamed from other tools (zcat, curl, split ...) without intermediate files.
+Gzip compression is detected from the magic bytes of the data, not from the file extension.
+Non-regular inputs are read once and never cached : a producer thread decompresses the data and reads
+large batches of lines, passed to the parser through a bounded queue ('iter_line_batches'),
+so that I/O and parsing overlap and a slow parser holds back the reader (backpressure).
 
 Returns
 -------
-tuple:
+CountMatrix (see matrix_utils):
 - tissues : list[str]
   Names of tissues/cells corresponding to the columns of the matrix
-- data : dict[str, list[float]]
-  Dictionary mapping each gene to a list of counts per tissue/cell
+- genes : list[str]
+  Names of genes corresponding to the rows of the matrix
+- counts : numpy.ndarray
+  Contiguous 2-D array (genes x tissues/cells) of counts, stored as float64 (default), float32 or int32
+
+For compatibility, the matrix can still be unpacked into the old '(tissues, data)' tuple,
+where data : dict[str, numpy.ndarray] maps each gene to a view of its counts per tissue/cell.
+
+Zero-heavy matrices are returned as a SparseCountMatrix (only nonzero counts, CSR layout) with the same interface :
+by default (storage="auto"), the storage is chosen from the density of the first rows read ;
+storage="dense" or storage="sparse" forces it.
 
  Example
  -------
+- matrix = load_matrix("data/mini_ARCHS4.tsv.gz", dtype="float32")
+- matrix.counts = [[63, 120, 5],
+                   [0, 15, 2],
+                   [42, 87, 10]]
+- tissues, data = matrix
 - tissues = ['tissue1', 'tissue2', 'tissue3']
 - data = { 
         'GENE1': [63, 120, 5],
@@ -44,41 +80,596 @@ By convention, cells are implicitly considered as tissues.
 
 # Module for reading .gz files without manual decompression
 import gzip
+import io
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from operator import itemgetter
+
+import numpy as np
+
+from cache_utils import read_cache, write_cache, clear_cache
+from matrix_utils import MatrixBuilder, SparseCountMatrix, StatStoreBuilder
+
+# Statistics available for each gene, in file order
+STAT_NAMES = ("count", "mean", "std", "min", "max", "25%", "50%", "75%")
+
+# First bytes of a gzip stream
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Approximate amount of text read by the producer thread in one batch of lines
+BATCH_BYTES = 4 * 1024 * 1024
+
+# Maximum number of batches waiting for the parser
+QUEUE_SIZE = 4
+
+def new_counters(timings=False):
+
+    """
+    Parsing counters, filled by the loaders when a 'counters' dictionary is given (see profiling_utils).
+
+    - lines : data lines read (header excluded)
+    - skipped_lines : lines ignored (other statistics, malformed lines)
+    - invalid_cells : missing/invalid values replaced with 0.0
+
+    With timings=True, the serial loader ('stream_matrix') also records where its time goes, in seconds :
+    - read_seconds : reading the lines (file reads, gzip decompression, UTF-8 decoding)
+    - split_seconds : tokenizing the kept lines into fields
+    - convert_seconds : converting the values to float ('parse_counts')
+    The worker processes of the parallel loaders do not record them.
+    """
+
+    counters = {"lines": 0, "skipped_lines": 0, "invalid_cells": 0}
+    if timings:
+        counters.update({"read_seconds": 0.0, "split_seconds": 0.0, "convert_seconds": 0.0})
+    return counters
+
+def merge_counters(total, part):
+    for name, value in part.items():
+        total[name] = total.get(name, 0) + value
+    return total
+
+def parse_counts(values, counters=None):
+
+    """
+    Convert a list of count strings to a float64 array.
+
+    Missing/invalid values are replaced with 0.0 (and counted in counters["invalid_cells"]).
+    """
+
+    # Fast path: NumPy converts the whole row at once
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        pass
+
+    # Slow path, only for rows containing missing/invalid values
+    counts = []
+    invalid = 0
+    for value in values:
+        try:
+            counts.append(float(value))
+        except ValueError:
+            counts.append(0.0)
+            invalid += 1
+    if counters is not None:
+        counters["invalid_cells"] += invalid
+    return np.array(counts, dtype=np.float64)
+
+class LoadFilter:
+
+    """
+    Subset of a matrix selected while it is read (see 'Filters' above).
+
+    Parameters
+    ----------
+    - genes : iterable of str or None
+      Allowlist of gene names
+    - gene_pattern : str or None
+      Regular expression searched in the gene names (e.g. "^MT-")
+    - tissues : iterable of str or None
+      Names of the tissue/cell columns kept ; columns keep their file order
+    - min_total : float or None
+      Genes whose total count over the kept columns is below this threshold are dropped
+
+    A gene is kept if it passes every given criterion.
+
+    Example
+    -------
+    row_filter = LoadFilter(gene_pattern="^HLA-", tissues=["liver", "lung"], min_total=10)
+    matrix = load_matrix("data/ARCHS4.tsv.gz", row_filter=row_filter)
+    """
+
+    def __init__(self, genes=None, gene_pattern=None, tissues=None, min_total=None):
+        self.genes = frozenset(genes) if genes is not None else None
+        self.gene_pattern = gene_pattern
+        self._pattern = re.compile(gene_pattern) if gene_pattern is not None else None
+        self.tissues = list(dict.fromkeys(tissues)) if tissues is not None else None
+        self.min_total = float(min_total) if min_total is not None else None
+
+    @property
+    def filters_genes(self):
+        return self.genes is not None or self._pattern is not None
+
+    def keep_gene(self, gene):
+        if self.genes is not None and gene not in self.genes:
+            return False
+        return self._pattern is None or self._pattern.search(gene) is not None
+
+    def gene_predicate(self):
+
+        """
+        Fastest callable telling whether a gene is kept (None : every gene is kept), used once per line.
+        """
+
+        if self.genes is not None and self._pattern is None:
+            return self.genes.__contains__
+        if self.genes is None and self._pattern is not None:
+            return self._pattern.search
+        return self.keep_gene if self.filters_genes else None
+
+    def columns(self, tissues):
+
+        """
+        Indices of the kept columns among the header names 'tissues', in file order (None : all columns).
+        """
 
-def load_matrix(path):
-    opener = gzip.open if path.endswith(".gz") else open
-
-    with opener(path, "rt", encoding="utf-8") as f:
-            
-            # Read header
-            header = f.readline().rstrip("\n").split("\t")
-            if len(header) < 3:
-                 raise ValueError("Invalid header")
-           
-            tissues = header[2:]
-            data = {}
-            
-            # Iterate over file lines
-            for line in f:
+        if self.tissues is None:
+            return None
+
+        index = {name: i for i, name in enumerate(tissues)}
+        missing = [name for name in self.tissues if name not in index]
+        if missing:
+            raise ValueError(f"Unknown tissue(s)/cell(s): {', '.join(missing[:10])}")
+        if not self.tissues:
+            raise ValueError("No tissue/cell selected")
+        return sorted(index[name] for name in self.tissues)
+
+    def project(self, tissues):
+
+        """
+        Returns
+        -------
+        tuple: (names of the kept tissues/cells, their column indices or None for all columns)
+        """
+
+        columns = self.columns(tissues)
+        if columns is None:
+            return list(tissues), None
+        return [tissues[j] for j in columns], columns
+
+    def apply(self, matrix):
+
+        """
+        Filter a matrix that is already loaded (e.g. memory-mapped from the binary cache).
+        """
+
+        rows = None
+        if self.filters_genes:
+            rows = [i for i, gene in enumerate(matrix.genes) if self.keep_gene(gene)]
+        columns = self.columns(matrix.tissues)
+        if rows is not None or columns is not None:
+            matrix = matrix.select(rows, columns)
+
+        if self.min_total is not None:
+            matrix = matrix.select(np.flatnonzero(matrix.gene_totals() >= self.min_total))
+        return matrix
+
+    def __bool__(self):
+        return self.filters_genes or self.tissues is not None or self.min_total is not None
+
+    def __repr__(self):
+        # Deterministic : also used as a pipeline stage parameter (see pipeline_utils)
+        genes = sorted(self.genes) if self.genes is not None else None
+        return (f"LoadFilter(genes={genes}, gene_pattern={self.gene_pattern!r}, tissues={self.tissues}, "
+                f"min_total={self.min_total})")
+
+def parse_header(line):
+
+    """
+    Return the names of tissues/cells from the header line of a matrix file.
+
+    The line ending is removed whether the line was read in text mode or decoded from bytes ("\n" or "\r\n").
+    """
+
+    header = line.rstrip("\r\n").split("\t")
+    if len(header) < 3:
+        raise ValueError("Invalid header")
+    return header[2:]
+
+def read_header(f):
+
+    """
+    Read the header line of an open matrix file and return the names of tissues/cells.
+    """
+
+    return parse_header(f.readline())
+
+def iter_stat_rows(f, stats=("count",), counters=None, row_filter=None, columns=None):
+
+    """
+    Iterate over the rows of an open matrix file (header already read) whose stat is in 'stats'.
+
+    The gene and stat fields are checked before the line is split, so rows of unwanted genes ('row_filter',
+    see LoadFilter) and statistics are never tokenized. With 'columns' (indices of the kept tissues/cells,
+    in increasing order, see LoadFilter.project), lines are split up to the last kept column only
+    and the other values are never converted.
+
+    Yields
+    ------
+    tuple: (gene, stat, values) with values a float64 array, one value per tissue/cell
+    """
+
+    wanted = set(stats)
+    lines = kept = 0
+
+    # Tokenizing and conversion times, only when requested (see new_counters)
+    timed = counters is not None and "split_seconds" in counters
+    clock = time.perf_counter
+    split_seconds = convert_seconds = 0.0
+
+    keep_gene = row_filter.gene_predicate() if row_filter is not None else None
+    min_total = row_filter.min_total if row_filter is not None else None
+    if columns is not None:
+        # Fields of the kept values ; the rest of the line after the last one is left unsplit
+        positions = [column + 2 for column in columns]
+        last = positions[-1]
+        pick = itemgetter(*positions) if len(positions) > 1 else (lambda parts: (parts[last],))
+
+    try:
+        for line in f:
+            lines += 1
+
+            # Locate the gene and stat fields (before the first and second tabs) without splitting the line
+            first = line.find("\t")
+            second = line.find("\t", first + 1) if first >= 0 else -1
+            if second < 0:
+                continue
+
+            if keep_gene is not None and not keep_gene(line[:first]):
+                continue
+
+            stat = line[first + 1:second].strip()
+            if stat not in wanted:
+                continue
+
+            if timed:
+                start = clock()
+            if columns is None:
                 parts = line.rstrip("\n").split("\t")
-                if len(parts) < 3:
-                    continue
-                
-                gene = parts[0]
-                stat = parts[1].strip()
-
-                # Keep only 'count' rows
-                if stat != "count":
-                    continue
-
-                # Convert values to float and replace missing/invalid values with 0.0
-                counts = []
-                for value in parts[2:]:
-                        try:
-                              counts.append(float(value))
-                        except ValueError:
-                              counts.append(0.0)
-                                             
-                data[gene] = counts
-            
-            return tissues, data
+                values = parts[2:]
+            else:
+                parts = line.split("\t", last + 1)
+                if len(parts) <= last:
+                    raise ValueError(f"Counts length does not match number of tissues/cells for gene {parts[0]}")
+                values = pick(parts)
+
+            # Convert values to float and replace missing/invalid values with 0.0
+            if timed:
+                split = clock()
+            counts = parse_counts(values, counters)
+            if timed:
+                split_seconds += split - start
+                convert_seconds += clock() - split
+            if min_total is not None and counts.sum() < min_total:
+                continue
+
+            kept += 1
+            yield parts[0], stat, counts
+
+    finally:
+        # Counters are updated once, when the iteration ends or is interrupted
+        if counters is not None:
+            counters["lines"] += lines
+            counters["skipped_lines"] += lines - kept
+        if timed:
+            counters["split_seconds"] += split_seconds
+            counters["convert_seconds"] += convert_seconds
+
+def iter_count_rows(f, counters=None, row_filter=None, columns=None):
+
+    """
+    Iterate over the 'count' rows of an open matrix file (header already read),
+    optionally filtered while they are read (see 'iter_stat_rows').
+
+    Yields
+    ------
+    tuple: (gene, counts) with counts a float64 array, one value per (kept) tissue/cell
+    """
+
+    for gene, _, counts in iter_stat_rows(f, ("count",), counters, row_filter, columns):
+        yield gene, counts
+
+# ---------------------------------------------------------------------
+# Input sources : paths, standard input, pipes and file objects
+# ---------------------------------------------------------------------
+
+def is_regular_file(source):
+
+    """
+    True if 'source' is the path of a regular file (which can be fingerprinted, cached, indexed and split).
+    """
+
+    return isinstance(source, (str, os.PathLike)) and source != "-" and os.path.isfile(source)
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+class BorrowedStream(io.RawIOBase):
+
+    """
+    Read-only view of a binary stream owned by the caller (e.g. sys.stdin.buffer) : closing it leaves the stream open.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+class BorrowedTextStream(io.TextIOBase):
+
+    """
+    Read-only view of a text stream owned by the caller (e.g. io.StringIO) : closing it leaves the stream open.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def readlines(self, hint=-1):
+        return self.stream.readlines(hint)
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+def open_text(source):
+
+    """
+    Open a matrix source for reading as text, decompressing it if it starts with the gzip magic bytes.
+
+    'source' is a path (regular file or named pipe), "-" for the standard input, or an open file object.
+    Closing the returned file does not close the standard input or a file object given by the caller.
+    """
+
+    if isinstance(source, io.TextIOBase) and not hasattr(source, "buffer"):
+        return BorrowedTextStream(source)
+    if source == "-":
+        source = sys.stdin
+
+    if hasattr(source, "read"):
+        raw = io.BufferedReader(BorrowedStream(getattr(source, "buffer", source)))
+    else:
+        raw = open(source, "rb")
+
+    # peek does not consume the data, so it also works on pipes
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    return io.TextIOWrapper(raw, encoding="utf-8")
+
+def iter_line_batches(f, batch_bytes=BATCH_BYTES, queue_size=QUEUE_SIZE):
+
+    """
+    Read the lines of an open file in a producer thread and yield them in batches.
+
+    The producer (reading, decompression and decoding) and the consumer (parsing) run at the same time :
+    at most 'queue_size' batches wait in the queue, so the producer blocks when the consumer falls behind.
+    An error raised by the producer is raised again by the consumer.
+
+    Yields
+    ------
+    list[str] : batch of complete lines, about 'batch_bytes' characters
+    """
+
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up if the consumer stopped reading (e.g. parse error)
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            while not stop.is_set():
+                lines = f.readlines(batch_bytes)
+                if not lines:
+                    break
+                put(lines)
+            put(done)
+        except BaseException as error:
+            put(error)
+
+    producer = threading.Thread(target=produce, name="matrix-reader", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            batch = batches.get()
+            if batch is done:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        producer.join()
+
+def timed_iter(items, counters):
+
+    """
+    Iterate over 'items', adding the time spent waiting for each item to counters["read_seconds"].
+    """
+
+    clock = time.perf_counter
+    items = iter(items)
+    done = object()
+    while True:
+        start = clock()
+        item = next(items, done)
+        counters["read_seconds"] += clock() - start
+        if item is done:
+            return
+        yield item
+
+def stream_matrix(path, counters=None, row_filter=None):
+
+    """
+    Open a matrix file and stream its count rows without materializing the matrix.
+
+    Returns
+    -------
+    tuple:
+    - tissues : list[str]
+      Names of tissues/cells corresponding to the columns of the matrix (kept columns only with 'row_filter')
+    - rows : generator of (gene, counts)
+      Count rows in file order, filtered while they are read with 'row_filter' (see LoadFilter) ;
+      the file is closed when the generator is exhausted or closed
+
+    'path' can also be "-" (standard input), a named pipe or a file object (see 'open_text') :
+    lines are then read by a producer thread while the rows are consumed.
+
+    Example
+    -------
+    tissues, rows = stream_matrix("data/ARCHS4.tsv.gz")
+    for gene, counts in rows:
+        ...
+    """
+
+    f = open_text(path)
+
+    try:
+        tissues, columns = (row_filter or LoadFilter()).project(read_header(f))
+    except Exception:
+        f.close()
+        raise
+
+    # Reading time, only when requested (see new_counters) : waiting for the batches of the producer thread
+    # for standard input and pipes
+    timed = counters is not None and "read_seconds" in counters
+
+    def rows():
+        with f:
+            if is_regular_file(path):
+                lines = timed_iter(f, counters) if timed else f
+                yield from iter_count_rows(lines, counters, row_filter, columns)
+            else:
+                batches = iter_line_batches(f)
+                for lines in timed_iter(batches, counters) if timed else batches:
+                    yield from iter_count_rows(lines, counters, row_filter, columns)
+
+    return tissues, rows()
+
+def convert_storage(matrix, storage):
+
+    """
+    Return the matrix in the requested storage ("dense" or "sparse") ; "auto" keeps it as it is.
+    """
+
+    if storage == "dense" and isinstance(matrix, SparseCountMatrix):
+        return matrix.to_dense()
+    if storage == "sparse" and not isinstance(matrix, SparseCountMatrix):
+        return SparseCountMatrix.from_dense(matrix)
+    return matrix
+
+def load_matrix(path, dtype="float64", workers=1, cache=True, cache_dir=None, rebuild_cache=False, counters=None,
+                storage="auto", row_filter=None):
+
+    # 'counters' (see new_counters) is filled with parsing counters ; nothing is counted on a cache hit
+    # 'storage' is "dense" (CountMatrix), "sparse" (SparseCountMatrix) or "auto" : sparse if the density
+    # measured on the first rows is below matrix_utils.SPARSE_DENSITY_THRESHOLD
+    # 'row_filter' (see LoadFilter) selects genes and tissues/cells while the file is read
+    # "-", pipes and file objects are read by a producer thread (see 'stream_matrix'), without cache or workers
+    if not is_regular_file(path):
+        cache = rebuild_cache = False
+        workers = 1
+
+    # Reuse the binary cache of a previous load of the same file (see cache_utils)
+    if cache and not rebuild_cache:
+        matrix = read_cache(path, dtype=dtype, cache_dir=cache_dir, sparse=storage == "sparse")
+        if matrix is not None:
+            if row_filter:
+                matrix = row_filter.apply(matrix)
+            return convert_storage(matrix, storage)
+    if rebuild_cache:
+        clear_cache(path, cache_dir=cache_dir)
+
+    # The cache holds the full matrix : a filtered load does not write it
+    if row_filter:
+        cache = rebuild_cache = False
+
+    # Parse with a pool of worker processes (see parallel_utils) ; workers=None uses all CPU cores
+    if workers != 1:
+        from parallel_utils import load_matrix_parallel
+        matrix = load_matrix_parallel(path, dtype=dtype, workers=workers, counters=counters, storage=storage,
+                                      row_filter=row_filter)
+
+    else:
+        tissues, rows = stream_matrix(path, counters, row_filter)
+
+        builder = MatrixBuilder(tissues, dtype=dtype, storage=storage)
+        for gene, counts in rows:
+            builder.append(gene, counts)
+        matrix = builder.build()
+
+    if cache or rebuild_cache:
+        write_cache(path, matrix, cache_dir=cache_dir)
+
+    return matrix
+
+def load_stats(path, stats=("count",), dtype="float64"):
+
+    """
+    Load any subset of the per-gene statistics rows of a matrix file in a single read.
+
+    Rows of statistics that are not requested are rejected before being split, so loading
+    only 'count' parses about 8 times less text than loading all the statistics.
+
+    Returns
+    -------
+    StatStore (see matrix_utils) : one 2-D array (genes x tissues/cells) per requested statistic
+
+    Example
+    -------
+    store = load_stats("data/ARCHS4.tsv.gz", stats=("mean", "std", "50%"))
+    store["std"]            # array of standard deviations
+    store.matrix("mean")    # CountMatrix of the mean rows
+    """
+
+    for stat in stats:
+        if stat not in STAT_NAMES:
+            raise ValueError(f"Unknown statistic: {stat} (expected one of {', '.join(STAT_NAMES)})")
+
+    with open_text(path) as f:
+        tissues = read_header(f)
+        builder = StatStoreBuilder(tissues, stats, dtype=dtype)
+
+        for gene, stat, values in iter_stat_rows(f, stats):
+            builder.append(gene, stat, values)
+
+    return builder.build()
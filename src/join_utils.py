@@ -0,0 +1,358 @@
+"""
+Column-wise join of several count matrices on the gene name.
+
+The same gene panel is often split across several files (one file per batch of tissues/cells).
+'join_rows' joins them into a single stream of (gene, counts) rows whose columns are the tissues/cells
+of every input, in input order, without materializing every input at once:
+
+- Sorted-merge join : when every input is sorted by gene name (byte order, e.g. 'LC_ALL=C sort'), the inputs are
+  read in lockstep and each joined row is emitted as soon as its gene has been read from every input.
+  Memory holds one row per input.
+- Hash join : otherwise, every input but one (the probe : the largest file) is loaded into a hash table
+  gene -> counts, and the probe is streamed through it. Memory holds the inputs of the hash tables only.
+
+Whether the inputs are sorted is not known before they are read : 'consume_joined' and 'load_joined' attempt the
+sorted-merge join and, when an input turns out not to be sorted, discard the rows produced so far and read the
+inputs again with the hash join. Sorted inputs are read (and decompressed) once.
+
+Join types
+----------
+- inner : genes present in every input
+- outer : genes present in at least one input ; counts of the inputs where a gene is missing are 0
+
+Duplicate genes
+---------------
+A gene appearing several times in one input is summed ("sum"), kept at its first occurrence ("first")
+or rejected with an error ("error", default), instead of silently overwriting the earlier row.
+In the hash join, summing duplicates of the probe requires all its rows : the probe is then hashed as well.
+
+Tissue/cell names shared by several inputs are prefixed with the name of their input ("batch2:liver").
+
+Example
+-------
+tissues, rows = join_rows(["batch1.tsv", "batch2.tsv.gz"], how="outer", duplicates="sum", sorted_inputs=True)
+aggregator = StreamingAggregator(tissues).consume(rows)     # summary without the joined matrix
+matrix = load_joined(["batch1.tsv", "batch2.tsv.gz"])       # joined CountMatrix, sorted-merge join if possible
+"""
+
+import os
+
+import numpy as np
+
+from io_utils import LoadFilter, is_regular_file, merge_counters, new_counters, stream_matrix
+from matrix_utils import MatrixBuilder
+
+# Join types and policies for genes appearing several times in one input
+JOIN_TYPES = ("inner", "outer")
+DUPLICATE_POLICIES = ("sum", "first", "error")
+
+class UnsortedInputError(ValueError):
+
+    """
+    Raised by the sorted-merge join when an input is not sorted by gene name.
+    """
+
+def input_label(source, position):
+
+    """
+    Short name of an input : its file name without extension, or its position for standard input and file objects.
+    """
+
+    if not is_regular_file(source):
+        return f"input{position + 1}"
+    name = os.path.basename(source)
+    for extension in (".gz", ".tsv", ".txt"):
+        if name.endswith(extension) and len(name) > len(extension):
+            name = name[:-len(extension)]
+    return name
+
+def joined_tissues(tissue_lists, labels):
+
+    """
+    Names of the columns of the joined matrix : the tissues/cells of every input, in input order,
+    prefixed with the label of their input when the same name appears in several inputs.
+    """
+
+    seen = {}
+    for tissues in tissue_lists:
+        for name in set(tissues):
+            seen[name] = seen.get(name, 0) + 1
+
+    return [f"{label}:{name}" if seen[name] > 1 else name
+            for tissues, label in zip(tissue_lists, labels) for name in tissues]
+
+# ---------------------------------------------------------------------
+# PART 1 : Duplicate genes
+# ---------------------------------------------------------------------
+
+def check_policy(how, duplicates):
+    if how not in JOIN_TYPES:
+        raise ValueError(f"Unknown join type: {how} (expected one of {', '.join(JOIN_TYPES)})")
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy: {duplicates} (expected one of {', '.join(DUPLICATE_POLICIES)})")
+
+def duplicate_error(gene, label):
+    return ValueError(f"Duplicate gene {gene} in {label} (use duplicates='sum' or 'first')")
+
+def sorted_unique_rows(rows, duplicates, label):
+
+    """
+    Rows of a gene-sorted input with adjacent duplicates resolved ; raises UnsortedInputError if the input is not sorted.
+    """
+
+    pending = None
+    for gene, counts in rows:
+        if pending is not None:
+            if gene == pending[0]:
+                if duplicates == "error":
+                    raise duplicate_error(gene, label)
+                if duplicates == "sum":
+                    pending = (gene, pending[1] + counts)
+                continue
+            if gene < pending[0]:
+                raise UnsortedInputError(f"{label} is not sorted by gene ({gene} after {pending[0]})")
+            yield pending
+        pending = (gene, counts)
+
+    if pending is not None:
+        yield pending
+
+def hash_rows(rows, duplicates, label):
+
+    """
+    Hash table gene -> counts of an input, in order of first appearance, with duplicates resolved.
+    """
+
+    table = {}
+    for gene, counts in rows:
+        if gene in table:
+            if duplicates == "error":
+                raise duplicate_error(gene, label)
+            if duplicates == "sum":
+                table[gene] = table[gene] + counts
+            continue
+        table[gene] = counts
+    return table
+
+def unique_rows(rows, duplicates, label):
+
+    """
+    Rows of an input streamed in file order, later occurrences of a gene skipped ("first") or rejected ("error").
+    """
+
+    seen = set()
+    for gene, counts in rows:
+        if gene in seen:
+            if duplicates == "error":
+                raise duplicate_error(gene, label)
+            continue
+        seen.add(gene)
+        yield gene, counts
+
+# ---------------------------------------------------------------------
+# PART 2 : Joins
+# ---------------------------------------------------------------------
+
+def merge_join(streams, widths, how):
+
+    """
+    Sorted-merge join of gene-sorted streams of unique genes.
+
+    Yields
+    ------
+    tuple: (gene, counts) in increasing gene order, counts covering the columns of every input
+    """
+
+    offsets = np.concatenate([[0], np.cumsum(widths)])
+    heads = [next(stream, None) for stream in streams]
+
+    while True:
+        present = [head for head in heads if head is not None]
+        if not present or (how == "inner" and len(present) < len(heads)):
+            # The rest of the other inputs is still read : an input that is not sorted is always detected
+            for stream, head in zip(streams, heads):
+                if head is not None:
+                    for _ in stream:
+                        pass
+            return
+
+        gene = min(head[0] for head in present)
+        matched = [i for i, head in enumerate(heads) if head is not None and head[0] == gene]
+
+        if how == "outer" or len(matched) == len(heads):
+            counts = np.zeros(offsets[-1], dtype=np.float64)
+            for i in matched:
+                counts[offsets[i]:offsets[i + 1]] = heads[i][1]
+            yield gene, counts
+
+        for i in matched:
+            heads[i] = next(streams[i], None)
+
+def hash_join(tables, probe, widths, how):
+
+    """
+    Hash join : the rows of 'probe' (stream of unique genes, or None) are completed with the counts of the
+    hash tables ; with how="outer", genes of the tables missing from the probe follow, in input order.
+
+    'tables' holds one hash table per input, or None at the position of the probe.
+
+    Yields
+    ------
+    tuple: (gene, counts), counts covering the columns of every input
+    """
+
+    offsets = np.concatenate([[0], np.cumsum(widths)])
+    hashed = [(i, table) for i, table in enumerate(tables) if table is not None]
+    position = tables.index(None) if probe is not None else None
+
+    def joined(gene, probe_counts=None):
+        counts = np.zeros(offsets[-1], dtype=np.float64)
+        if probe_counts is not None:
+            counts[offsets[position]:offsets[position + 1]] = probe_counts
+        for i, table in hashed:
+            values = table.get(gene)
+            if values is not None:
+                counts[offsets[i]:offsets[i + 1]] = values
+        return counts
+
+    emitted = set()
+    if probe is not None:
+        for gene, counts in probe:
+            if how == "inner" and not all(gene in table for _, table in hashed):
+                continue
+            emitted.add(gene)
+            yield gene, joined(gene, counts)
+
+    for i, table in hashed:
+        for gene in table:
+            if gene in emitted:
+                continue
+            if how == "inner" and (probe is not None or not all(gene in other for _, other in hashed)):
+                continue
+            emitted.add(gene)
+            yield gene, joined(gene)
+
+def probe_position(sources):
+
+    """
+    Input streamed through the hash tables : the first input that cannot be read twice, else the largest file.
+    """
+
+    for i, source in enumerate(sources):
+        if not is_regular_file(source):
+            return i
+    return max(range(len(sources)), key=lambda i: os.path.getsize(sources[i]))
+
+def join_rows(sources, how="inner", duplicates="error", sorted_inputs=False, row_filter=None, counters=None):
+
+    """
+    Join several matrix files column-wise on the gene name, as a stream of rows.
+
+    Parameters
+    ----------
+    - sources : list
+      Paths of the matrix files ("-", named pipes and file objects are accepted, see io_utils.open_text)
+    - how : "inner" or "outer"
+    - duplicates : "sum", "first" or "error"
+      Policy for a gene appearing several times in one input
+    - sorted_inputs : bool
+      True : sorted-merge join (UnsortedInputError, a ValueError, if an input turns out not to be sorted) ;
+      False : hash join. See 'consume_joined' when it is not known whether the inputs are sorted
+    - row_filter : LoadFilter or None
+      Genes (allowlist / pattern) are selected while each input is read, 'min_total' on the joined counts ;
+      tissues/cells cannot be selected
+    - counters : dict or None
+      Filled with the parsing counters of all inputs (see io_utils.new_counters)
+
+    Returns
+    -------
+    tuple:
+    - tissues : list[str]
+      Columns of the joined matrix (see 'joined_tissues')
+    - rows : generator of (gene, counts)
+      Joined rows, counts as float64 arrays
+    """
+
+    check_policy(how, duplicates)
+    sources = list(sources)
+    if not sources:
+        raise ValueError("No input to join")
+
+    min_total = None
+    gene_filter = None
+    if row_filter:
+        if row_filter.tissues is not None:
+            raise ValueError("Tissues/cells cannot be selected when joining matrices")
+        min_total = row_filter.min_total
+        gene_filter = LoadFilter(genes=row_filter.genes, gene_pattern=row_filter.gene_pattern)
+
+    labels = [input_label(source, i) for i, source in enumerate(sources)]
+    opened = [stream_matrix(source, counters, gene_filter) for source in sources]
+    tissue_lists = [tissues for tissues, _ in opened]
+    widths = [len(tissues) for tissues in tissue_lists]
+
+    if sorted_inputs:
+        streams = [sorted_unique_rows(rows, duplicates, label) for (_, rows), label in zip(opened, labels)]
+        rows = merge_join(streams, widths, how)
+    else:
+        # Summing duplicates needs every row of an input : no input is streamed
+        position = probe_position(sources) if duplicates != "sum" else None
+        tables = [None if i == position else hash_rows(rows, duplicates, label)
+                  for i, ((_, rows), label) in enumerate(zip(opened, labels))]
+        probe = unique_rows(opened[position][1], duplicates, labels[position]) if position is not None else None
+        rows = hash_join(tables, probe, widths, how)
+
+    if min_total is not None:
+        rows = ((gene, counts) for gene, counts in rows if counts.sum() >= min_total)
+
+    return joined_tissues(tissue_lists, labels), rows
+
+def consume_joined(sources, consume, how="inner", duplicates="error", sorted_inputs=None, row_filter=None,
+                   counters=None):
+
+    """
+    Join several matrix files (see 'join_rows') and pass the joined columns and rows to consume(tissues, rows).
+
+    With sorted_inputs=None, the sorted-merge join is attempted : if an input turns out not to be sorted, 'consume'
+    is called again with the rows of the hash join (it must not keep state between calls).
+    Inputs that cannot be read twice (standard input, named pipes, file objects) go straight to the hash join.
+
+    Returns
+    -------
+    The value returned by the last call of 'consume'
+    """
+
+    sources = list(sources)
+    if sorted_inputs is not None:
+        return consume(*join_rows(sources, how, duplicates, sorted_inputs, row_filter, counters))
+    if not all(is_regular_file(source) for source in sources):
+        return consume(*join_rows(sources, how, duplicates, False, row_filter, counters))
+
+    # Counters of the discarded attempt are not kept (same counters as the caller's, counted from zero)
+    attempt = dict.fromkeys(counters or new_counters(), 0)
+    try:
+        result = consume(*join_rows(sources, how, duplicates, True, row_filter, attempt))
+    except UnsortedInputError:
+        attempt = dict.fromkeys(attempt, 0)
+        result = consume(*join_rows(sources, how, duplicates, False, row_filter, attempt))
+    if counters is not None:
+        merge_counters(counters, attempt)
+    return result
+
+def load_joined(sources, how="inner", duplicates="error", sorted_inputs=None, row_filter=None, counters=None,
+                dtype="float64", storage="auto"):
+
+    """
+    Join several matrix files (see 'consume_joined') into a single CountMatrix or SparseCountMatrix.
+
+    The joined rows are appended to the matrix as they are produced : the inputs are never all held in memory
+    with the sorted-merge join.
+    """
+
+    def build(tissues, rows):
+        builder = MatrixBuilder(tissues, dtype=dtype, storage=storage)
+        for gene, counts in rows:
+            builder.append(gene, counts)
+        return builder.build()
+
+    return consume_joined(sources, build, how, duplicates, sorted_inputs, row_filter, counters)
@@ -5,142 +5,571 @@ The workflow separates data loading, statistical analysis, visualization and rep
 
 The os module is used to handle file system operations such as creating output directories and building platform-independent file paths.
 
-The webbrowser module is used to automatically open the generated HTML report in the default web browser.
+The webbrowser module is used to automatically open the generated HTML report in the default web browser
+(unless --no-browser is given).
 
-The sys module is used to retrieve command-line arguments, allowing the user to specify the input file.
+The pipeline is expressed as named stages (load -> summary -> figures -> report, see pipeline_utils) whose
+results are cached in the report directory : a rerun only executes the stages whose inputs or options changed.
+
+The argparse module is used to read command-line arguments, allowing the user to specify the input file and options.
+
+With --streaming, count rows are aggregated in a single pass as they are read from the file,
+so the full matrix is never held in memory (useful for matrices larger than RAM).
+A file repeating a gene is read again to keep only the last row of that gene, as in the default mode.
+
+With --profile, each stage is measured (wall time, CPU time, peak memory, throughput, parsing counters, see profiling_utils) :
+the measurements are written to web_report/profile.json and shown in a timing section of the HTML report.
+
+Several input files (or glob patterns) are processed in batch mode, in a single invocation : the matrices are
+analyzed concurrently by a bounded pool of worker processes (--batch-workers), each one gets its own report
+directory, and an index page compares their summaries.
+
+Headless mode : with --format json|tsv, the summary and the full gene and tissue/cell totals are written
+to the standard output (or to --output FILE) instead of the HTML report ; no figure is rendered and no browser
+is opened. Plotting is an optional stage (--no-plots) and matplotlib is only imported when figures are drawn,
+so a summary starts in a fraction of a second (useful in cron jobs and health checks).
+The json module writes the machine-readable output. Totals are written with full precision (shortest repr of the
+float), so they read back exactly. Modules using NumPy are imported by the functions that need them, not when this
+script is imported : --help and argument errors are immediate, and the headless mode only loads what it uses.
+
+With --normalize, counts are normalized by library size (log1p of counts per million) and the most variable genes
+are selected (see normalization_utils) : they are shown in a figure and in a table of the report.
+With --correlation pearson|spearman, the tissue-by-tissue correlation matrix is computed (see correlation_utils),
+cached with the other stage results and shown as a clustered heatmap in the report.
+
+With --genes, --gene-pattern, --tissues and --min-total, only a subset of the matrix is read (see io_utils.LoadFilter) :
+excluded genes are rejected before their line is split and only the selected columns are converted.
+
+With --join inner|outer, several input files holding different tissues/cells of the same genes are joined
+column-wise on the gene name into a single matrix and report (see join_utils), instead of the batch mode.
+
+With --state FILE, the totals are kept in a persisted aggregate state (see aggregate_utils) : the input files
+not folded yet (the full matrix on the first run, then delta files of new genes or tissues/cells) are added to it,
+and the summary and report are built from the merged state without reading the files already folded.
+
+With --serve, the matrix is loaded once and kept in memory by a local query server (see server_utils) : gene lookups,
+tissue/cell totals, top-k rankings and the summary are answered as JSON over HTTP (--host/--port) or a Unix socket
+(--socket), and the matrix is reloaded when the input file changes.
 """
 
+import argparse
+import functools
+import glob
+import importlib
+import json
 import os
+import re
 import sys
-import webbrowser
+from html import escape
 
-from io_utils import load_matrix
-from stats_utils import total_count_tissue, total_count_gene, summarize
-from plotting import plot_tissue_total, plot_gene_total
+# Machine-readable output formats of the headless mode
+OUTPUT_FORMATS = ("json", "tsv")
 
-def generate_html_report(report_dir, path, tissues, data):
-   
-    """ 
-    Generate an HTML summary report for a gene expression matrix.
+# Options whose valid values are defined by a module using NumPy : (option, module, constant).
+# They are checked after parsing, importing the module only when the option is given.
+LAZY_CHOICES = (
+    ("storage", "matrix_utils", "STORAGES"),
+    ("figure_format", "plotting", "FIGURE_FORMATS"),
+    ("correlation", "correlation_utils", "METHODS"),
+    ("join", "join_utils", "JOIN_TYPES"),
+    ("duplicates", "join_utils", "DUPLICATE_POLICIES"),
+)
+
+def format_value(value):
+
+    # Shortest representation that reads back as the same float (no rounding of large totals)
+    return repr(float(value))
+
+def write_ranking(output_path, items, label):
 
-    The report includes :
-    - Name and path of the input expression matrix file
-    - Number of tissues/cells and genes
-    - Visualization of the top 10 tissues and genes by total read counts
-    
-    The HTML report displays plots that are generated separately by the plotting functions.
+    """
+    Write a ranking of (name, total count) pairs to a tab-separated file (totals with full precision).
     """
 
-    # HTML content of the report
-    html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <title>Expression Matrix Report</title>
-    <style>
-    body {{
-        font-family: Arial, sans-serif;
-        margin: 40px;
-    }}
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(f"rank\t{label}\ttotal_count\n")
+        for rank, (name, value) in enumerate(items, 1):
+            f.write(f"{rank}\t{name}\t{format_value(value)}\n")
+    return output_path
 
-    h1 {{
-        margin-top: 0;
-    }}
+def input_name(path):
 
-    .summary-box {{
-        border: 2px solid black;
-        background-color: #fde7ef; /* rose pâle */
-        padding: 20px 25px;
-        border-radius: 8px;
-        max-width: 900px;
-        margin-bottom: 40px;
-    }}
+    # Joined input files (--join) are shown as "a.tsv + b.tsv"
+    return " + ".join(str(source) for source in path) if isinstance(path, list) else path
 
-    .figure-box {{
-    border: 2px solid black;
-    padding: 15px;
-    border-radius: 8px;
-    margin-bottom: 40px;
-    max-width: 950px;
-}}
-
-    img {{
-        max-width: 900px;
-        margin-bottom: 40px;
-    }}
-</style>
-</head>
-<body>
+def write_summary(f, path, result, output_format):
 
-<div class="summary-box">
-    <h1>Expression Matrix — Summary Report</h1>
+    """
+    Write the summary and the full gene and tissue/cell totals of a matrix in a machine-readable format.
 
-    <p><strong>File:</strong> {path}</p>
-    <p><strong>Number of tissues / cells:</strong> {len(tissues)}</p>
-    <p><strong>Number of genes:</strong> {len(data)}</p>
-</div>
+    - json : one object with the file, dimensions, density, min/max summary (same format as 'summarize')
+             and the totals as {name: total} dictionaries
+    - tsv  : '#'-prefixed summary lines, then one "axis, name, total_count" row per tissue/cell and per gene
+    """
 
-<h2>Top 10 tissues / cells by total read counts</h2>
-<div class="figure-box">
-    <img src="top_tissues.png">
-</div>
+    summary = result.to_dict()
 
-<h2>Top 10 genes by total read counts</h2>
-<div class="figure-box">
-    <img src="top_genes.png">
-</div>
+    if output_format == "json":
+        json.dump({
+            "file": input_name(path),
+            "n_genes": result.n_genes,
+            "n_tissues": result.n_tissues,
+            "density": result.density,
+            "summary": summary,
+            "tissue_totals": result.tissue_totals_dict(),
+            "gene_totals": result.gene_totals_dict(),
+        }, f, indent=1)
+        f.write("\n")
+        return
 
-</body>
-</html>
-"""
-    # Build the path to the HTML report file
-    report_file = os.path.join(report_dir, "report.html")
-    
-    # Write the HTML content to disk using UTF-8 encoding
-    with open(report_file, "w", encoding="utf-8") as f:
-        f.write(html)
-    
-    # Return the path to the generated report
-    return report_file
+    f.write(f"# file\t{input_name(path)}\n")
+    f.write(f"# n_genes\t{result.n_genes}\n")
+    f.write(f"# n_tissues\t{result.n_tissues}\n")
+    f.write(f"# density\t{format_value(result.density)}\n")
+    for axis in ("genes", "tissues"):
+        for side in ("min", "max"):
+            extreme = summary[axis][side]
+            f.write(f"# {axis}_{side}\t{format_value(extreme['value'])}\t{','.join(extreme['names'])}\n")
+
+    f.write("axis\tname\ttotal_count\n")
+    for name, value in zip(result.tissues, result.tissue_totals.tolist()):
+        f.write(f"tissue\t{name}\t{format_value(value)}\n")
+    for name, value in zip(result.genes, result.gene_totals.tolist()):
+        f.write(f"gene\t{name}\t{format_value(value)}\n")
+
+def name_list(value):
+
+    """
+    Names given on the command line : comma-separated, or '@FILE' for a file with one name per line.
+    """
+
+    if value.startswith("@"):
+        with open(value[1:], encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+def parse_args(argv=None):
+
+    """
+    Read the input file path and options from the command line.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Summary report of a gene expression count matrix (.tsv or .tsv.gz)")
+    parser.add_argument("paths", nargs="+", metavar="path",
+                        help="input matrix files (.tsv or .tsv.gz), named pipes, '-' for the standard input, or glob patterns ; "
+                             "several files are processed in batch mode")
+    parser.add_argument("--output-dir", default="web_report",
+                        help="report directory (default web_report) ; in batch mode, one subdirectory per matrix and an index.html")
+    parser.add_argument("--batch-workers", type=int, default=1,
+                        help="number of matrices analyzed at the same time in batch mode (0 = all CPU cores, default 1)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="aggregate count rows in a single pass without loading the full matrix")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse the matrix, and of threads used by --correlation "
+                             "(0 = all CPU cores, default 1)")
+    parser.add_argument("--storage", default="auto",
+                        help="in-memory storage of the matrix : dense array, sparse (nonzero counts only) "
+                             "or chosen from the measured density (auto, dense or sparse, default auto)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not read or write the binary cache of the matrix")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="parse the matrix again and replace its binary cache")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of the binary cache (default : next to the input file)")
+    parser.add_argument("--figure-format", default="png",
+                        help="output format of the figures (png or svg, default png)")
+    parser.add_argument("--dpi", type=int, default=300,
+                        help="resolution of PNG figures (default 300)")
+    parser.add_argument("--export-top", type=int, default=0, metavar="N",
+                        help="export the top N genes and tissues/cells as .tsv rankings in the report")
+    parser.add_argument("--normalize", action="store_true",
+                        help="normalize counts by library size (log1p CPM) and select highly variable genes, "
+                             "shown in the figures and report")
+    parser.add_argument("--n-hvg", type=int, default=None, metavar="N",
+                        help="number of highly variable genes selected with --normalize "
+                             "(default normalization_utils.N_TOP_GENES)")
+    parser.add_argument("--correlation", default=None, metavar="METHOD",
+                        help="correlate every pair of tissues/cells (pearson or spearman) and show a clustered heatmap "
+                             "in the report")
+    parser.add_argument("--genes", type=name_list, default=None, metavar="NAMES",
+                        help="read only these genes (comma-separated, or @FILE with one name per line)")
+    parser.add_argument("--gene-pattern", default=None, metavar="REGEX",
+                        help="read only the genes whose name matches this regular expression")
+    parser.add_argument("--tissues", type=name_list, default=None, metavar="NAMES",
+                        help="read only these tissue/cell columns (comma-separated, or @FILE with one name per line)")
+    parser.add_argument("--min-total", type=float, default=None, metavar="X",
+                        help="drop the genes whose total count over the selected tissues/cells is below X")
+    parser.add_argument("--join", default=None, metavar="HOW",
+                        help="join the input files column-wise on the gene name into a single matrix and report "
+                             "(inner : genes present in every file, outer : in any file) instead of the batch mode")
+    parser.add_argument("--duplicates", default="error", metavar="POLICY",
+                        help="with --join, policy for a gene appearing several times in one file "
+                             "(sum, first or error, default error)")
+    parser.add_argument("--state", default=None, metavar="FILE",
+                        help="persisted aggregate state (.npz) : fold the input files not folded yet (new genes or "
+                             "tissues/cells) into it and report the merged totals, created on the first run")
+    parser.add_argument("--serve", action="store_true",
+                        help="keep the matrix in memory and answer JSON queries (/gene, /tissues, /top, /summary) "
+                             "on a local HTTP server instead of writing a report")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address of the --serve HTTP server (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="port of the --serve HTTP server (default 8765, 0 = any free port)")
+    parser.add_argument("--socket", default=None, metavar="PATH",
+                        help="with --serve, listen on this Unix socket instead of host:port")
+    parser.add_argument("--query-cache", type=int, default=1024, metavar="N",
+                        help="with --serve, number of query responses kept in the LRU cache (default 1024)")
+    parser.add_argument("--reload-interval", type=float, default=2.0, metavar="SECONDS",
+                        help="with --serve, interval between two checks of the input file for hot reload "
+                             "(default 2, 0 = no reload)")
+    parser.add_argument("--force", action="store_true",
+                        help="run every pipeline stage again, ignoring cached results")
+    parser.add_argument("--no-plots", action="store_true",
+                        help="do not render figures (matplotlib is not imported)")
+    parser.add_argument("--no-browser", action="store_true",
+                        help="do not open the report in a web browser")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None,
+                        help="headless mode : write the summary and all totals as JSON or TSV instead of the HTML report "
+                             "(implies --no-plots and --no-browser)")
+    parser.add_argument("--output", default="-", metavar="FILE",
+                        help="output file of --format (default : standard output)")
+    parser.add_argument("--profile", action="store_true",
+                        help="measure each stage and write web_report/profile.json (also shown in the report)")
+    parser.add_argument("--profile-hook", action="append", default=[], metavar="STAGE=HOOK",
+                        help="attach a profiler to one stage, HOOK : cprofile or sample (implies --profile)")
+    args = parser.parse_args(argv)
+    for option, module, constant in LAZY_CHOICES:
+        value = getattr(args, option)
+        if value is not None and value != parser.get_default(option):
+            choices = getattr(importlib.import_module(module), constant)
+            if value not in choices:
+                parser.error(f"argument --{option.replace('_', '-')}: invalid choice: '{value}' "
+                             f"(choose from {', '.join(choices)})")
+    if args.format:
+        args.no_plots = args.no_browser = True
+    if args.normalize and args.streaming:
+        parser.error("--normalize needs the loaded matrix and cannot be used with --streaming")
+    if args.correlation and args.streaming:
+        parser.error("--correlation needs the loaded matrix and cannot be used with --streaming")
+    if args.join and args.tissues is not None:
+        parser.error("--tissues cannot be used with --join")
+    if args.state:
+        for option in ("normalize", "correlation", "join", "genes", "gene_pattern", "tissues", "min_total"):
+            if getattr(args, option) not in (None, False):
+                parser.error(f"--{option.replace('_', '-')} cannot be used with --state (only totals are kept)")
+    if args.serve:
+        for option in ("streaming", "normalize", "correlation", "join", "state", "format"):
+            if getattr(args, option) not in (None, False):
+                parser.error(f"--{option} cannot be used with --serve")
+        if len(args.paths) != 1:
+            parser.error("--serve expects a single input file")
+    if args.gene_pattern is not None:
+        try:
+            re.compile(args.gene_pattern)
+        except re.error as error:
+            parser.error(f"invalid --gene-pattern: {error}")
+    return args
+
+# ---------------------------------------------------------------
+# Pipeline stages : load -> summary (-> normalize, correlation) -> figures -> report
+# ---------------------------------------------------------------
+
+def summary_stage(matrix):
+    from stats_utils import compute_summary
+    return compute_summary(matrix.tissues, matrix)
+
+def streaming_summary_stage(path, counters=None, row_filter=None):
+    from io_utils import is_regular_file, merge_counters, new_counters, stream_matrix
+    from stats_utils import DuplicateGeneError, StreamingAggregator
+
+    # Same counters as the caller's (with or without timings), counted from zero
+    attempt = dict.fromkeys(counters or new_counters(), 0)
+    try:
+        tissues, rows = stream_matrix(path, counters=attempt, row_filter=row_filter)
+        result = StreamingAggregator(tissues).consume(rows).result()
+    except DuplicateGeneError as error:
+        if not is_regular_file(path):
+            raise SystemExit(f"{error} when the input cannot be read twice (run without --streaming)")
+
+        # Running totals cannot drop a row : the last row of each gene is located first,
+        # then only these rows are aggregated (the later row wins, as in load_matrix)
+        _, rows = stream_matrix(path, row_filter=row_filter)
+        last = {gene: i for i, (gene, _) in enumerate(rows)}
+        attempt = dict.fromkeys(attempt, 0)
+        tissues, rows = stream_matrix(path, counters=attempt, row_filter=row_filter)
+        rows = (row for i, row in enumerate(rows) if last[row[0]] == i)
+        result = StreamingAggregator(tissues).consume(rows).result()
+
+    if counters is not None:
+        merge_counters(counters, attempt)
+    return result
+
+def join_stage(*paths, how="inner", duplicates="error", row_filter=None, counters=None, storage="auto"):
+    from join_utils import load_joined
+    return load_joined(list(paths), how=how, duplicates=duplicates, row_filter=row_filter, counters=counters,
+                       storage=storage)
+
+def streaming_join_stage(*paths, how="inner", duplicates="error", row_filter=None, counters=None):
+    from join_utils import consume_joined
+    from stats_utils import StreamingAggregator
+
+    # Joined rows are aggregated as they are produced : the joined matrix is never built
+    return consume_joined(list(paths), lambda tissues, rows: StreamingAggregator(tissues).consume(rows).result(),
+                          how=how, duplicates=duplicates, row_filter=row_filter, counters=counters)
+
+def state_stage(state_path, *paths, counters=None):
+    from aggregate_utils import update_state
+
+    # Only the files not folded yet are read ; the state file is rewritten if it changed
+    state, _ = update_state(state_path, paths, counters=counters)
+    return state.result()
+
+def normalize_stage(matrix, result, n_top):
+    from normalization_utils import highly_variable_genes
+
+    # Library sizes are the tissue/cell totals of the summary ; blocks are normalized on the fly
+    return highly_variable_genes(matrix, n_top=n_top, sizes=result.tissue_totals)
+
+def correlation_stage(matrix, method, workers=1):
+    from correlation_utils import tissue_correlation
+    return tissue_correlation(matrix, method=method, workers=workers)
+
+def distribution_stage(matrix):
+    from distribution_utils import compute_distribution
+    from plotting import BOX_QUANTILES
+
+    # Quantiles of the counts of each tissue/cell drawn by the boxplot (see plotting.tissue_distribution_spec)
+    return compute_distribution(matrix, quantiles=BOX_QUANTILES).result()
+
+def figures_stage(result, *values, optional=(), report_dir=".", figure_format="png", dpi=300):
+
+    # Imported here : runs without figures never load the plotting code
+    from plotting import (tissue_total_spec, gene_total_spec, variable_gene_spec, correlation_heatmap_spec,
+                          gene_distribution_spec, tissue_distribution_spec, render_figures)
+
+    # Values of the optional inputs ("normalize", "correlation", "distribution"), in the order of 'optional'
+    values = dict(zip(optional, values))
+
+    # Bar plots for tissues/cells and genes, rendered in parallel (unchanged figures are not rendered again)
+    figures = [
+        tissue_total_spec(result, top_n=10, log_scale=True, dpi=dpi,
+                          output_path=os.path.join(report_dir, f"top_tissues.{figure_format}")),
+        gene_total_spec(result, top_n=10, log_scale=True, dpi=dpi,
+                        output_path=os.path.join(report_dir, f"top_genes.{figure_format}")),
+        gene_distribution_spec(result, dpi=dpi, output_path=os.path.join(report_dir, f"gene_distribution.{figure_format}")),
+    ]
+    if "normalize" in values:
+        figures.append(variable_gene_spec(values["normalize"], top_n=10, dpi=dpi,
+                                          output_path=os.path.join(report_dir, f"top_variable_genes.{figure_format}")))
+    if "correlation" in values:
+        figures.append(correlation_heatmap_spec(values["correlation"], dpi=dpi,
+                                                output_path=os.path.join(report_dir, f"tissue_correlation.{figure_format}")))
+    if "distribution" in values:
+        figures.append(tissue_distribution_spec(values["distribution"], dpi=dpi,
+                                                output_path=os.path.join(report_dir, f"tissue_distribution.{figure_format}")))
+    render_figures(figures)
+    return [spec["output_path"] for spec in figures]
+
+def report_stage(result, *values, optional=(), report_dir=".", path="", export_top=0, figure_format="png",
+                 profile=None):
+    from report_utils import generate_html_report
+
+    # Values of the optional inputs ("figures", "normalize", "correlation", "distribution"), in the order of 'optional'
+    values = dict(zip(optional, values))
+
+    # Export the rankings (top-k selection, no full sort)
+    if export_top:
+        write_ranking(os.path.join(report_dir, "top_tissues.tsv"), result.top_tissues(export_top), "tissue")
+        write_ranking(os.path.join(report_dir, "top_genes.tsv"), result.top_genes(export_top), "gene")
+
+    return generate_html_report(report_dir, path, result, export_top=export_top, figure_format=figure_format,
+                                profile=profile, plots="figures" in values, variable_genes=values.get("normalize"),
+                                correlation=values.get("correlation"), distribution=values.get("distribution"))
+
+def optional_inputs(args, *names):
+
+    # Optional stages enabled by the command-line options, in the order of 'names'
+    # The tissue/cell distribution needs the loaded matrix : it is only drawn with the figures of a loaded matrix
+    enabled = {"figures": not args.no_plots, "normalize": args.normalize, "correlation": bool(args.correlation),
+               "distribution": not (args.no_plots or args.streaming or args.state)}
+    return [name for name in names if enabled[name]]
+
+def load_filter(args):
+
+    """
+    Genes and tissues/cells selected on the command line, as stage parameters (empty without selection).
+    """
+
+    from io_utils import LoadFilter
+
+    row_filter = LoadFilter(genes=args.genes, gene_pattern=args.gene_pattern, tissues=args.tissues,
+                            min_total=args.min_total)
+    return {"row_filter": row_filter} if row_filter else {}
+
+def report_stage_def(args, path, report_dir, profile=None):
+    from pipeline_utils import Stage
+
+    # The measurements are a parameter of the report : a profiled run always writes the report again
+    report_files = [os.path.join(report_dir, "report.html")]
+    if args.export_top:
+        report_files += [os.path.join(report_dir, f"top_{axis}.tsv") for axis in ("tissues", "genes")]
+
+    params = {"report_dir": report_dir, "path": input_name(path), "export_top": args.export_top,
+              "figure_format": args.figure_format}
+    if profile:
+        params["profile"] = profile
+
+    optional = optional_inputs(args, "figures", "normalize", "correlation", "distribution")
+    params["optional"] = optional
+    return Stage("report", report_stage, inputs=["summary"] + optional, outputs=report_files, params=params,
+                 version=3)
+
+def pipeline_cache_dir(args, path, report_dir):
+    from cache_utils import cache_location
+    from io_utils import is_regular_file
+
+    if not args.format:
+        return os.path.join(report_dir, ".pipeline_cache")
+
+    # Headless mode writes nothing to the report directory : the summary is cached next to the matrix cache
+    # of the input file, and not at all without it (--no-cache, joined files, standard input)
+    if args.no_cache or isinstance(path, list) or not is_regular_file(path):
+        return None
+    return os.path.join(cache_location(path, args.cache_dir), "pipeline")
+
+def build_pipeline(args, path, report_dir, profiler=None, counters=None):
+
+    """
+    Declare the stages of the analysis of one matrix file.
+
+    Options that do not change the results (number of workers, matrix cache) are not stage parameters,
+    so changing them does not invalidate cached results.
+    'counters' (see io_utils.new_counters) is filled with the parsing counters of the matrix, if it is read.
+    'path' is a list of files with --join (joined into a single matrix) and --state (folded into the state).
+    """
+
+    from io_utils import load_matrix, is_regular_file
+    from pipeline_utils import Pipeline, Stage
+
+    pipeline = Pipeline(pipeline_cache_dir(args, path, report_dir), force=args.force or args.rebuild_cache,
+                        profiler=profiler)
+
+    if isinstance(path, list):
+        # One source per joined (or folded) file : changing any of them invalidates the matrix
+        sources = [f"matrix_file_{i}" for i in range(len(path))]
+        for name, source in zip(sources, path):
+            pipeline.source(name, source, cacheable=is_regular_file(source))
+        params = {"how": args.join, "duplicates": args.duplicates, **load_filter(args)}
+
+        if args.state:
+            # The key of the state file changes when a fold rewrites it : the next run folds nothing and is cached
+            pipeline.source("state_file", args.state, cacheable=os.path.exists(args.state))
+            summary = functools.partial(state_stage, counters=counters)
+            pipeline.add(Stage("summary", summary, inputs=["state_file"] + sources, version=2))
+        elif args.streaming:
+            summary = functools.partial(streaming_join_stage, counters=counters)
+            pipeline.add(Stage("summary", summary, inputs=sources, params=params, version=2))
+        else:
+            load = functools.partial(join_stage, counters=counters, storage=args.storage)
+            pipeline.add(Stage("load", load, inputs=sources, params=params, store=False))
+            pipeline.add(Stage("summary", summary_stage, inputs=["load"], version=2))
+
+    elif args.streaming:
+        pipeline.source("matrix_file", path, cacheable=is_regular_file(path))
+        summary = functools.partial(streaming_summary_stage, counters=counters)
+        pipeline.add(Stage("summary", summary, inputs=["matrix_file"], params=load_filter(args), version=2))
+    else:
+        pipeline.source("matrix_file", path, cacheable=is_regular_file(path))
+        load = functools.partial(load_matrix, workers=args.workers or None, cache=not args.no_cache,
+                                 cache_dir=args.cache_dir, rebuild_cache=args.rebuild_cache, counters=counters,
+                                 storage=args.storage)
+        pipeline.add(Stage("load", load, inputs=["matrix_file"], params=load_filter(args), store=False))
+        pipeline.add(Stage("summary", summary_stage, inputs=["load"], version=2))
+
+    if args.normalize:
+        from normalization_utils import N_TOP_GENES
+        pipeline.add(Stage("normalize", normalize_stage, inputs=["load", "summary"],
+                           params={"n_top": args.n_hvg or N_TOP_GENES}))
+
+    if args.correlation:
+        # The number of threads does not change the result : not a parameter
+        correlation = functools.partial(correlation_stage, workers=args.workers or os.cpu_count() or 1)
+        pipeline.add(Stage("correlation", correlation, inputs=["load"], params={"method": args.correlation}))
+
+    if optional_inputs(args, "distribution"):
+        pipeline.add(Stage("distribution", distribution_stage, inputs=["load"]))
+
+    if not args.no_plots:
+        names = ["tissues", "genes"] + (["variable_genes"] if args.normalize else [])
+        figure_files = [os.path.join(report_dir, f"top_{name}.{args.figure_format}") for name in names]
+        figure_files.append(os.path.join(report_dir, f"gene_distribution.{args.figure_format}"))
+        if args.correlation:
+            figure_files.append(os.path.join(report_dir, f"tissue_correlation.{args.figure_format}"))
+        if optional_inputs(args, "distribution"):
+            figure_files.append(os.path.join(report_dir, f"tissue_distribution.{args.figure_format}"))
+        optional = optional_inputs(args, "normalize", "correlation", "distribution")
+        pipeline.add(Stage("figures", figures_stage, inputs=["summary"] + optional, outputs=figure_files,
+                           params={"report_dir": report_dir, "figure_format": args.figure_format, "dpi": args.dpi,
+                                   "optional": optional}, version=2))
+
+    pipeline.add(report_stage_def(args, path, report_dir))
+
+    return pipeline
+
+def make_profiler(args, report_dir):
+
+    """
+    Profiler of the run, or None without --profile / --profile-hook.
+    """
+
+    if not (args.profile or args.profile_hook):
+        return None
+
+    from profiling_utils import Profiler
+
+    hooks = {}
+    for item in args.profile_hook:
+        stage, sep, hook = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--profile-hook expects STAGE=HOOK, got: {item}")
+        hooks[stage] = hook
+
+    try:
+        return Profiler(report_dir, hooks=hooks)
+    except ValueError as error:
+        raise SystemExit(str(error))
+
+def record_load(profiler, pipeline, path, result, counters):
+    from io_utils import is_regular_file
+
+    # Counters and throughput of the stage that read the matrix file, if it was not reused from a cache
+    stage = "summary" if "load" not in pipeline.stages else "load"
+    if pipeline.status.get(stage) != "computed":
+        return
+
+    profiler.records[stage]["counters"] = dict(counters)
+    if counters["lines"]:
+        profiler.add_throughput(stage, lines=counters["lines"], cells=result.n_genes * result.n_tissues)
+    if counters["lines"] and is_regular_file(path):
+        profiler.add_throughput(stage, bytes=os.path.getsize(path))
+
+def print_summary(path, result):
+
+    """
+    Print the summary of one matrix to the console.
+    """
+
+    summary = result.to_dict()
 
-# Read input file path from command-line argument
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <file.tsv or .tsv.gz>")
-        raise SystemExit(1)
-    
-    path = sys.argv[1]
-    report_dir = "web_report"
-    
-    print()
-    print("Expression matrix — summary report")
-    print("**********************************")
-  
-    # -----------------------------------
-    # PART 1 : Load the expression matrix
-    # -----------------------------------
-    
-    tissues, data = load_matrix(path)
-   
     print()
     print("Input data")
     print("**********")
-    print("File:", path)
-    print("Number of tissues/cells :", len(tissues))
-    print("Number of genes :", len(data))
-   
-    # ----------------------------------------------
-    # PART 2 : Compute totals and summary statistics
-    # ----------------------------------------------
-
-    # Total read counts per tissue/cell
-    tissue_totals = total_count_tissue(tissues, data)
-     
-    # Total read counts per gene
-    gene_totals = total_count_gene(data)
- 
-    # Summary of min/max values for genes and tissues
-    summary = summarize(tissues, data)
+    print("File:", input_name(path))
+    print("Number of tissues/cells :", result.n_tissues)
+    print("Number of genes :", result.n_genes)
+    print(f"Density (nonzero counts) : {result.density:.1%}")
 
     print()
     print("Gene-level total counts")
@@ -158,23 +587,321 @@ def main():
     print("Max total counts :", summary["tissues"]["max"]["value"])
     print("Tissue(s) :", ", ".join(summary["tissues"]["max"]["names"]))
 
+def print_profile(profiler, profile_file):
+    print()
+    print("Profile")
+    print("*******")
+    for record in profiler.to_list():
+        if record.get("cached"):
+            print(f"{record['stage']} : cached")
+        else:
+            rss = "n/a" if record["peak_rss_mb"] is None else f"{record['peak_rss_mb']:.1f} MB"
+            print(f"{record['stage']} : {record['wall_seconds']:.3f} s wall, {record['cpu_seconds']:.3f} s CPU, "
+                  f"peak RSS {rss}")
+            timers = [f"{name[:-len('_seconds')]} {value:.3f} s" for name, value in record.get("counters", {}).items()
+                      if name.endswith("_seconds")]
+            if timers:
+                print("   ", ", ".join(timers))
+    print("Written to", profile_file)
+
+def analyze(args, path, report_dir, verbose=True):
+
+    """
+    Run the pipeline of one matrix file and write its report to 'report_dir'.
+
+    In headless mode (--format), only the summary is computed and the report directory is not created
+    (unless --profile writes its measurements there).
+
+    Returns
+    -------
+    tuple : (SummaryResult, path of the HTML report or None in headless mode)
+    """
+
+    # Create the output directory if it does not already exist
+    if not args.format or args.profile or args.profile_hook:
+        os.makedirs(report_dir, exist_ok=True)
+    from io_utils import new_counters
+
+    profiler = make_profiler(args, report_dir)
+    counters = new_counters(timings=profiler is not None)
+    pipeline = build_pipeline(args, path, report_dir, profiler=profiler, counters=counters)
+
+    # ------------------------------------------------------------------------------
+    # PART 1 + 2 : Load the expression matrix, compute totals and summary statistics
+    # ------------------------------------------------------------------------------
+
+    # Totals per gene and per tissue/cell, min/max values and rankings
+    # (the matrix is only read if the cached summary is out of date)
+    result = pipeline.run("summary")
+    if verbose:
+        print_summary(path, result)
+
     # ---------------------------------------
     # PART 3 : Generate plots and HTML report
     # ---------------------------------------
 
-    # Create the output directory if it does not already exist
-    os.makedirs(report_dir, exist_ok=True)
+    if profiler is not None:
+        record_load(profiler, pipeline, path, result, counters)
 
-    # Generate and save the bar plot for tissues/cells
-    plot_tissue_total(tissue_totals, top_n=10, log_scale=True, output_path=os.path.join(report_dir, "top_tissues.png"))
-   
-    # Generate and save the bar plot for genes
-    plot_gene_total(gene_totals, top_n=10, log_scale=True, output_path=os.path.join(report_dir, "top_genes.png"))
+    report_file = None
+    if not args.format:
+        if profiler is not None:
+            if not args.no_plots:
+                pipeline.run("figures")
+            pipeline.add(report_stage_def(args, path, report_dir, profile=profiler.to_list()))
+
+        report_file = pipeline.run("report")
+
+    if profiler is not None:
+        profile_file = profiler.write(os.path.join(report_dir, "profile.json"))
+        if verbose:
+            print_profile(profiler, profile_file)
+
+    return result, report_file
+
+# ---------------------------------------------------------------
+# Batch mode : several matrices, one report directory per matrix
+# ---------------------------------------------------------------
+
+def expand_paths(patterns):
+
+    """
+    Expand glob patterns (quoted on the command line or on Windows) into the list of input files, in order.
+    """
+
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise SystemExit(f"No input file matches: {pattern}")
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+def report_dirs(paths, output_dir):
+
+    """
+    Name of the report directory of each input file : its file name without extension, made unique.
+    """
+
+    dirs = []
+    for path in paths:
+        name = os.path.basename(path)
+        for extension in (".gz", ".tsv", ".txt"):
+            if name.endswith(extension) and len(name) > len(extension):
+                name = name[:-len(extension)]
+        base, n = name, 1
+        while os.path.join(output_dir, name) in dirs:
+            n += 1
+            name = f"{base}_{n}"
+        dirs.append(os.path.join(output_dir, name))
+    return dirs
+
+def batch_task(args, path, report_dir):
+
+    """
+    Analyze one matrix of a batch, in a worker process.
+
+    Errors are returned instead of raised so that a failing matrix does not stop the batch.
+    """
+
+    try:
+        result, report_file = analyze(args, path, report_dir, verbose=False)
+    except Exception as error:
+        return {"path": path, "report_dir": report_dir, "error": f"{type(error).__name__}: {error}"}
+
+    summary = result.to_dict()
+    return {
+        "path": path,
+        "report_dir": report_dir,
+        "report": report_file,
+        "n_genes": result.n_genes,
+        "n_tissues": result.n_tissues,
+        "total": float(result.tissue_totals.sum()),
+        "density": result.density,
+        "genes": summary["genes"],
+        "tissues": summary["tissues"],
+    }
+
+def run_batch(args, paths, output_dir, workers=1):
+
+    """
+    Analyze several matrices in a pool of 'workers' processes.
+
+    Each worker holds one matrix at a time, so the peak memory is bounded by the number of workers.
+    A matrix whose analysis fails (error, or worker process killed) is reported in the index, the others are not affected.
+
+    Returns
+    -------
+    list[dict] : one entry per input file, in input order ("error" key for failed matrices)
+    """
+
+    dirs = report_dirs(paths, output_dir)
+    entries = {}
+
+    if workers == 1:
+        for path, report_dir in zip(paths, dirs):
+            entries[path] = batch_task(args, path, report_dir)
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(batch_task, args, path, report_dir): (path, report_dir)
+                       for path, report_dir in zip(paths, dirs)}
+            for future in as_completed(futures):
+                path, report_dir = futures[future]
+                try:
+                    entries[path] = future.result()
+                except Exception as error:
+                    # The worker process died (e.g. killed when out of memory)
+                    entries[path] = {"path": path, "report_dir": report_dir, "error": f"{type(error).__name__}: {error}"}
+
+    return [entries[path] for path in paths]
+
+def generate_index(output_dir, entries):
+
+    """
+    Generate the index page of a batch : one row per matrix comparing their summaries, with a link to each report.
+    """
+
+    def extreme(entry, axis, side):
+        names = ", ".join(escape(name) for name in entry[axis][side]["names"])
+        return f"{entry[axis][side]['value']:g} ({names})"
+
+    rows = []
+    for entry in entries:
+        name = escape(os.path.basename(entry["path"]))
+        if "error" in entry:
+            rows.append(f"<tr class=\"error\"><td>{name}</td><td colspan=\"8\">failed : {escape(entry['error'])}</td></tr>")
+            continue
+
+        link = os.path.relpath(entry["report"], output_dir).replace(os.sep, "/")
+        rows.append(
+            f"<tr><td><a href=\"{escape(link)}\">{name}</a></td>"
+            f"<td>{entry['n_genes']}</td><td>{entry['n_tissues']}</td><td>{entry['density']:.1%}</td><td>{entry['total']:g}</td>"
+            f"<td>{extreme(entry, 'genes', 'min')}</td><td>{extreme(entry, 'genes', 'max')}</td>"
+            f"<td>{extreme(entry, 'tissues', 'min')}</td><td>{extreme(entry, 'tissues', 'max')}</td></tr>")
+
+    failed = sum("error" in entry for entry in entries)
+    html = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Expression Matrices — Batch Report</title>
+    <style>
+    body {{
+        font-family: Arial, sans-serif;
+        margin: 40px;
+    }}
+
+    table {{
+        border-collapse: collapse;
+    }}
+
+    th, td {{
+        border: 1px solid #999;
+        padding: 4px 8px;
+        text-align: left;
+    }}
+
+    th {{
+        background-color: #fde7ef; /* rose pâle */
+    }}
+
+    tr.error td {{
+        color: #b00020;
+    }}
+</style>
+</head>
+<body>
+
+<h1>Expression Matrices — Batch Report</h1>
+<p>{len(entries)} matrices, {failed} failed.</p>
+
+<table>
+<tr><th>File</th><th>Genes</th><th>Tissues / cells</th><th>Density</th><th>Total counts</th>
+<th>Gene min</th><th>Gene max</th><th>Tissue / cell min</th><th>Tissue / cell max</th></tr>
+{chr(10).join(rows)}
+</table>
+
+</body>
+</html>
+"""
+    index_file = os.path.join(output_dir, "index.html")
+    with open(index_file, "w", encoding="utf-8") as f:
+        f.write(html)
+    return index_file
+
+# ---------------------------------------------------------------
+# Server mode : the matrix stays in memory and answers queries
+# ---------------------------------------------------------------
+
+def serve_matrix(args, paths):
+    from io_utils import load_matrix, is_regular_file
+    from server_utils import serve
+
+    if len(paths) != 1 or not is_regular_file(paths[0]):
+        raise SystemExit("--serve expects a single regular input file (it is watched for changes)")
+
+    # Each reload goes through the binary cache : only a changed file is parsed again
+    loader = functools.partial(load_matrix, workers=args.workers or None, cache=not args.no_cache,
+                               cache_dir=args.cache_dir, storage=args.storage, **load_filter(args))
+    serve(paths[0], host=args.host, port=args.port, unix_socket=args.socket, loader=loader,
+          cache_size=args.query_cache, reload_interval=args.reload_interval)
+
+# Read input file path from command-line argument
+def main(argv=None):
+    args = parse_args(argv)
+    paths = expand_paths(args.paths)
+    output_dir = args.output_dir
+
+    # With --join or --state, the input files are a single (joined or folded) matrix
+    if args.join or args.state:
+        paths = [paths]
+
+    if args.serve:
+        serve_matrix(args, paths)
+        return
+
+    # Headless mode : machine-readable summary, nothing else on the standard output
+    if args.format:
+        if len(paths) != 1:
+            raise SystemExit("--format expects a single input file (or --join)")
+        result, _ = analyze(args, paths[0], output_dir, verbose=False)
+
+        if args.output == "-":
+            write_summary(sys.stdout, paths[0], result, args.format)
+        else:
+            with open(args.output, "w", encoding="utf-8") as f:
+                write_summary(f, paths[0], result, args.format)
+        return
+
+    print()
+    print("Expression matrix — summary report")
+    print("**********************************")
+
+    if len(paths) == 1:
+        _, report_file = analyze(args, paths[0], output_dir)
+    else:
+        # One report directory per matrix and an index page comparing them
+        os.makedirs(output_dir, exist_ok=True)
+        entries = run_batch(args, paths, output_dir, workers=args.batch_workers or os.cpu_count() or 1)
+
+        print()
+        for entry in entries:
+            if "error" in entry:
+                print(f"{entry['path']} : FAILED ({entry['error']})")
+            else:
+                print(f"{entry['path']} : {entry['n_genes']} genes, {entry['n_tissues']} tissues/cells -> {entry['report']}")
+        report_file = generate_index(output_dir, entries)
 
-    # Generate the HTML report and open it in the default web browser
-    report_file = generate_html_report(report_dir, path, tissues, data)
+    # Open the report in the default web browser
     report_path = os.path.abspath(report_file)
-    webbrowser.open("file://" + report_path)
+    if args.no_browser:
+        print()
+        print("Report :", report_path)
+    else:
+        import webbrowser
+        webbrowser.open("file://" + report_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
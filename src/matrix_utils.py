@@ -0,0 +1,793 @@
+"""
+Columnar in-memory representation of a gene expression count matrix.
+
+Instead of one Python list of floats per gene, all counts are stored in a single
+contiguous 2-D NumPy array of shape (number of genes, number of tissues/cells).
+Each cell then costs 4 or 8 bytes instead of a boxed Python float, and totals per
+gene or per tissue/cell become vectorized reductions.
+
+The NumPy module is used for array storage and vectorized computations.
+
+Example
+-------
+- tissues = ['tissue1', 'tissue2', 'tissue3']
+- genes = ['GENE1', 'GENE2']
+- counts = [[63, 120, 5],
+            [0, 15, 2]]
+
+Notes
+-----
+The old '(tissues, data)' representation remains available through 'as_tuple()',
+where 'data' maps each gene to a view of its row in the count array.
+
+Zero-heavy matrices (e.g. single-cell data) can be stored as a SparseCountMatrix : only the nonzero counts
+are kept, in CSR layout (one run of values and column indices per gene). Memory and aggregation time are
+then proportional to the number of nonzero counts. 'load_matrix' chooses this storage automatically
+when the density measured on the first rows is below SPARSE_DENSITY_THRESHOLD (see MatrixBuilder).
+
+Several per-gene statistics (count, mean, std, ...) can be kept together in a StatStore,
+with one array per statistic.
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+# Storage types accepted for the count array
+DTYPES = {
+    "float32": np.float32,
+    "float64": np.float64,
+    "int32": np.int32,
+}
+
+# Storage modes of a count matrix
+STORAGES = ("auto", "dense", "sparse")
+
+# Below this fraction of nonzero counts, the "auto" storage keeps the matrix in sparse (CSR) form :
+# a nonzero cell then costs its value plus a 4-byte column index
+SPARSE_DENSITY_THRESHOLD = 0.3
+
+# Number of rows read before the "auto" storage measures the density and chooses dense or sparse
+DENSITY_SAMPLE_ROWS = 1024
+
+def resolve_dtype(dtype):
+
+    """
+    Convert a dtype name ('float32', 'float64', 'int32') or NumPy dtype into a NumPy dtype.
+    """
+
+    if isinstance(dtype, str):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype} (expected one of {', '.join(DTYPES)})")
+        return np.dtype(DTYPES[dtype])
+
+    dtype = np.dtype(dtype)
+    if dtype not in [np.dtype(t) for t in DTYPES.values()]:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    return dtype
+
+class CountMatrix:
+
+    """
+    Gene expression count matrix backed by a contiguous 2-D NumPy array.
+
+    Attributes
+    ----------
+    - tissues : list[str]
+      Names of tissues/cells corresponding to the columns of the matrix
+    - genes : list[str]
+      Names of genes corresponding to the rows of the matrix
+    - gene_index : dict[str, int]
+      Dictionary mapping each gene to its row in 'counts'
+    - counts : numpy.ndarray
+      Count array of shape (len(genes), len(tissues))
+
+    Notes
+    -----
+    For compatibility, a CountMatrix can be unpacked like the old return value of 'load_matrix':
+    tissues, data = matrix
+    """
+
+    def __init__(self, tissues, genes, counts):
+        counts = np.ascontiguousarray(counts)
+
+        if counts.ndim != 2:
+            raise ValueError("Counts must be a 2-D array")
+        if counts.shape != (len(genes), len(tissues)):
+            raise ValueError("Counts shape does not match number of genes and tissues/cells")
+
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.counts = counts
+        self._data = None
+
+    @classmethod
+    def from_dict(cls, tissues, data, dtype="float64"):
+
+        """
+        Build a CountMatrix from the old '(tissues, data)' representation.
+        """
+
+        builder = CountMatrixBuilder(tissues, dtype=dtype, capacity=max(len(data), 1))
+        for gene, counts in data.items():
+            builder.append(gene, counts)
+        return builder.build()
+
+    @property
+    def n_genes(self):
+        return len(self.genes)
+
+    @property
+    def n_tissues(self):
+        return len(self.tissues)
+
+    @property
+    def dtype(self):
+        return self.counts.dtype
+
+    @property
+    def nbytes(self):
+
+        """
+        Number of bytes used by the count array.
+        """
+
+        return self.counts.nbytes
+
+    def row(self, gene):
+
+        """
+        Return the counts of one gene as a view of its row in the count array.
+        """
+
+        return self.counts[self.gene_index[gene]]
+
+    def gene_totals(self):
+
+        """
+        Total counts per gene, as a float64 array aligned with 'genes'.
+        """
+
+        return self.counts.sum(axis=1, dtype=np.float64)
+
+    def tissue_totals(self):
+
+        """
+        Total counts per tissue/cell, as a float64 array aligned with 'tissues'.
+        """
+
+        return self.counts.sum(axis=0, dtype=np.float64)
+
+    def totals(self, block_rows=4096):
+
+        """
+        Compute total counts per gene and per tissue/cell in a single traversal of the count array.
+
+        Rows are processed by blocks : both sums are taken while a block is in the CPU cache.
+
+        Returns
+        -------
+        tuple: (gene_totals, tissue_totals), float64 arrays aligned with 'genes' and 'tissues'
+        """
+
+        gene_totals = np.empty(self.n_genes, dtype=np.float64)
+        tissue_totals = np.zeros(self.n_tissues, dtype=np.float64)
+
+        for start in range(0, self.n_genes, block_rows):
+            block = self.counts[start:start + block_rows]
+            block.sum(axis=1, dtype=np.float64, out=gene_totals[start:start + block_rows])
+            tissue_totals += block.sum(axis=0, dtype=np.float64)
+
+        return gene_totals, tissue_totals
+
+    @property
+    def nnz(self):
+
+        """
+        Number of nonzero counts.
+        """
+
+        return int(np.count_nonzero(self.counts))
+
+    @property
+    def density(self):
+
+        """
+        Fraction of nonzero counts (0.0 to 1.0).
+        """
+
+        size = self.n_genes * self.n_tissues
+        return self.nnz / size if size else 0.0
+
+    def select(self, rows=None, columns=None):
+
+        """
+        Sub-matrix of the given genes (row indices) and tissues/cells (column indices), in the given order.
+
+        Only the selected counts are copied : rows of a memory-mapped count array that are not selected are never read.
+        """
+
+        rows = np.arange(self.n_genes) if rows is None else np.asarray(rows, dtype=np.intp)
+        if columns is None:
+            return CountMatrix(self.tissues, [self.genes[i] for i in rows], self.counts[rows])
+
+        columns = np.asarray(columns, dtype=np.intp)
+        return CountMatrix([self.tissues[j] for j in columns], [self.genes[i] for i in rows],
+                           self.counts[np.ix_(rows, columns)])
+
+    def as_tuple(self):
+
+        """
+        Return the old '(tissues, data)' representation.
+
+        'data' maps each gene to a view of its row in the count array: no counts are copied.
+        """
+
+        if self._data is None:
+            self._data = {gene: self.counts[i] for i, gene in enumerate(self.genes)}
+        return self.tissues, self._data
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __repr__(self):
+        return f"CountMatrix(genes={self.n_genes}, tissues={self.n_tissues}, dtype={self.dtype})"
+
+class CountMatrixBuilder:
+
+    """
+    Incrementally fill a CountMatrix one gene row at a time.
+
+    Rows are written into a preallocated array whose capacity doubles when full,
+    so no per-gene Python list is kept while the file is read.
+    If a gene is appended twice, the later row overwrites the earlier one.
+    """
+
+    def __init__(self, tissues, dtype="float64", capacity=1024):
+        self.tissues = list(tissues)
+        self.dtype = resolve_dtype(dtype)
+        self.genes = []
+        self._index = {}
+        self._counts = np.empty((max(capacity, 1), len(self.tissues)), dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.genes)
+
+    def _grow(self):
+        grown = np.empty((2 * self._counts.shape[0], len(self.tissues)), dtype=self.dtype)
+        grown[:len(self.genes)] = self._counts[:len(self.genes)]
+        self._counts = grown
+
+    def append(self, gene, counts):
+        if len(counts) != len(self.tissues):
+            raise ValueError(f"Counts length does not match number of tissues/cells for gene {gene}")
+
+        row = self._index.get(gene)
+        if row is None:
+            row = len(self.genes)
+            if row == self._counts.shape[0]:
+                self._grow()
+            self.genes.append(gene)
+            self._index[gene] = row
+
+        self._counts[row] = counts
+
+    def extend(self, genes, counts):
+
+        """
+        Append a block of rows at once ('counts' has one row per gene in 'genes').
+
+        Rows are copied as a single block when no gene is repeated, otherwise one by one.
+        """
+
+        if len(genes) != len(counts):
+            raise ValueError("Number of genes does not match number of count rows")
+
+        duplicates = len(set(genes)) != len(genes) or any(gene in self._index for gene in genes)
+        if duplicates:
+            for gene, row in zip(genes, counts):
+                self.append(gene, row)
+            return
+
+        if len(genes) and np.shape(counts)[1] != len(self.tissues):
+            raise ValueError("Counts length does not match number of tissues/cells")
+
+        start = len(self.genes)
+        while start + len(genes) > self._counts.shape[0]:
+            self._grow()
+
+        self._counts[start:start + len(genes)] = counts
+        for i, gene in enumerate(genes, start):
+            self.genes.append(gene)
+            self._index[gene] = i
+
+    def build(self):
+        counts = self._counts
+
+        # Release the unused capacity without copying the filled rows
+        if counts.shape[0] != len(self.genes):
+            counts.resize((len(self.genes), len(self.tissues)), refcheck=False)
+
+        return CountMatrix(self.tissues, self.genes, counts)
+
+class SparseCountMatrix:
+
+    """
+    Gene expression count matrix storing only the nonzero counts, in CSR (compressed sparse row) layout.
+
+    The nonzero counts of gene i are values[indptr[i]:indptr[i + 1]], in the columns (tissues/cells)
+    indices[indptr[i]:indptr[i + 1]], in increasing column order.
+
+    It has the same interface as CountMatrix (names, totals, 'row', unpacking into '(tissues, data)'),
+    and totals are computed from the nonzero counts only, without building the dense array.
+
+    Attributes
+    ----------
+    - tissues, genes : list[str]
+    - gene_index : dict[str, int]
+    - indptr : numpy.ndarray (int64), length len(genes) + 1
+    - indices : numpy.ndarray (int32), column of each nonzero count
+    - values : numpy.ndarray, nonzero counts
+    """
+
+    def __init__(self, tissues, genes, indptr, indices, values):
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int32)
+        values = np.asarray(values)
+
+        if len(indptr) != len(genes) + 1 or indptr[0] != 0 or indptr[-1] != len(values):
+            raise ValueError("Row pointers do not match number of genes and nonzero counts")
+        if len(indices) != len(values):
+            raise ValueError("Column indices and values must have the same length")
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(tissues)):
+            raise ValueError("Column index out of range of the tissues/cells")
+
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self._data = None
+
+    @classmethod
+    def from_dense(cls, matrix, block_rows=4096):
+
+        """
+        Convert a CountMatrix to sparse storage, block of rows by block of rows
+        (a memory-mapped count array is never fully loaded).
+        """
+
+        counts = matrix.counts
+        row_nnz = np.empty(matrix.n_genes, dtype=np.int64)
+        indices, values = [], []
+
+        for start in range(0, matrix.n_genes, block_rows):
+            block = np.asarray(counts[start:start + block_rows])
+            rows, cols = np.nonzero(block)
+            row_nnz[start:start + len(block)] = np.bincount(rows, minlength=len(block))
+            indices.append(cols.astype(np.int32))
+            values.append(block[rows, cols])
+
+        indptr = np.zeros(matrix.n_genes + 1, dtype=np.int64)
+        np.cumsum(row_nnz, out=indptr[1:])
+        return cls(matrix.tissues, matrix.genes, indptr,
+                   np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                   np.concatenate(values) if values else np.empty(0, dtype=counts.dtype))
+
+    def to_dense(self):
+
+        """
+        Convert to a CountMatrix (dense 2-D array).
+        """
+
+        counts = np.zeros((self.n_genes, self.n_tissues), dtype=self.dtype)
+        counts[self._row_ids(), self.indices] = self.values
+        return CountMatrix(self.tissues, self.genes, counts)
+
+    @property
+    def n_genes(self):
+        return len(self.genes)
+
+    @property
+    def n_tissues(self):
+        return len(self.tissues)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+
+        """
+        Number of bytes used by the value, column index and row pointer arrays.
+        """
+
+        return self.values.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    @property
+    def density(self):
+        size = self.n_genes * self.n_tissues
+        return self.nnz / size if size else 0.0
+
+    def _row_ids(self):
+        return np.repeat(np.arange(self.n_genes), np.diff(self.indptr))
+
+    def row(self, gene):
+
+        """
+        Return the counts of one gene as a dense array (a new array, not a view).
+        """
+
+        i = self.gene_index[gene]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        counts = np.zeros(self.n_tissues, dtype=self.dtype)
+        counts[self.indices[start:end]] = self.values[start:end]
+        return counts
+
+    def gene_totals(self):
+
+        """
+        Total counts per gene, as a float64 array aligned with 'genes'.
+        """
+
+        totals = np.zeros(self.n_genes, dtype=np.float64)
+        starts = self.indptr[:-1]
+        filled = self.indptr[1:] > starts
+
+        # reduceat sums each run of values up to the start of the next nonempty row
+        if self.nnz:
+            totals[filled] = np.add.reduceat(self.values, starts[filled], dtype=np.float64)
+        return totals
+
+    def tissue_totals(self):
+
+        """
+        Total counts per tissue/cell, as a float64 array aligned with 'tissues'.
+        """
+
+        return np.bincount(self.indices, weights=self.values, minlength=self.n_tissues).astype(np.float64)
+
+    def totals(self, block_rows=4096):
+
+        """
+        Compute total counts per gene and per tissue/cell (same result as CountMatrix.totals).
+
+        Returns
+        -------
+        tuple: (gene_totals, tissue_totals), float64 arrays aligned with 'genes' and 'tissues'
+        """
+
+        return self.gene_totals(), self.tissue_totals()
+
+    def select(self, rows=None, columns=None):
+
+        """
+        Sub-matrix of the given genes (row indices) and tissues/cells (column indices), in the given order
+        (same result as CountMatrix.select), gathered from the nonzero counts only.
+        """
+
+        rows = np.arange(self.n_genes) if rows is None else np.asarray(rows, dtype=np.intp)
+
+        # Positions of the nonzero counts of the selected rows, run after run
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        row_ids = np.repeat(np.arange(len(rows)), lengths)
+        indices, values = self.indices[positions], self.values[positions]
+
+        tissues = self.tissues
+        if columns is not None:
+            columns = np.asarray(columns, dtype=np.intp)
+            tissues = [self.tissues[j] for j in columns]
+
+            # New index of each old column (-1 : dropped), then columns sorted again within each row
+            mapping = np.full(self.n_tissues, -1, dtype=np.int64)
+            mapping[columns] = np.arange(len(columns))
+            indices = mapping[indices]
+            kept = indices >= 0
+            indices, values, row_ids = indices[kept], values[kept], row_ids[kept]
+            if np.any(np.diff(columns) < 0):
+                order = np.lexsort((indices, row_ids))
+                indices, values = indices[order], values[order]
+
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_ids, minlength=len(rows)), out=indptr[1:])
+        return SparseCountMatrix(tissues, [self.genes[i] for i in rows], indptr, indices, values)
+
+    def as_tuple(self):
+
+        """
+        Return the old '(tissues, data)' representation.
+
+        'data' is a read-only mapping building the dense row of a gene when it is accessed.
+        """
+
+        if self._data is None:
+            self._data = SparseRows(self)
+        return self.tissues, self._data
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __repr__(self):
+        return (f"SparseCountMatrix(genes={self.n_genes}, tissues={self.n_tissues}, dtype={self.dtype}, "
+                f"density={self.density:.3f})")
+
+class SparseRows(Mapping):
+
+    """
+    Mapping gene -> dense counts of a SparseCountMatrix, built on access.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __getitem__(self, gene):
+        return self.matrix.row(gene)
+
+    def __iter__(self):
+        return iter(self.matrix.genes)
+
+    def __len__(self):
+        return self.matrix.n_genes
+
+# Count matrix classes accepted by the statistics functions
+MATRIX_TYPES = (CountMatrix, SparseCountMatrix)
+
+class SparseCountMatrixBuilder:
+
+    """
+    Incrementally fill a SparseCountMatrix, keeping only the nonzero counts.
+
+    Rows appended one at a time are buffered in a small dense block and compressed
+    'block_rows' rows at a time. As with CountMatrixBuilder, if a gene is appended twice, the later row
+    overwrites the earlier one : compressed rows cannot be overwritten in place, so every row is kept
+    and the earlier ones are dropped when the matrix is built.
+    """
+
+    def __init__(self, tissues, dtype="float64", block_rows=1024):
+        self.tissues = list(tissues)
+        self.dtype = resolve_dtype(dtype)
+        self.genes = []
+        self._index = {}
+        self._row_genes = []
+        self._row_nnz = []
+        self._indices = []
+        self._values = []
+        self._buffer = np.empty((block_rows, len(self.tissues)), dtype=self.dtype)
+        self._buffered = 0
+
+    def __len__(self):
+        return len(self.genes)
+
+    def _add_genes(self, genes):
+        # Gene -> its latest stored row
+        for gene in genes:
+            if gene not in self._index:
+                self.genes.append(gene)
+            self._index[gene] = len(self._row_genes)
+            self._row_genes.append(gene)
+
+    def _compress(self, counts):
+        rows, cols = np.nonzero(counts)
+        self._row_nnz.append(np.bincount(rows, minlength=len(counts)))
+        self._indices.append(cols.astype(np.int32))
+        self._values.append(counts[rows, cols])
+
+    def _flush(self):
+        if self._buffered:
+            self._compress(self._buffer[:self._buffered])
+            self._buffered = 0
+
+    def append(self, gene, counts):
+        if len(counts) != len(self.tissues):
+            raise ValueError(f"Counts length does not match number of tissues/cells for gene {gene}")
+
+        self._add_genes([gene])
+        self._buffer[self._buffered] = counts
+        self._buffered += 1
+        if self._buffered == len(self._buffer):
+            self._flush()
+
+    def extend(self, genes, counts):
+
+        """
+        Append a block of rows ('counts' is a dense 2-D block with one row per gene in 'genes').
+        """
+
+        counts = np.asarray(counts, dtype=self.dtype)
+        if len(genes) != len(counts):
+            raise ValueError("Number of genes does not match number of count rows")
+        if len(genes) and counts.shape[1] != len(self.tissues):
+            raise ValueError("Counts length does not match number of tissues/cells")
+
+        self._flush()
+        self._add_genes(genes)
+        self._compress(counts.reshape(len(genes), len(self.tissues)))
+
+    def build(self):
+        self._flush()
+
+        indptr = np.zeros(len(self._row_genes) + 1, dtype=np.int64)
+        if self._row_nnz:
+            np.cumsum(np.concatenate(self._row_nnz), out=indptr[1:])
+
+        indices = np.concatenate(self._indices) if self._indices else np.empty(0, dtype=np.int32)
+        values = np.concatenate(self._values) if self._values else np.empty(0, dtype=self.dtype)
+        matrix = SparseCountMatrix(self.tissues, self._row_genes, indptr, indices, values)
+
+        # Overwritten rows : only the latest row of each gene is kept, in order of first appearance
+        if len(self._row_genes) != len(self.genes):
+            matrix = matrix.select([self._index[gene] for gene in self.genes])
+        return matrix
+
+class MatrixBuilder:
+
+    """
+    Fill a count matrix row by row, with dense, sparse or automatically chosen storage.
+
+    With storage="auto", rows are first stored densely ; once 'sample_rows' rows have been read,
+    the fraction of nonzero counts is measured and, if it is below 'threshold', the rows read so far
+    are moved to sparse storage, which is used for the rest of the file. A matrix with fewer rows
+    than 'sample_rows' is measured as a whole when it is built.
+
+    Whatever the storage, a gene appended twice keeps its later row.
+    """
+
+    def __init__(self, tissues, dtype="float64", storage="auto",
+                 threshold=SPARSE_DENSITY_THRESHOLD, sample_rows=DENSITY_SAMPLE_ROWS):
+        if storage not in STORAGES:
+            raise ValueError(f"Unsupported storage: {storage} (expected one of {', '.join(STORAGES)})")
+
+        self.tissues = list(tissues)
+        self.dtype = resolve_dtype(dtype)
+        self.storage = storage
+        self.threshold = threshold
+        self.sample_rows = sample_rows
+
+        if storage == "sparse":
+            self._builder = SparseCountMatrixBuilder(tissues, dtype)
+        else:
+            self._builder = CountMatrixBuilder(tissues, dtype)
+
+    def __len__(self):
+        return len(self._builder)
+
+    @property
+    def sparse(self):
+        return isinstance(self._builder, SparseCountMatrixBuilder)
+
+    def _dense_density(self):
+        n = len(self._builder)
+        size = n * len(self.tissues)
+        return np.count_nonzero(self._builder._counts[:n]) / size if size else 1.0
+
+    def _switch_to_sparse(self):
+        dense = self._builder
+        n = len(dense)
+        self._builder = SparseCountMatrixBuilder(self.tissues, self.dtype)
+        self._builder.extend(dense.genes, dense._counts[:n])
+
+    def _decide(self):
+        # The storage is chosen once, on the first 'sample_rows' rows
+        if self.storage == "auto" and len(self._builder) >= self.sample_rows:
+            self.storage = "sparse" if self._dense_density() < self.threshold else "dense"
+            if self.storage == "sparse":
+                self._switch_to_sparse()
+
+    def append(self, gene, counts):
+        self._builder.append(gene, counts)
+        self._decide()
+
+    def extend(self, genes, counts):
+        self._builder.extend(genes, counts)
+        self._decide()
+
+    def build(self):
+        if self.storage == "auto" and len(self._builder) and self._dense_density() < self.threshold:
+            self._switch_to_sparse()
+        return self._builder.build()
+
+class StatStore:
+
+    """
+    Struct-of-arrays store of several per-gene statistics (count, mean, std, min, max, quartiles).
+
+    Each statistic is stored in its own 2-D array (genes x tissues/cells), all sharing the same
+    gene and tissue/cell order. A gene without a row for a statistic has NaN values for it (0 for int32).
+
+    Attributes
+    ----------
+    - tissues : list[str]
+    - genes : list[str]
+    - gene_index : dict[str, int]
+    - arrays : dict[str, numpy.ndarray]
+      Dictionary mapping each statistic to its array
+    """
+
+    def __init__(self, tissues, genes, arrays):
+        for stat, values in arrays.items():
+            if values.shape != (len(genes), len(tissues)):
+                raise ValueError(f"Shape of '{stat}' does not match number of genes and tissues/cells")
+
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.arrays = dict(arrays)
+
+    @property
+    def stats(self):
+        return list(self.arrays)
+
+    def __getitem__(self, stat):
+        return self.arrays[stat]
+
+    def __contains__(self, stat):
+        return stat in self.arrays
+
+    def matrix(self, stat="count"):
+
+        """
+        Return one statistic as a CountMatrix (no copy of the array).
+        """
+
+        return CountMatrix(self.tissues, self.genes, self.arrays[stat])
+
+    def __repr__(self):
+        return f"StatStore(genes={len(self.genes)}, tissues={len(self.tissues)}, stats={self.stats})"
+
+class StatStoreBuilder:
+
+    """
+    Incrementally fill a StatStore one (gene, stat) row at a time.
+
+    All statistic arrays grow together ; rows not (yet) filled hold NaN (0 for int32).
+    """
+
+    def __init__(self, tissues, stats, dtype="float64", capacity=1024):
+        self.tissues = list(tissues)
+        self.dtype = resolve_dtype(dtype)
+        self.fill = np.nan if self.dtype.kind == "f" else 0
+        self.genes = []
+        self._index = {}
+        self._arrays = {stat: np.full((max(capacity, 1), len(self.tissues)), self.fill, dtype=self.dtype)
+                        for stat in stats}
+
+    def _capacity(self):
+        return next(iter(self._arrays.values())).shape[0] if self._arrays else 0
+
+    def _grow(self):
+        for stat, values in self._arrays.items():
+            grown = np.full((2 * values.shape[0], len(self.tissues)), self.fill, dtype=self.dtype)
+            grown[:len(self.genes)] = values[:len(self.genes)]
+            self._arrays[stat] = grown
+
+    def append(self, gene, stat, values):
+        if len(values) != len(self.tissues):
+            raise ValueError(f"Values length does not match number of tissues/cells for gene {gene}")
+
+        row = self._index.get(gene)
+        if row is None:
+            row = len(self.genes)
+            if row == self._capacity():
+                self._grow()
+            self.genes.append(gene)
+            self._index[gene] = row
+
+        self._arrays[stat][row] = values
+
+    def build(self):
+        # Release the unused capacity without copying the filled rows
+        for values in self._arrays.values():
+            if values.shape[0] != len(self.genes):
+                values.resize((len(self.genes), len(self.tissues)), refcheck=False)
+
+        return StatStore(self.tissues, self.genes, self._arrays)
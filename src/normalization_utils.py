@@ -0,0 +1,292 @@
+"""
+Library-size normalization and selection of highly variable genes.
+
+Raw totals are hard to compare between tissues/cells sequenced at very different depths.
+This module provides:
+
+- CPM-like normalization : each count is divided by the total count of its tissue/cell (library size)
+  and multiplied by a common scale (1e6 : counts per million), then log1p-transformed.
+  Gene lengths are not part of the matrix, so length-corrected units (TPM) cannot be computed.
+- Selection of highly variable genes (mean/dispersion ranking with binning) : the mean and the dispersion
+  (variance / mean) of the normalized counts of each gene are computed, genes are grouped into bins of similar
+  mean, and the log dispersion of each gene is standardized within its bin (z-score). Genes with the highest
+  normalized dispersion are selected.
+
+All computations are vectorized and processed by blocks of rows, so a memory-mapped matrix is never fully loaded:
+- 'highly_variable_genes' normalizes each block on the fly : the normalized matrix is never stored
+- 'normalize_counts' returns the normalized matrix, in a new float32 array or in place
+  (the counts array is overwritten, a single float32 copy is made first if it is read-only or of integer type)
+Sparse matrices stay sparse : zeros are unchanged by the scaling and by log1p, so only nonzero counts are read.
+
+Example
+-------
+variable = highly_variable_genes(matrix, n_top=2000)
+variable.top(10)                                              # [(gene, normalized dispersion), ...]
+normalized = normalize_counts(matrix, inplace=True)          # log1p(CPM), no second matrix in memory
+"""
+
+import numpy as np
+
+from matrix_utils import CountMatrix, SparseCountMatrix, resolve_dtype
+from stats_utils import top_k_indices
+
+# Library size after scaling (counts per million)
+CPM_SCALE = 1e6
+
+# Default number of selected genes and of mean bins
+N_TOP_GENES = 2000
+N_BINS = 20
+
+# Number of rows normalized at once
+BLOCK_ROWS = 4096
+
+def library_sizes(matrix):
+
+    """
+    Total count of each tissue/cell (column), as a float64 array aligned with 'tissues'.
+    """
+
+    return matrix.tissue_totals()
+
+def scale_factors(sizes, scale=CPM_SCALE):
+
+    """
+    Factor applied to the counts of each tissue/cell : scale / library size (0 for empty tissues/cells).
+    """
+
+    sizes = np.asarray(sizes, dtype=np.float64)
+    factors = np.zeros(len(sizes), dtype=np.float64)
+    np.divide(scale, sizes, out=factors, where=sizes > 0)
+    return factors
+
+# ---------------------------------------------------------------------
+# PART 1 : Normalization
+# ---------------------------------------------------------------------
+
+def normalize_block(block, factors, log=True, out=None):
+
+    """
+    Scale a block of rows (genes x tissues/cells) by the column factors and apply log1p, in 'out' if given.
+    """
+
+    out = np.multiply(block, factors, out=out, casting="unsafe")
+    if log:
+        np.log1p(out, out=out)
+    return out
+
+def writable_float(array, dtype=np.float32):
+
+    # The array itself if it can receive normalized values, else a single copy
+    if array.flags.writeable and np.issubdtype(array.dtype, np.floating):
+        return array
+    return np.array(array, dtype=dtype)
+
+def normalize_counts(matrix, scale=CPM_SCALE, log=True, sizes=None, inplace=False, dtype="float32",
+                     block_rows=BLOCK_ROWS):
+
+    """
+    Normalize a CountMatrix or SparseCountMatrix by library size (counts per 'scale') and log1p-transform it.
+
+    Parameters
+    ----------
+    - sizes : numpy.ndarray or None
+      Library sizes (default : total count of each tissue/cell, e.g. SummaryResult.tissue_totals)
+    - inplace : bool
+      Write the normalized values into the count array of 'matrix' instead of a new array,
+      so that memory is not doubled (the array is first copied once as 'dtype' if it is read-only,
+      e.g. memory-mapped from the binary cache, or of integer type)
+    - dtype : str
+      Storage type of the normalized values when a new array is allocated
+
+    Returns
+    -------
+    CountMatrix or SparseCountMatrix : normalized matrix (with inplace=True, 'matrix' itself when possible)
+    """
+
+    dtype = resolve_dtype(dtype)
+    factors = scale_factors(library_sizes(matrix) if sizes is None else sizes, scale)
+    if len(factors) != matrix.n_tissues:
+        raise ValueError("Library sizes length does not match number of tissues/cells")
+
+    if isinstance(matrix, SparseCountMatrix):
+        values = writable_float(matrix.values, dtype) if inplace else np.empty(matrix.nnz, dtype=dtype)
+        for start in range(0, matrix.nnz, block_rows * 64):
+            end = start + block_rows * 64
+            normalize_block(matrix.values[start:end], factors[matrix.indices[start:end]], log, out=values[start:end])
+
+        if inplace and values is matrix.values:
+            return matrix
+        return SparseCountMatrix(matrix.tissues, matrix.genes, matrix.indptr, matrix.indices, values)
+
+    if not isinstance(matrix, CountMatrix):
+        raise TypeError(f"Expected a CountMatrix or SparseCountMatrix, got {type(matrix).__name__}")
+
+    counts = matrix.counts
+    output = writable_float(counts, dtype) if inplace else np.empty(counts.shape, dtype=dtype)
+    for start in range(0, matrix.n_genes, block_rows):
+        end = start + block_rows
+        normalize_block(counts[start:end], factors, log, out=output[start:end])
+
+    if inplace and output is counts:
+        return matrix
+    return CountMatrix(matrix.tissues, matrix.genes, output)
+
+# ---------------------------------------------------------------------
+# PART 2 : Highly variable genes
+# ---------------------------------------------------------------------
+
+class VariableGenes:
+
+    """
+    Mean, dispersion and normalized dispersion of the normalized counts of each gene.
+
+    Attributes
+    ----------
+    - genes : list[str]
+    - means, dispersions : numpy.ndarray (float64)
+      Mean and log dispersion (log of variance / mean, NaN for genes never expressed) aligned with 'genes'
+    - dispersions_norm : numpy.ndarray (float64)
+      Log dispersion standardized within the bin of genes of similar mean (NaN for genes never expressed)
+    - selected : numpy.ndarray (int)
+      Indices of the highly variable genes, by decreasing normalized dispersion
+    """
+
+    def __init__(self, genes, means, dispersions, dispersions_norm, selected):
+        self.genes = list(genes)
+        self.means = means
+        self.dispersions = dispersions
+        self.dispersions_norm = dispersions_norm
+        self.selected = selected
+
+    @property
+    def n_selected(self):
+        return len(self.selected)
+
+    def top(self, n=None):
+
+        """
+        list[tuple[str, float]] : The 'n' most variable genes (all selected genes if None)
+        with their normalized dispersion, in ranking order.
+        """
+
+        return [(self.genes[i], float(self.dispersions_norm[i])) for i in self.selected[:n]]
+
+    def to_dict(self):
+        return {
+            "genes": [
+                {"name": self.genes[i], "mean": float(self.means[i]), "dispersion": float(self.dispersions[i]),
+                 "dispersion_norm": float(self.dispersions_norm[i])}
+                for i in self.selected
+            ]
+        }
+
+    def __repr__(self):
+        return f"VariableGenes(genes={len(self.genes)}, selected={self.n_selected})"
+
+def gene_moments(matrix, factors=None, log=True, block_rows=BLOCK_ROWS):
+
+    """
+    Mean and variance (ddof=0) of each gene, optionally of its normalized counts ('factors' : see scale_factors),
+    computed by blocks of rows : the normalized matrix is never stored.
+
+    Returns
+    -------
+    tuple: (means, variances), float64 arrays aligned with 'genes'
+    """
+
+    means = np.zeros(matrix.n_genes, dtype=np.float64)
+    variances = np.zeros(matrix.n_genes, dtype=np.float64)
+    if not matrix.n_tissues:
+        return means, variances
+
+    sparse = isinstance(matrix, SparseCountMatrix)
+    for start in range(0, matrix.n_genes, block_rows):
+        end = min(start + block_rows, matrix.n_genes)
+
+        if sparse:
+            # Zeros stay zeros and contribute n_zero * mean^2 to the sum of squared deviations
+            low, high = matrix.indptr[start], matrix.indptr[end]
+            indices = matrix.indices[low:high]
+            values = matrix.values[low:high].astype(np.float64)
+            if factors is not None:
+                values = normalize_block(values, factors[indices], log, out=values)
+            row_nnz = np.diff(matrix.indptr[start:end + 1])
+            rows = np.repeat(np.arange(end - start), row_nnz)
+            block_means = np.bincount(rows, weights=values, minlength=end - start) / matrix.n_tissues
+            squares = np.bincount(rows, weights=(values - block_means[rows]) ** 2, minlength=end - start)
+            means[start:end] = block_means
+            variances[start:end] = (squares + (matrix.n_tissues - row_nnz) * block_means ** 2) / matrix.n_tissues
+            continue
+
+        block = matrix.counts[start:end]
+        if factors is not None:
+            block = normalize_block(block, factors, log, out=np.empty(block.shape, dtype=np.float64))
+        means[start:end] = block.mean(axis=1, dtype=np.float64)
+        variances[start:end] = block.var(axis=1, dtype=np.float64)
+
+    return means, variances
+
+def binned_zscores(values, bins):
+
+    """
+    Standardize values within groups : (value - group mean) / group standard deviation (ddof=1).
+
+    Groups with a single value or without spread get a z-score of 0.
+    """
+
+    n_bins = int(bins.max()) + 1 if len(bins) else 0
+    counts = np.bincount(bins, minlength=n_bins)
+    means = np.bincount(bins, weights=values, minlength=n_bins) / np.maximum(counts, 1)
+    squares = np.bincount(bins, weights=(values - means[bins]) ** 2, minlength=n_bins)
+    stds = np.sqrt(squares / np.maximum(counts - 1, 1))
+
+    zscores = np.zeros(len(values), dtype=np.float64)
+    spread = stds[bins] > 0
+    zscores[spread] = (values[spread] - means[bins][spread]) / stds[bins][spread]
+    return zscores
+
+def highly_variable_genes(matrix, n_top=N_TOP_GENES, n_bins=N_BINS, normalize=True, scale=CPM_SCALE, sizes=None,
+                          block_rows=BLOCK_ROWS):
+
+    """
+    Select the genes whose normalized counts vary the most, relative to genes of similar mean expression.
+
+    Parameters
+    ----------
+    - n_top : int
+      Number of genes selected (genes never expressed are never selected)
+    - n_bins : int
+      Number of bins of equal width over the gene means
+    - normalize : bool
+      Normalize the counts by library size and log1p (on the fly, block by block) ;
+      False if 'matrix' is already normalized (e.g. by 'normalize_counts')
+    - sizes : numpy.ndarray or None
+      Library sizes (default : total count of each tissue/cell)
+
+    Returns
+    -------
+    VariableGenes
+    """
+
+    factors = None
+    if normalize:
+        factors = scale_factors(library_sizes(matrix) if sizes is None else sizes, scale)
+
+    means, variances = gene_moments(matrix, factors, block_rows=block_rows)
+
+    dispersions = np.full(matrix.n_genes, np.nan)
+    expressed = means > 0
+    dispersions[expressed] = np.log(np.maximum(variances[expressed], 1e-300) / means[expressed])
+
+    dispersions_norm = np.full(matrix.n_genes, np.nan)
+    if expressed.any():
+        expressed_means = means[expressed]
+        edges = np.linspace(expressed_means.min(), expressed_means.max(), n_bins + 1)
+        bins = np.clip(np.searchsorted(edges, expressed_means, side="right") - 1, 0, n_bins - 1)
+        dispersions_norm[expressed] = binned_zscores(dispersions[expressed], bins)
+
+    # Partial selection among the expressed genes
+    candidates = np.flatnonzero(expressed)
+    selected = candidates[top_k_indices(dispersions_norm[candidates], min(n_top, len(candidates)))]
+
+    return VariableGenes(matrix.genes, means, dispersions, dispersions_norm, selected)
@@ -0,0 +1,400 @@
+"""
+Multi-core parsing of large count matrices.
+
+Parsing (split on tabs, float conversion) dominates the loading time of large matrices.
+This module distributes it over a pool of worker processes:
+
+- Plain .tsv : the file is split into byte ranges aligned on newlines,
+  each range is read and parsed independently by a worker.
+- .tsv.gz : a single gzip stream cannot be decompressed in parallel, so the main process
+  decompresses it and sends large blocks of complete lines to the workers (pipelined decompress-and-parse).
+- Block-gzipped .tsv.gz (BGZF, as produced by 'bgzip') : the file is a series of small independent
+  gzip members, so ranges of blocks are decompressed and parsed by the workers themselves.
+
+Partial results are merged in file order, so the resulting CountMatrix is identical to the one built by 'load_matrix'.
+A LoadFilter (see io_utils) is applied by the workers while they parse : only the kept rows and columns are sent back.
+
+The concurrent.futures module provides the process pool.
+The struct and zlib modules are used to read and write BGZF blocks.
+"""
+
+import gzip
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from io_utils import iter_count_rows, parse_header, read_header, new_counters, merge_counters, is_gzip, LoadFilter
+from matrix_utils import MatrixBuilder, resolve_dtype
+
+# Default amount of text (bytes) parsed by one task
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Fixed part of a BGZF block header (gzip header with a 'BC' extra subfield)
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# Maximum amount of uncompressed data in one BGZF block (same value as bgzip)
+BGZF_BLOCK_SIZE = 0xff00
+
+def default_workers():
+    return os.cpu_count() or 1
+
+# ---------------------------------------------------------------------
+# PART 1 : Parsing of a block of text (run in the worker processes)
+# ---------------------------------------------------------------------
+
+def parse_lines(text, n_tissues, dtype, row_filter=None, columns=None):
+
+    """
+    Parse the count rows contained in a block of complete lines, filtered with 'row_filter' and 'columns'
+    (see io_utils.iter_stat_rows) : 'n_tissues' is then the number of kept columns.
+
+    Returns
+    -------
+    tuple:
+    - genes : list[str]
+    - counts : numpy.ndarray of shape (len(genes), n_tissues)
+    - counters : dict, parsing counters (see io_utils.new_counters)
+    """
+
+    genes = []
+    counters = new_counters()
+
+    # Blocks are decoded from bytes : CRLF line endings are translated as in the text mode of the serial loader
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    counts = np.empty((len(lines), n_tissues), dtype=dtype)
+
+    for gene, values in iter_count_rows(lines, counters, row_filter, columns):
+        if len(values) != n_tissues:
+            raise ValueError(f"Counts length does not match number of tissues/cells for gene {gene}")
+        counts[len(genes)] = values
+        genes.append(gene)
+
+    return genes, counts[:len(genes)].copy(), counters
+
+def split_fragments(data):
+
+    """
+    Split a block of bytes into (head, body, tail) where 'body' contains only complete lines.
+
+    'head' is the text before the first newline (the end of a line started in the previous block)
+    and 'tail' the text after the last newline (the start of a line continued in the next block).
+    If the block contains no newline, 'body' and 'tail' are None.
+    """
+
+    first = data.find(b"\n")
+    if first < 0:
+        return data, None, None
+
+    last = data.rfind(b"\n")
+    return data[:first], data[first + 1:last + 1], data[last + 1:]
+
+def parse_byte_range(path, start, end, n_tissues, dtype, row_filter=None, columns=None):
+
+    """
+    Worker task : parse the lines of a plain text file between two byte offsets aligned on newlines.
+    """
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    return parse_lines(text, n_tissues, dtype, row_filter, columns)
+
+def parse_text_block(text, n_tissues, dtype, row_filter=None, columns=None):
+
+    """
+    Worker task : parse a block of complete lines sent by the main process.
+    """
+
+    return parse_lines(text, n_tissues, dtype, row_filter, columns)
+
+def parse_bgzf_blocks(path, start, end, n_tissues, dtype, row_filter=None, columns=None):
+
+    """
+    Worker task : decompress and parse a range of BGZF blocks.
+
+    Lines (and multi-byte characters) may cross block ranges, so the incomplete first and last lines
+    are returned as raw bytes and stitched together by the main process.
+
+    Returns
+    -------
+    tuple: (head, genes, counts, counters, tail), see 'split_fragments'
+    """
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+
+    head, body, tail = split_fragments(gzip.decompress(raw))
+    if body is None:
+        return head, [], np.empty((0, n_tissues), dtype=dtype), new_counters(), None
+
+    genes, counts, counters = parse_lines(body.decode("utf-8"), n_tissues, dtype, row_filter, columns)
+    return head, genes, counts, counters, tail
+
+# ---------------------------------------------------------------------
+# PART 2 : Splitting of the input into independent tasks
+# ---------------------------------------------------------------------
+
+def newline_ranges(path, start, chunk_size=CHUNK_SIZE):
+
+    """
+    Split a plain text file into byte ranges [start, end) of about 'chunk_size' bytes, each ending on a newline.
+    """
+
+    size = os.path.getsize(path)
+    ranges = []
+
+    with open(path, "rb") as f:
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                # Move the end of the range to the next newline
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+def is_bgzf(path):
+
+    """
+    Return True if the file starts with a BGZF block header.
+    """
+
+    with open(path, "rb") as f:
+        header = f.read(16)
+    return len(header) == 16 and header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+def bgzf_blocks(path):
+
+    """
+    List the (offset, size) of every block of a BGZF file by reading the block headers only.
+    """
+
+    blocks = []
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != BGZF_MAGIC:
+                raise ValueError(f"Invalid BGZF block at offset {offset}")
+
+            # Look for the 'BC' subfield giving the total block size - 1
+            xlen = struct.unpack("<H", header[10:12])[0]
+            extra = f.read(xlen)
+            block_size = None
+            pos = 0
+            while pos + 4 <= len(extra):
+                si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+                if si1 == 66 and si2 == 67 and slen == 2:
+                    block_size = struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+                pos += 4 + slen
+            if block_size is None:
+                raise ValueError(f"Missing BGZF block size at offset {offset}")
+
+            blocks.append((offset, block_size))
+            offset += block_size
+
+    return blocks
+
+def block_ranges(blocks, chunk_size=CHUNK_SIZE):
+
+    """
+    Group consecutive BGZF blocks into byte ranges [start, end) of about 'chunk_size' compressed bytes.
+    """
+
+    ranges = []
+    start = None
+    for offset, size in blocks:
+        if start is None:
+            start = offset
+        end = offset + size
+        if end - start >= chunk_size:
+            ranges.append((start, end))
+            start = None
+    if start is not None:
+        ranges.append((start, blocks[-1][0] + blocks[-1][1]))
+    return ranges
+
+def bgzf_block(data):
+
+    """
+    Compress bytes into a single BGZF block (a gzip member whose header records its own size).
+    """
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = 18 + len(deflated) + 8
+
+    header = BGZF_MAGIC + struct.pack("<IBBHBBHH", 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+    footer = struct.pack("<II", zlib.crc32(data), len(data))
+    return header + deflated + footer
+
+def bgzf_compress(src_path, dst_path):
+
+    """
+    Write a block-gzipped (BGZF) copy of a plain text file, readable by gzip and by 'load_bgzf_parallel'.
+    """
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        while True:
+            data = src.read(BGZF_BLOCK_SIZE)
+            if not data:
+                break
+            dst.write(bgzf_block(data))
+
+        # Empty end-of-file block
+        dst.write(bgzf_block(b""))
+
+# ---------------------------------------------------------------------
+# PART 3 : Parallel loaders
+# ---------------------------------------------------------------------
+
+def merge_part(builder, counters, part):
+
+    """
+    Append the rows parsed by one task and add its parsing counters.
+    """
+
+    genes, counts, part_counters = part
+    builder.extend(genes, counts)
+    if counters is not None:
+        merge_counters(counters, part_counters)
+
+def load_tsv_parallel(path, dtype, workers, chunk_size, counters=None, storage="dense", row_filter=None):
+    # Read the header and the byte offset of the first data line
+    with open(path, "rb") as f:
+        tissues, columns = row_filter.project(parse_header(f.readline().decode("utf-8")))
+        start = f.tell()
+
+    builder = MatrixBuilder(tissues, dtype=dtype, storage=storage)
+    ranges = newline_ranges(path, start, chunk_size)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_byte_range, path, s, e, len(tissues), dtype, row_filter, columns)
+                   for s, e in ranges]
+
+        # Merge partial results in file order
+        for future in futures:
+            merge_part(builder, counters, future.result())
+
+    return builder.build()
+
+def load_gzip_pipelined(path, dtype, workers, chunk_size, counters=None, storage="dense", row_filter=None):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        tissues, columns = row_filter.project(read_header(f))
+        builder = MatrixBuilder(tissues, dtype=dtype, storage=storage)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            carry = ""
+
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    break
+
+                # Send only complete lines, keep the last partial line for the next block
+                block = carry + block
+                cut = block.rfind("\n") + 1
+                carry = block[cut:]
+                if cut:
+                    pending.append(pool.submit(parse_text_block, block[:cut], len(tissues), dtype, row_filter, columns))
+
+                # Bounded number of blocks in flight : decompression waits for the parsers (backpressure)
+                while len(pending) > 2 * workers:
+                    merge_part(builder, counters, pending.pop(0).result())
+
+            if carry:
+                pending.append(pool.submit(parse_text_block, carry, len(tissues), dtype, row_filter, columns))
+
+            for future in pending:
+                merge_part(builder, counters, future.result())
+
+    return builder.build()
+
+def load_bgzf_parallel(path, dtype, workers, chunk_size, counters=None, storage="dense", row_filter=None):
+    ranges = block_ranges(bgzf_blocks(path), chunk_size)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # The number of tissues is needed by the workers, so the header is read first
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            tissues, columns = row_filter.project(read_header(f))
+        n_tissues = len(tissues)
+        builder = MatrixBuilder(tissues, dtype=dtype, storage=storage)
+
+        futures = [pool.submit(parse_bgzf_blocks, path, s, e, n_tissues, dtype, row_filter, columns)
+                   for s, e in ranges]
+
+        # Lines crossing range boundaries are rebuilt from the fragments and parsed here
+        carry = b""
+        header_done = False
+        for future in futures:
+            head, genes, counts, part_counters, tail = future.result()
+
+            # No newline in this range : the current line continues in the next one
+            if tail is None:
+                carry += head
+                continue
+
+            # The first complete line is the header, already read
+            if header_done:
+                merge_part(builder, counters, parse_lines((carry + head).decode("utf-8"), n_tissues, dtype,
+                                                          row_filter, columns))
+            header_done = True
+
+            merge_part(builder, counters, (genes, counts, part_counters))
+            carry = tail
+
+        if carry and header_done:
+            merge_part(builder, counters, parse_lines(carry.decode("utf-8"), n_tissues, dtype, row_filter, columns))
+
+    return builder.build()
+
+def load_matrix_parallel(path, dtype="float64", workers=None, chunk_size=CHUNK_SIZE, counters=None, storage="dense",
+                         row_filter=None):
+
+    """
+    Load a count matrix using a pool of worker processes.
+
+    The file type is detected automatically from its first bytes (plain .tsv, gzip or BGZF .tsv.gz).
+
+    Parameters
+    ----------
+    - workers : int or None
+      Number of worker processes (default : number of CPU cores)
+    - chunk_size : int
+      Approximate number of bytes parsed by one task
+    - counters : dict or None
+      Filled with the parsing counters of all tasks (see io_utils.new_counters)
+    - storage : "dense", "sparse" or "auto"
+      Storage of the matrix (see matrix_utils.MatrixBuilder)
+    - row_filter : LoadFilter or None
+      Genes and tissues/cells kept (see io_utils.LoadFilter), applied by the workers
+
+    Returns
+    -------
+    CountMatrix or SparseCountMatrix : identical to the matrix returned by 'load_matrix'
+    """
+
+    dtype = resolve_dtype(dtype)
+    workers = workers or default_workers()
+    row_filter = row_filter or LoadFilter()
+
+    if not is_gzip(path):
+        return load_tsv_parallel(path, dtype, workers, chunk_size, counters, storage, row_filter)
+    if is_bgzf(path):
+        return load_bgzf_parallel(path, dtype, workers, chunk_size, counters, storage, row_filter)
+    return load_gzip_pipelined(path, dtype, workers, chunk_size, counters, storage, row_filter)
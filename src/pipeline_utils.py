@@ -0,0 +1,206 @@
+"""
+Incremental execution of the analysis pipeline as a graph of named stages.
+
+Each stage declares its inputs (other stages or source files), its parameters and the files it writes.
+Its result (artifact) is stored in a local cache under a key computed from:
+- the name and version of the stage,
+- its parameters,
+- the keys of its inputs (for a source file : its fingerprint, see cache_utils).
+
+Keys are computed without running anything, so a rerun only executes the stages whose key changed
+(or whose artifact/output files are missing) : changing a report option reruns the report stage only,
+reusing the cached summary without reading the input matrix again.
+
+Example
+-------
+pipeline = Pipeline(".pipeline_cache")
+pipeline.source("matrix_file", "data/ARCHS4.tsv")
+pipeline.add(Stage("summary", summarize_file, inputs=["matrix_file"]))
+pipeline.add(Stage("report", write_report, inputs=["summary"], params={"top_n": 10}, outputs=["report.html"]))
+pipeline.run("report")
+pipeline.status   # {"summary": "cached", "report": "computed", ...}
+
+With cache_dir=None, no artifact is read or written : each stage runs once per run.
+
+With a Profiler (see profiling_utils), the execution of each stage is measured (time, CPU, memory)
+and the stages reused from the cache are recorded as cached.
+
+The pickle module is used to store artifacts and the hashlib/json modules to compute stage keys.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+from cache_utils import file_fingerprint
+
+class Stage:
+
+    """
+    A named step of the pipeline.
+
+    Parameters
+    ----------
+    - name : str
+    - func : callable
+      Called as func(*input_values, **params)
+    - inputs : list[str]
+      Names of the stages or sources whose values are passed to 'func', in order
+    - params : dict
+      Parameters of the stage (must be JSON-serializable) ; any change invalidates the stage
+    - outputs : list[str]
+      Files written by the stage ; the stage is executed again if one of them is missing
+    - store : bool
+      Store the returned value in the artifact cache (False for values that have their own cache)
+    - version : int
+      Bump it when the code of the stage changes
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, outputs=(), store=True, version=1):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.outputs = list(outputs)
+        self.store = store
+        self.version = version
+
+class Pipeline:
+
+    """
+    Graph of stages with an artifact cache.
+
+    Attributes
+    ----------
+    - status : dict[str, str]
+      Dictionary mapping each stage used by the last 'run' to "computed" or "cached"
+    - profiler : profiling_utils.Profiler or None
+      Profiler measuring the execution of each stage
+    """
+
+    def __init__(self, cache_dir, force=False, profiler=None):
+        self.cache_dir = cache_dir
+        self.force = force
+        self.profiler = profiler
+        self.stages = {}
+        self.sources = {}
+        self.status = {}
+        self._keys = {}
+        self._values = {}
+
+    def source(self, name, path, cacheable=True):
+
+        """
+        Declare an input file. Its key is the fingerprint of the file (size, mtime, content hash).
+
+        An input that cannot be fingerprinted (standard input, pipe) is declared with cacheable=False :
+        it gets a new key on every run, so the stages depending on it are always executed.
+        """
+
+        self.sources[name] = path
+        self._keys.pop(name, None)
+        if not cacheable:
+            self._keys[name] = os.urandom(16).hex()
+
+    def add(self, stage):
+        self.stages[stage.name] = stage
+
+        # Keys of the stages may depend on the new stage ; keys of the sources do not change
+        self._keys = {name: key for name, key in self._keys.items() if name in self.sources}
+        return stage
+
+    def key(self, name):
+
+        """
+        Cache key of a stage or source, derived from its parameters and from the keys of its inputs.
+        """
+
+        if name not in self._keys:
+            if name in self.sources:
+                content = {"source": file_fingerprint(self.sources[name])}
+            elif name in self.stages:
+                stage = self.stages[name]
+                content = {
+                    "stage": stage.name,
+                    "version": stage.version,
+                    "params": stage.params,
+                    "inputs": [self.key(i) for i in stage.inputs],
+                }
+            else:
+                raise KeyError(f"Unknown stage or source: {name}")
+
+            encoded = json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+            self._keys[name] = hashlib.sha256(encoded).hexdigest()
+
+        return self._keys[name]
+
+    def _artifact_file(self, name):
+        return os.path.join(self.cache_dir, f"{name}-{self.key(name)[:32]}.pkl")
+
+    def _save(self, name, value):
+
+        # The cache is optional : an unwritable cache directory only disables it
+        if self.cache_dir is None:
+            return
+        try:
+            self._write_artifact(name, value)
+        except OSError:
+            pass
+
+    def _write_artifact(self, name, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Remove the artifacts of previous keys of this stage
+        prefix = f"{name}-"
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(prefix) and entry.endswith(".pkl") and len(entry) == len(prefix) + 36:
+                os.remove(os.path.join(self.cache_dir, entry))
+
+        artifact = self._artifact_file(name)
+        with open(artifact + ".tmp", "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(artifact + ".tmp", artifact)
+
+    def _load(self, name):
+        stage = self.stages[name]
+        if self.cache_dir is None or self.force or not stage.store or not all(os.path.exists(p) for p in stage.outputs):
+            return False, None
+
+        try:
+            with open(self._artifact_file(name), "rb") as f:
+                return True, pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+
+    def run(self, name):
+
+        """
+        Return the value of a stage, executing it (and its invalidated inputs) only if needed.
+        """
+
+        if name in self.sources:
+            return self.sources[name]
+        if name in self._values:
+            return self._values[name]
+
+        stage = self.stages[name]
+        found, value = self._load(name)
+
+        if found:
+            self.status[name] = "cached"
+            if self.profiler is not None:
+                self.profiler.mark_cached(name)
+        else:
+            values = [self.run(i) for i in stage.inputs]
+            if self.profiler is None:
+                value = stage.func(*values, **stage.params)
+            else:
+                with self.profiler.stage(name):
+                    value = stage.func(*values, **stage.params)
+            self.status[name] = "computed"
+            if stage.store:
+                self._save(name, value)
+
+        self._values[name] = value
+        return value
@@ -4,37 +4,139 @@ Module dedicated to data visualization for gene expression analysis.
 This module provides functions to generate bar plots illustrating:
 - The top tissues/cells by total read counts
 - The top genes by total read counts
+- The most variable genes by normalized dispersion (see normalization_utils)
 
-Matplotlib is used to produce publication-quality figures that can be displayed interactively or saved as PNG files for inclusion in an HTML report.
+a hierarchically clustered heatmap of the tissue-by-tissue correlation matrix (see correlation_utils),
+and distribution figures for quality control :
+- a log-binned histogram of all gene totals with their cumulative distribution (ECDF)
+- a boxplot of the counts of each tissue/cell (quantiles from distribution_utils)
+
+Distribution figures are drawn from precomputed bins and quantiles : the histogram counts are computed with
+a single vectorized pass over the totals, and matplotlib draws a fixed number of artists (one outline, one curve,
+at most MAX_BOXES boxes), so rendering time does not grow with the number of genes.
+
+Matplotlib is used to produce publication-quality figures that can be displayed interactively or saved as PNG or SVG files for inclusion in an HTML report.
 
 The plotting functions are designed to be reusable and configurable: number of items displayed, logarithmic scale, etc.
+They accept either a dictionary of totals or the SummaryResult computed once by 'stats_utils.compute_summary',
+in which case the precomputed rankings are reused.
+
+Rendering pipeline
+------------------
+Figures saved to disk are described by a "figure spec" (a plain dictionary: plotted data and options)
+and drawn with the object-oriented Figure API, without the global pyplot state machine and without
+any interactive backend. pyplot is only imported when a figure is displayed interactively.
+
+Matplotlib itself is only imported when a figure is drawn : building figure specs, and importing
+this module, stay cheap for runs that do not render figures.
+
+'render_figures' renders several independent figures in a process pool and skips a figure
+when a content hash of its data and options matches the file already present in the output directory
+(hashes are stored in a '.figures.json' manifest next to the figures).
+
+The hashlib and json modules are used to compute and store these content hashes.
 """
 
-import matplotlib.pyplot as plt
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from stats_utils import SummaryResult, top_k
+
+# Version of the drawing code, part of the content hash : bump it when the figures change
+RENDER_VERSION = 1
+
+# Name of the manifest storing the content hash of each rendered figure
+MANIFEST_NAME = ".figures.json"
+
+# Supported output formats
+FIGURE_FORMATS = ("png", "svg")
+
+# Maximum number of rows/columns of a heatmap : larger matrices are averaged by blocks for display
+MAX_HEATMAP_CELLS = 400
+
+# Maximum number of tissues/cells whose names are written along the heatmap
+MAX_HEATMAP_LABELS = 60
+
+# Number of logarithmic bins of the gene total histogram
+HISTOGRAM_BINS = 60
+
+# Maximum number of boxes of the tissue/cell boxplot : larger matrices show tissues/cells evenly spread by median
+MAX_BOXES = 50
+
+# Quantiles of the counts of each tissue/cell drawn by the boxplot : whiskers, box and median
+BOX_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
 
 # ---------------------------------------------------------------------
-# PART 1 : Top 10 tissues / cells with the highest read counts
+# PART 1 : Figure specs and drawing with the object-oriented API
 # ---------------------------------------------------------------------
 
-def plot_tissue_total(tissue_totals, top_n=10, log_scale=True, output_path=None):
-    
-    # Sort tissues/cells by total counts in descending order
-    items = sorted(tissue_totals.items(), key=lambda x: x[1], reverse=True)
-    if top_n:
-        items = items[:top_n]
+def barplot_spec(items, xlabel, title, log_scale=True, output_path=None, dpi=300, ylabel_pad=None,
+                 ylabel="Total counts", value_format=None):
+
+    """
+    Describe a bar plot of (name, value) pairs as a plain, picklable dictionary.
+
+    Bar labels are integers with thin-space thousands separators, or formatted with 'value_format' (e.g. ".2f").
+    """
+
+    return {
+        "kind": "barplot",
+        "items": [[str(name), float(value)] for name, value in items],
+        "xlabel": xlabel,
+        "title": title,
+        "log_scale": bool(log_scale),
+        "ylabel_pad": ylabel_pad,
+        "ylabel": ylabel,
+        "value_format": value_format,
+        "figsize": [12, 6],
+        "dpi": dpi,
+        "output_path": output_path,
+    }
+
+def spec_hash(spec):
+
+    """
+    Content hash of a figure spec : plotted data and options, output format included, output path excluded.
+    """
 
-    tissues = [t for t, _ in items]
-    values = [v for _, v in items]
+    content = {key: value for key, value in spec.items() if key != "output_path"}
+    content["format"] = figure_format(spec["output_path"]) if spec.get("output_path") else None
+    content["render_version"] = RENDER_VERSION
 
-    # Create the figure and bar plot
-    plt.figure(figsize=(12, 6))
-    colors = plt.cm.tab10(range(len(values)))
-    bars = plt.bar(tissues, values, color=colors)
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+def figure_format(output_path):
+    extension = os.path.splitext(output_path)[1].lstrip(".").lower()
+    if extension not in FIGURE_FORMATS:
+        raise ValueError(f"Unsupported figure format: {extension} (expected one of {', '.join(FIGURE_FORMATS)})")
+    return extension
+
+def draw_barplot(fig, spec):
+
+    """
+    Draw a bar plot spec on a Figure.
+    """
+
+    import matplotlib
+
+    names = [name for name, _ in spec["items"]]
+    values = [value for _, value in spec["items"]]
+
+    # Create the bar plot
+    ax = fig.subplots()
+    colors = matplotlib.colormaps["tab10"](range(len(values)))
+    bars = ax.bar(range(len(values)), values, color=colors)
 
     # Add numerical labels above each bar
     for bar, value in zip(bars, values):
-        label = f"{int(value):,}".replace(",", " ")
-        plt.text(
+        if spec["value_format"]:
+            label = format(value, spec["value_format"])
+        else:
+            label = f"{int(value):,}".replace(",", " ")
+        ax.text(
             bar.get_x() + bar.get_width() / 2,
             bar.get_height(),
             label,
@@ -45,91 +147,500 @@ def plot_tissue_total(tissue_totals, top_n=10, log_scale=True, output_path=None)
         )
 
     # Set axis labels and plot title
-    plt.xlabel("Tissues/Cells", fontsize=12, fontweight="bold")
-    plt.ylabel("Total counts", fontsize=12, fontweight="bold")
-    plt.title("Top tissues/cells by total count", fontsize=14, fontweight="bold", pad=15)
+    ax.set_xlabel(spec["xlabel"], fontsize=12, fontweight="bold")
+    ylabel = spec["ylabel"]
+    ax.set_ylabel(ylabel, fontsize=12, fontweight="bold")
+    ax.set_title(spec["title"], fontsize=14, fontweight="bold", pad=15)
 
     # Apply logarithmic scale to the y-axis if requested
-    if log_scale:
-        plt.yscale("log")
-        plt.ylabel("Total counts (log scale)", fontsize=12, fontweight="bold")
+    if spec["log_scale"]:
+        ax.set_yscale("log")
+        ax.set_ylabel(f"{ylabel} (log scale)", fontsize=12, fontweight="bold", labelpad=spec["ylabel_pad"])
 
     # Format tick labels
-    plt.xticks(fontsize=10, rotation=45, ha="right")
-    plt.yticks(fontsize=10)
-    
+    ax.set_xticks(range(len(names)))
+    ax.set_xticklabels(names, fontsize=10, rotation=45, ha="right")
+    ax.tick_params(axis="y", labelsize=10)
+
     # Customize axis borders for better visual appearance
-    ax = plt.gca()
     for spine in ax.spines.values():
         spine.set_linewidth(1.2)
 
     # Adjust layout to avoid overlapping elements
-    plt.tight_layout()
-    
+    fig.tight_layout()
+
+def heatmap_spec(values, labels, title, dendrogram=(), output_path=None, dpi=300, colorbar_label=""):
+
+    """
+    Describe a heatmap of a square matrix (list of rows) in [-1, 1] with an optional dendrogram drawn above it.
+
+    'dendrogram' is a list of [x0, y0, x1, y1] segments, x in cell units (0 to the number of columns).
+    """
+
+    return {
+        "kind": "heatmap",
+        "values": [[round(float(value), 4) for value in row] for row in values],
+        "labels": [str(label) for label in labels] if labels else None,
+        "title": title,
+        "dendrogram": [[float(value) for value in segment] for segment in dendrogram],
+        "colorbar_label": colorbar_label,
+        "figsize": [11, 12],
+        "dpi": dpi,
+        "output_path": output_path,
+    }
+
+def draw_heatmap(fig, spec):
+
+    """
+    Draw a heatmap spec on a Figure : dendrogram on top, heatmap and color bar below.
+    """
+
+    n = len(spec["values"])
+    if spec["dendrogram"]:
+        top, ax = fig.subplots(2, 1, gridspec_kw={"height_ratios": [1, 4]}, sharex=True)
+        for x0, y0, x1, y1 in spec["dendrogram"]:
+            top.plot([x0, x1], [y0, y1], color="black", linewidth=0.6)
+        top.set_ylabel("Distance (1 - r)", fontsize=10)
+        top.set_title(spec["title"], fontsize=14, fontweight="bold", pad=15)
+        top.tick_params(axis="x", bottom=False, labelbottom=False)
+        for side in ("top", "right", "bottom"):
+            top.spines[side].set_visible(False)
+    else:
+        ax = fig.subplots()
+        ax.set_title(spec["title"], fontsize=14, fontweight="bold", pad=15)
+
+    image = ax.imshow(spec["values"], cmap="RdBu_r", vmin=-1, vmax=1, interpolation="nearest",
+                      extent=(0, n, n, 0), aspect="auto")
+    ax.set_xlim(0, n)
+    colorbar = fig.colorbar(image, ax=ax, orientation="horizontal", fraction=0.04, pad=0.12 if spec["labels"] else 0.04)
+    colorbar.set_label(spec["colorbar_label"], fontsize=10)
+
+    if spec["labels"]:
+        ticks = [i + 0.5 for i in range(n)]
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(spec["labels"], fontsize=7, rotation=90)
+        ax.set_yticks(ticks)
+        ax.set_yticklabels(spec["labels"], fontsize=7)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+    fig.tight_layout()
+
+def histogram_spec(edges, counts, zeros, xlabel, title, output_path=None, dpi=300):
+
+    """
+    Describe a histogram of precomputed logarithmic bins ('edges', 'counts') with its cumulative distribution.
+
+    'zeros' is the number of values equal to 0 (outside the logarithmic bins) : they start the cumulative
+    distribution and are written in the legend.
+    """
+
+    return {
+        "kind": "histogram",
+        "edges": [float(edge) for edge in edges],
+        "counts": [int(count) for count in counts],
+        "zeros": int(zeros),
+        "xlabel": xlabel,
+        "title": title,
+        "figsize": [12, 6],
+        "dpi": dpi,
+        "output_path": output_path,
+    }
+
+def draw_histogram(fig, spec):
+
+    """
+    Draw a histogram spec on a Figure : bins as a single outline (log x-axis), cumulative fraction on a second y-axis.
+    """
+
+    edges = np.asarray(spec["edges"])
+    counts = np.asarray(spec["counts"])
+    total = spec["zeros"] + counts.sum()
+
+    ax = fig.subplots()
+    if len(counts):
+        ax.stairs(counts, edges, fill=True, color="tab:blue", alpha=0.6, label="Number of genes")
+        ax.set_xscale("log")
+
+        # Cumulative fraction at the upper edge of each bin (values equal to 0 come first)
+        ecdf = ax.twinx()
+        ecdf.plot(edges, np.concatenate([[spec["zeros"]], spec["zeros"] + np.cumsum(counts)]) / max(total, 1),
+                  color="tab:red", linewidth=1.5, label="Cumulative fraction")
+        ecdf.set_ylim(0, 1.02)
+        ecdf.set_ylabel("Cumulative fraction", fontsize=12, fontweight="bold")
+
+    ax.set_xlabel(f"{spec['xlabel']} (log scale)", fontsize=12, fontweight="bold")
+    ax.set_ylabel("Number of genes", fontsize=12, fontweight="bold")
+    ax.set_title(spec["title"], fontsize=14, fontweight="bold", pad=15)
+    if spec["zeros"]:
+        ax.text(0.01, 0.97, f"{spec['zeros']:,} genes with a total of 0 (not shown)".replace(",", " "),
+                transform=ax.transAxes, ha="left", va="top", fontsize=10)
+
+    fig.tight_layout()
+
+def boxplot_spec(names, stats, title, ylabel, output_path=None, dpi=300):
+
+    """
+    Describe a boxplot of precomputed statistics : one [whisker low, q1, median, q3, whisker high] list per name.
+    """
+
+    return {
+        "kind": "boxplot",
+        "names": [str(name) for name in names],
+        "stats": [[float(value) for value in row] for row in stats],
+        "title": title,
+        "ylabel": ylabel,
+        "figsize": [12, 6],
+        "dpi": dpi,
+        "output_path": output_path,
+    }
+
+def draw_boxplot(fig, spec):
+
+    """
+    Draw a boxplot spec on a Figure (symmetric log y-axis : zero counts stay visible).
+    """
+
+    ax = fig.subplots()
+    boxes = [{"label": name, "whislo": low, "q1": q1, "med": median, "q3": q3, "whishi": high}
+             for name, (low, q1, median, q3, high) in zip(spec["names"], spec["stats"])]
+    ax.bxp(boxes, showfliers=False, patch_artist=True,
+           boxprops={"facecolor": "tab:blue", "alpha": 0.6}, medianprops={"color": "black"})
+
+    ax.set_yscale("symlog", linthresh=1)
+    ax.set_ylabel(f"{spec['ylabel']} (symmetric log scale)", fontsize=12, fontweight="bold")
+    ax.set_title(spec["title"], fontsize=14, fontweight="bold", pad=15)
+    ax.set_xticks(range(1, len(boxes) + 1))
+    ax.set_xticklabels(spec["names"], fontsize=8, rotation=90)
+    ax.tick_params(axis="y", labelsize=10)
+
+    fig.tight_layout()
+
+# Drawing function of each kind of figure spec
+DRAWERS = {
+    "barplot": draw_barplot,
+    "heatmap": draw_heatmap,
+    "histogram": draw_histogram,
+    "boxplot": draw_boxplot,
+}
+
+def render_figure(spec):
+
+    """
+    Render a figure spec to its output file (format given by the file extension).
+
+    Uses a standalone Figure (Agg canvas) : safe to call in worker processes and on headless servers.
+    """
+
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=spec["figsize"])
+    DRAWERS[spec["kind"]](fig, spec)
+    fig.savefig(spec["output_path"], dpi=spec["dpi"], format=figure_format(spec["output_path"]))
+    return spec["output_path"]
+
+def show_figure(spec):
+
+    """
+    Display a figure spec interactively (imports pyplot and its interactive backend).
+    """
+
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=spec["figsize"])
+    DRAWERS[spec["kind"]](fig, spec)
+    plt.show()
+
+# ---------------------------------------------------------------------
+# PART 2 : Parallel, cached rendering of several figures
+# ---------------------------------------------------------------------
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(directory, manifest):
+    manifest_file = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def render_figures(specs, workers=None, force=False):
+
+    """
+    Render several independent figure specs, in parallel, skipping those that are up to date.
+
+    A figure is up to date when its output file exists and the content hash of its spec
+    matches the hash recorded when the file was rendered.
+
+    Parameters
+    ----------
+    - workers : int or None
+      Number of worker processes (default : one per figure to render, up to the number of CPU cores ;
+      1 renders in the current process)
+    - force : bool
+      Render every figure, even if it is up to date
+
+    Returns
+    -------
+    dict[str, bool] : Dictionary mapping each output path to True if it was rendered, False if it was skipped
+    """
+
+    manifests = {}
+    todo = []
+    status = {}
+
+    for spec in specs:
+        directory, name = os.path.split(os.path.abspath(spec["output_path"]))
+        manifest = manifests.setdefault(directory, read_manifest(directory))
+        digest = spec_hash(spec)
+
+        if not force and manifest.get(name) == digest and os.path.exists(spec["output_path"]):
+            status[spec["output_path"]] = False
+        else:
+            todo.append((spec, directory, name, digest))
+
+    if workers is None:
+        workers = min(len(todo), os.cpu_count() or 1)
+
+    if workers > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_figure, [spec for spec, _, _, _ in todo]))
+    else:
+        for spec, _, _, _ in todo:
+            render_figure(spec)
+
+    # Record the hashes of the rendered figures
+    for spec, directory, name, digest in todo:
+        manifests[directory][name] = digest
+        status[spec["output_path"]] = True
+    for directory in {directory for _, directory, _, _ in todo}:
+        write_manifest(directory, manifests[directory])
+
+    return status
+
+# ---------------------------------------------------------------------
+# PART 3 : Top 10 tissues / cells with the highest read counts
+# ---------------------------------------------------------------------
+
+def tissue_total_spec(tissue_totals, top_n=10, log_scale=True, output_path=None, dpi=300):
+
+    # Sort tissues/cells by total counts in descending order
+    if isinstance(tissue_totals, SummaryResult):
+        items = tissue_totals.top_tissues(top_n or None)
+    else:
+        items = top_k(tissue_totals, top_n or None)
+
+    return barplot_spec(items, "Tissues/Cells", "Top tissues/cells by total count",
+                        log_scale=log_scale, output_path=output_path, dpi=dpi)
+
+def plot_tissue_total(tissue_totals, top_n=10, log_scale=True, output_path=None, dpi=300):
+
+    spec = tissue_total_spec(tissue_totals, top_n, log_scale, output_path, dpi)
+
     # Save the figure to disk or display it interactively
     if output_path:
-        plt.savefig(output_path, dpi=300)
-        plt.close()
+        render_figures([spec], workers=1)
     else:
-        plt.show()
-    
+        show_figure(spec)
+
 # --------------------------------------------------
-# PART 2 : Top 10 genes with the highest read counts
+# PART 4 : Top 10 genes with the highest read counts
 # --------------------------------------------------
 
-def plot_gene_total(gene_totals, top_n=10, log_scale=True, output_path=None):
-    
+def gene_total_spec(gene_totals, top_n=10, log_scale=True, output_path=None, dpi=300):
+
     # Sort genes by total counts in descending order
-    items = sorted(gene_totals.items(), key=lambda x: x[1], reverse=True)
-    if top_n:
-        items = items[:top_n]
+    if isinstance(gene_totals, SummaryResult):
+        items = gene_totals.top_genes(top_n or None)
+    else:
+        items = top_k(gene_totals, top_n or None)
 
-    genes = [g for g, _ in items]
-    values = [v for _, v in items]
+    return barplot_spec(items, "Genes", "Top genes by total count",
+                        log_scale=log_scale, output_path=output_path, dpi=dpi, ylabel_pad=15)
 
-    # Create the figure and bar plot
-    plt.figure(figsize=(12, 6))
-    colors = plt.cm.tab10(range(len(values)))
-    bars = plt.bar(genes, values, color=colors)
+def plot_gene_total(gene_totals, top_n=10, log_scale=True, output_path=None, dpi=300):
 
-    # Add numerical labels above each bar
-    for bar, value in zip(bars, values):
-        label = f"{int(value):,}".replace(",", " ")
-        plt.text(
-            bar.get_x() + bar.get_width() / 2,
-            bar.get_height(),
-            label,
-            ha="center",
-            va="bottom",
-            fontsize=9,
-            fontweight="bold"
-        )
+    spec = gene_total_spec(gene_totals, top_n, log_scale, output_path, dpi)
 
-    # Set axis labels and plot title
-    plt.xlabel("Genes", fontsize=12, fontweight="bold")
-    plt.ylabel("Total counts", fontsize=12, fontweight="bold")
-    plt.title("Top genes by total count", fontsize=14, fontweight="bold", pad=15)
+    # Save the figure to disk or display it interactively
+    if output_path:
+        render_figures([spec], workers=1)
+    else:
+        show_figure(spec)
 
-    # Apply logarithmic scale to the y-axis if requested
-    if log_scale:
-        plt.yscale("log")
-        plt.ylabel("Total counts (log scale)", fontsize=12, fontweight="bold", labelpad=15)
-    
-    # Format tick labels
-    plt.xticks(rotation=45, ha="right", fontsize=10)
-    plt.yticks(fontsize=10)
+# --------------------------------------------------------------
+# PART 5 : Top 10 highly variable genes (normalized dispersion)
+# --------------------------------------------------------------
 
-    # Customize axis borders for better visual appearance
-    ax = plt.gca()
-    for spine in ax.spines.values():
-        spine.set_linewidth(1.2)
+def variable_gene_spec(variable_genes, top_n=10, output_path=None, dpi=300):
 
-    # Adjust layout to avoid overlapping elements
-    plt.tight_layout()
+    # Genes already ranked by 'normalization_utils.highly_variable_genes'
+    return barplot_spec(variable_genes.top(top_n), "Genes", "Top highly variable genes by normalized dispersion",
+                        log_scale=False, output_path=output_path, dpi=dpi, ylabel="Normalized dispersion",
+                        value_format=".2f")
+
+def plot_variable_genes(variable_genes, top_n=10, output_path=None, dpi=300):
+
+    spec = variable_gene_spec(variable_genes, top_n, output_path, dpi)
+
+    # Save the figure to disk or display it interactively
+    if output_path:
+        render_figures([spec], workers=1)
+    else:
+        show_figure(spec)
+
+# -------------------------------------------------------------------
+# PART 6 : Clustered heatmap of the tissue-by-tissue correlation
+# -------------------------------------------------------------------
+
+def block_average(values, size):
+
+    # Average a square matrix over a size x size grid of (nearly) equal blocks
+    n = len(values)
+    edges = np.linspace(0, n, size + 1).astype(int)
+    counts = np.diff(edges)
+    sums = np.add.reduceat(np.add.reduceat(values, edges[:-1], axis=0), edges[:-1], axis=1)
+    return sums / np.outer(counts, counts)
+
+def dendrogram_segments(linkage, order, scale=1.0):
+
+    """
+    Line segments [x0, y0, x1, y1] of the dendrogram of a clustering, leaves at x = (position in 'order' + 0.5) * scale.
+    """
+
+    n = len(order)
+    x = {int(leaf): (position + 0.5) * scale for position, leaf in enumerate(order)}
+    y = dict.fromkeys(x, 0.0)
+    segments = []
+
+    for i, (a, b, height, _) in enumerate(linkage):
+        a, b = int(a), int(b)
+        segments += [[x[a], y[a], x[a], height], [x[b], y[b], x[b], height], [x[a], height, x[b], height]]
+        x[n + i], y[n + i] = (x[a] + x[b]) / 2, float(height)
+
+    return segments
+
+def correlation_heatmap_spec(correlation, output_path=None, dpi=300):
+
+    """
+    Clustered heatmap of a correlation_utils.CorrelationResult : rows and columns in the leaf order of the
+    clustering, dendrogram on top. Matrices larger than MAX_HEATMAP_CELLS are averaged by blocks
+    (undefined correlations are shown as 0).
+    """
+
+    tissues, values = correlation.clustered()
+    values = np.nan_to_num(values, nan=0.0)
+    n = len(tissues)
+    size = min(n, MAX_HEATMAP_CELLS)
+    if size < n:
+        values = block_average(values, size)
+
+    return heatmap_spec(values, tissues if n <= MAX_HEATMAP_LABELS else None,
+                        f"Tissue / cell correlation ({correlation.method.capitalize()}, {n} tissues / cells, clustered)",
+                        dendrogram=dendrogram_segments(correlation.linkage, correlation.order, size / max(n, 1)),
+                        output_path=output_path, dpi=dpi, colorbar_label=f"{correlation.method.capitalize()} correlation")
+
+def plot_correlation_heatmap(correlation, output_path=None, dpi=300):
+
+    spec = correlation_heatmap_spec(correlation, output_path, dpi)
+
+    # Save the figure to disk or display it interactively
+    if output_path:
+        render_figures([spec], workers=1)
+    else:
+        show_figure(spec)
+
+# -------------------------------------------------------------------
+# PART 7 : Distribution of all gene totals and of each tissue/cell
+# -------------------------------------------------------------------
+
+def log_histogram(values, bins=HISTOGRAM_BINS):
+
+    """
+    Logarithmic histogram of nonnegative values, in one vectorized pass.
+
+    Returns
+    -------
+    tuple : (edges, counts, zeros) : bin edges (bins + 1 values, equal ratio between consecutive edges),
+    number of positive values in each bin, and number of values equal to 0 (they have no logarithmic bin)
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    positive = values[values > 0]
+    zeros = int(np.count_nonzero(values == 0))
+    if not len(positive):
+        return np.zeros(0), np.zeros(0, dtype=np.int64), zeros
+
+    low, high = np.log10(positive.min()), np.log10(positive.max())
+    if high - low < 1e-9:
+        low, high = low - 0.5, high + 0.5
+    edges = np.logspace(low, high, bins + 1)
+
+    # Bin of each value from its logarithm (the last bin includes its upper edge)
+    index = np.minimum(((np.log10(positive) - low) / (high - low) * bins).astype(np.intp), bins - 1)
+    return edges, np.bincount(index, minlength=bins), zeros
+
+def gene_distribution_spec(gene_totals, bins=HISTOGRAM_BINS, output_path=None, dpi=300):
+
+    # All gene totals : the SummaryResult array or the values of a dictionary of totals
+    if isinstance(gene_totals, SummaryResult):
+        values = gene_totals.gene_totals
+    else:
+        values = np.fromiter(gene_totals.values(), dtype=np.float64, count=len(gene_totals))
+
+    edges, counts, zeros = log_histogram(values, bins)
+    return histogram_spec(edges, counts, zeros, "Gene total count",
+                          f"Distribution of the total counts of all {len(values):,} genes".replace(",", " "),
+                          output_path=output_path, dpi=dpi)
+
+def plot_gene_distribution(gene_totals, bins=HISTOGRAM_BINS, output_path=None, dpi=300):
+
+    spec = gene_distribution_spec(gene_totals, bins, output_path, dpi)
+
+    # Save the figure to disk or display it interactively
+    if output_path:
+        render_figures([spec], workers=1)
+    else:
+        show_figure(spec)
+
+def tissue_distribution_spec(distribution, max_boxes=MAX_BOXES, output_path=None, dpi=300):
+
+    """
+    Boxplot of the counts of each tissue/cell from a distribution_utils.DistributionResult computed with
+    quantiles=BOX_QUANTILES : whiskers at the 5th and 95th percentiles, tissues/cells sorted by median.
+    Above 'max_boxes' tissues/cells, boxes evenly spread over that order are shown (lowest and highest medians included).
+    """
+
+    levels = list(distribution.quantile_levels)
+    missing = [q for q in BOX_QUANTILES if q not in levels]
+    if missing:
+        raise ValueError(f"Distribution computed without the quantiles {missing} (use quantiles=BOX_QUANTILES)")
+
+    quantiles = distribution.tissues["quantiles"][:, [levels.index(q) for q in BOX_QUANTILES]]
+    order = np.argsort(quantiles[:, 2], kind="stable")
+    n = len(order)
+    if n > max_boxes:
+        order = order[np.unique(np.linspace(0, n - 1, max_boxes).round().astype(np.intp))]
+
+    title = "Counts of each tissue / cell (5-25-50-75-95th percentiles, sorted by median)"
+    if len(order) < n:
+        title = f"Counts of {len(order)} of {n} tissues / cells (5-25-50-75-95th percentiles, evenly spread by median)"
+    return boxplot_spec([distribution.tissue_names[i] for i in order], quantiles[order], title, "Counts",
+                        output_path=output_path, dpi=dpi)
+
+def plot_tissue_distribution(distribution, max_boxes=MAX_BOXES, output_path=None, dpi=300):
+
+    spec = tissue_distribution_spec(distribution, max_boxes, output_path, dpi)
 
     # Save the figure to disk or display it interactively
     if output_path:
-        plt.savefig(output_path, dpi=300)
-        plt.close()
+        render_figures([spec], workers=1)
     else:
-        plt.show()
\ No newline at end of file
+        show_figure(spec)
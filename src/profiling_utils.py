@@ -0,0 +1,204 @@
+"""
+Per-stage profiling and resource instrumentation of the pipeline.
+
+A Profiler records, for each stage (load, summary, figures, report) :
+- wall time and CPU time (of the process and of its finished worker processes),
+- peak resident memory (RSS) of the process at the end of the stage and its increase during the stage,
+- throughput : lines/sec, bytes/sec and cells/sec when the stage reports these quantities,
+- counters such as those of 'load_matrix' (lines read, non-count lines skipped, invalid cells coerced to 0.0).
+
+Records are written to a JSON file and can be displayed in the HTML report.
+
+Hooks attach a profiler to a single stage :
+- "cprofile" : deterministic profile of the stage, saved as '<stage>.prof' (open with pstats or snakeviz)
+- "sample"   : sampling profiler (stack of the main thread sampled every few milliseconds), saved as
+               '<stage>.samples.txt' in the "collapsed stacks" format read by flamegraph tools
+Other hooks can be added with 'register_hook'.
+
+The resource module gives the peak RSS, cProfile the deterministic profiler,
+and the sys/threading modules the sampling profiler. The resource module is Unix-only :
+elsewhere (Windows), the peak RSS and the CPU time of the worker processes are recorded as None.
+"""
+
+import cProfile
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+
+    """
+    Peak resident memory of the current process, in MB (None without the resource module).
+    """
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def children_cpu_seconds():
+
+    """
+    CPU time used by the terminated child processes (worker pools) of the current process
+    (None without the resource module).
+    """
+
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+# ---------------------------------------------------------------------
+# PART 1 : Profiling hooks attached to a single stage
+# ---------------------------------------------------------------------
+
+@contextmanager
+def cprofile_hook(stage, output_dir):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(output_dir, f"{stage}.prof"))
+
+@contextmanager
+def sample_hook(stage, output_dir, interval=0.005):
+    target = threading.get_ident()
+    stacks = collections.Counter()
+    done = threading.Event()
+
+    def sampler():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(stack))] += 1
+
+    thread = threading.Thread(target=sampler, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+        with open(os.path.join(output_dir, f"{stage}.samples.txt"), "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+# Available hooks : name -> function(stage, output_dir) returning a context manager
+HOOKS = {
+    "cprofile": cprofile_hook,
+    "sample": sample_hook,
+}
+
+def register_hook(name, hook):
+
+    """
+    Register a profiling hook : a function (stage, output_dir) returning a context manager around the stage.
+    """
+
+    HOOKS[name] = hook
+
+# ---------------------------------------------------------------------
+# PART 2 : Per-stage measurements
+# ---------------------------------------------------------------------
+
+class Profiler:
+
+    """
+    Collect per-stage measurements.
+
+    Example
+    -------
+    profiler = Profiler("web_report", hooks={"load": "cprofile"})
+    with profiler.stage("load") as record:
+        matrix = load_matrix(path, counters=record["counters"])
+    profiler.add_throughput("load", lines=..., bytes=..., cells=...)
+    profiler.write("web_report/profile.json")
+    """
+
+    def __init__(self, output_dir=".", hooks=None):
+        self.output_dir = output_dir
+        self.hooks = dict(hooks or {})
+        self.records = {}
+
+        for stage, hook in self.hooks.items():
+            if hook not in HOOKS:
+                raise ValueError(f"Unknown profiling hook for stage {stage}: {hook} (expected one of {', '.join(HOOKS)})")
+
+    @contextmanager
+    def stage(self, name):
+
+        """
+        Measure the code run inside the 'with' block as stage 'name'.
+
+        Yields the record of the stage ; its "counters" dictionary can be filled by the stage.
+        """
+
+        record = self.records.setdefault(name, {"stage": name, "counters": {}})
+        hook = HOOKS[self.hooks[name]](name, self.output_dir) if name in self.hooks else None
+
+        rss_before = peak_rss_mb()
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), children_cpu_seconds()
+        try:
+            if hook is None:
+                yield record
+            else:
+                with hook:
+                    yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_rss_mb"] = peak_rss_mb()
+            if resource is None:
+                record["children_cpu_seconds"] = record["rss_increase_mb"] = None
+            else:
+                record["children_cpu_seconds"] = children_cpu_seconds() - children_cpu
+                record["rss_increase_mb"] = record["peak_rss_mb"] - rss_before
+            if name in self.hooks:
+                record["hook"] = self.hooks[name]
+
+    def mark_cached(self, name):
+
+        """
+        Record a stage whose result was reused from the pipeline cache (not executed).
+        """
+
+        self.records.setdefault(name, {"stage": name, "counters": {}})["cached"] = True
+
+    def add_throughput(self, name, **quantities):
+
+        """
+        Add processed quantities to a stage (e.g. lines=..., bytes=..., cells=...) and derive their rates per second.
+        """
+
+        record = self.records.setdefault(name, {"stage": name, "counters": {}})
+        seconds = record.get("wall_seconds")
+
+        for quantity, value in quantities.items():
+            record[quantity] = value
+            if seconds:
+                record[f"{quantity}_per_sec"] = value / seconds
+
+    def to_list(self):
+        return list(self.records.values())
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.to_list()}, f, indent=1)
+        return path
@@ -0,0 +1,395 @@
+"""
+Generation of the HTML summary report of a gene expression matrix.
+
+The report is a single, portable HTML file:
+- summary of the matrix (dimensions, density, min/max total counts)
+- figures inlined as base64 data URIs (PNG or SVG), so no image file has to be shipped with the report
+- full tables of the gene and tissue/cell totals : the totals are embedded once as compact JSON
+  (one array of names, one array of totals) and displayed by a small script as sortable, searchable tables
+  rendered one page at a time, so reports of 60k+ genes open instantly
+- highly variable genes (normalized dispersion), if the counts were normalized (see normalization_utils)
+- clustered heatmap of the tissue-by-tissue correlation and most correlated pairs, if computed (see correlation_utils)
+- distribution of all gene totals (log-binned histogram) and of the counts of each tissue/cell (boxplot, if computed,
+  see distribution_utils)
+- links to the exported rankings and timing of the pipeline stages, if any
+
+The report is written to disk section by section (the totals in chunks) instead of being built as one string.
+
+The base64 module is used to inline figures and the json module to embed the totals.
+"""
+
+import base64
+import json
+import os
+from html import escape
+
+import numpy as np
+
+# Number of rows displayed per page of the totals tables
+PAGE_SIZE = 100
+
+# Number of names/totals serialized at once when the totals are embedded
+JSON_CHUNK = 10000
+
+# Number of most correlated tissue/cell pairs listed in the report
+CORRELATED_PAIRS = 1000
+
+# MIME type of each inlined figure format
+FIGURE_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+REPORT_STYLE = """
+    body {
+        font-family: Arial, sans-serif;
+        margin: 40px;
+    }
+
+    h1 {
+        margin-top: 0;
+    }
+
+    .summary-box {
+        border: 2px solid black;
+        background-color: #fde7ef; /* rose pâle */
+        padding: 20px 25px;
+        border-radius: 8px;
+        max-width: 900px;
+        margin-bottom: 40px;
+    }
+
+    .figure-box {
+        border: 2px solid black;
+        padding: 15px;
+        border-radius: 8px;
+        margin-bottom: 40px;
+        max-width: 950px;
+    }
+
+    img {
+        max-width: 900px;
+        margin-bottom: 40px;
+    }
+
+    table {
+        border-collapse: collapse;
+    }
+
+    th, td {
+        border: 1px solid #999;
+        padding: 4px 8px;
+        text-align: left;
+    }
+
+    .totals-table th[data-key] {
+        cursor: pointer;
+        background-color: #fde7ef;
+    }
+
+    .totals-table td.number {
+        text-align: right;
+    }
+
+    .table-controls {
+        margin-bottom: 10px;
+    }
+"""
+
+# Sortable, searchable, paginated tables of the embedded totals (only one page of rows is in the DOM)
+TABLE_SCRIPT = """
+function escapeHtml(text) {
+    return text.replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\\"": "&quot;"}[c]));
+}
+
+function totalsTable(box) {
+    const data = JSON.parse(document.getElementById(box.dataset.source).textContent);
+    const pageSize = parseInt(box.dataset.pageSize);
+    const n = data.names.length;
+
+    // Rank of each row by decreasing total, computed once ; non-finite totals (null) come last
+    const total = i => data.totals[i] === null ? -Infinity : data.totals[i];
+    const byTotal = Array.from({length: n}, (_, i) => i).sort((a, b) => total(b) - total(a) || a - b);
+    const rank = new Array(n);
+    byTotal.forEach((row, i) => { rank[row] = i + 1; });
+
+    const state = {query: "", key: "rank", ascending: true, page: 0, rows: byTotal};
+    const search = box.querySelector("input");
+    const body = box.querySelector("tbody");
+    const info = box.querySelector(".page-info");
+
+    function update() {
+        const query = state.query.toLowerCase();
+        let rows = byTotal.filter(i => !query || data.names[i].toLowerCase().includes(query));
+        if (state.key === "name") {
+            rows.sort((a, b) => data.names[a] < data.names[b] ? -1 : data.names[a] > data.names[b] ? 1 : 0);
+        }
+        if (!state.ascending) {
+            rows.reverse();
+        }
+        state.rows = rows;
+        state.page = 0;
+        render();
+    }
+
+    function render() {
+        const pages = Math.max(1, Math.ceil(state.rows.length / pageSize));
+        state.page = Math.min(Math.max(state.page, 0), pages - 1);
+        const start = state.page * pageSize;
+        body.innerHTML = state.rows.slice(start, start + pageSize).map(i =>
+            "<tr><td class=\\"number\\">" + rank[i] + "</td><td>" + escapeHtml(data.names[i]) +
+            "</td><td class=\\"number\\">" + (data.totals[i] === null ? "n/a" : data.totals[i].toLocaleString("en-US")) +
+            "</td></tr>").join("");
+        info.textContent = state.rows.length ?
+            "Rows " + (start + 1) + "-" + Math.min(start + pageSize, state.rows.length) + " of " + state.rows.length +
+            " (page " + (state.page + 1) + " / " + pages + ")" : "No match";
+    }
+
+    search.addEventListener("input", () => { state.query = search.value; update(); });
+    box.querySelector(".previous").addEventListener("click", () => { state.page -= 1; render(); });
+    box.querySelector(".next").addEventListener("click", () => { state.page += 1; render(); });
+    box.querySelectorAll("th[data-key]").forEach(th => th.addEventListener("click", () => {
+        // Rank and total share the same order (largest total first) ; a second click reverses it
+        const key = th.dataset.key === "name" ? "name" : "rank";
+        state.ascending = state.key === key && state.lastHeader === th.dataset.key ? !state.ascending : true;
+        state.key = key;
+        state.lastHeader = th.dataset.key;
+        update();
+    }));
+
+    update();
+}
+
+document.querySelectorAll(".totals-table").forEach(totalsTable);
+"""
+
+# ---------------------------------------------------------------------
+# PART 1 : Report sections
+# ---------------------------------------------------------------------
+
+def inline_figure(figure_path, alt=""):
+
+    """
+    HTML image tag embedding a PNG or SVG figure file as a base64 data URI.
+    """
+
+    extension = os.path.splitext(figure_path)[1].lstrip(".").lower()
+    with open(figure_path, "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    return f'<img alt="{escape(alt)}" src="data:{FIGURE_TYPES[extension]};base64,{data}">'
+
+def write_json_array(f, values):
+
+    # Written by chunks : the whole array is never held as one string
+    f.write("[")
+    for start in range(0, len(values), JSON_CHUNK):
+        if start:
+            f.write(",")
+        chunk = json.dumps(values[start:start + JSON_CHUNK], separators=(",", ":"), allow_nan=False)
+        f.write(chunk[1:-1].replace("</", "<\\/"))
+    f.write("]")
+
+def write_totals_data(f, element_id, names, totals):
+
+    """
+    Embed names and totals as a JSON data block : {"names": [...], "totals": [...]}.
+
+    Non-finite totals (from "nan"/"inf" cells) are written as null : bare NaN/Infinity are not valid JSON
+    and would make JSON.parse fail in the browser.
+    """
+
+    values = totals.tolist()
+    if not np.isfinite(totals).all():
+        values = [value if np.isfinite(value) else None for value in values]
+
+    f.write(f'<script type="application/json" id="{element_id}">{{"names":')
+    write_json_array(f, list(names))
+    f.write(',"totals":')
+    write_json_array(f, values)
+    f.write("}</script>\n")
+
+def write_totals_table(f, element_id, title, label, names, totals, value_label="Total count"):
+
+    """
+    Write a sortable, searchable, paginated table of totals (rows are rendered in the browser from the embedded data).
+    """
+
+    f.write(f"""
+<h2>{escape(title)}</h2>
+<div class="figure-box totals-table" data-source="{element_id}" data-page-size="{PAGE_SIZE}">
+    <div class="table-controls">
+        <input type="search" placeholder="Search {escape(label.lower())}">
+        <button class="previous">&lt;</button>
+        <button class="next">&gt;</button>
+        <span class="page-info"></span>
+    </div>
+    <table>
+        <thead><tr><th data-key="rank">Rank</th><th data-key="name">{escape(label)}</th><th data-key="total">{escape(value_label)}</th></tr></thead>
+        <tbody></tbody>
+    </table>
+</div>
+""")
+    write_totals_data(f, element_id, names, totals)
+
+def profile_table(profile):
+
+    """
+    HTML table of the per-stage measurements recorded by a Profiler.
+    """
+
+    rows = []
+    for record in profile:
+        if record.get("cached"):
+            rows.append(f"<tr><td>{escape(record['stage'])}</td><td colspan=\"5\">cached</td></tr>")
+            continue
+
+        rates = [f"{record[key]:,.0f} {unit}/s" for key, unit in
+                 (("lines_per_sec", "lines"), ("bytes_per_sec", "bytes"), ("cells_per_sec", "cells"))
+                 if key in record]
+        counters = ", ".join(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+                             for name, value in record.get("counters", {}).items())
+        rows.append(
+            f"<tr><td>{escape(record['stage'])}</td>"
+            f"<td>{record.get('wall_seconds', 0):.3f}</td>"
+            f"<td>{record.get('cpu_seconds', 0) + (record.get('children_cpu_seconds') or 0):.3f}</td>"
+            f"<td>{'n/a' if record.get('peak_rss_mb') is None else format(record['peak_rss_mb'], '.1f')}</td>"
+            f"<td>{escape(', '.join(rates))}</td>"
+            f"<td>{escape(counters)}</td></tr>")
+
+    return ("<table>\n<tr><th>Stage</th><th>Wall time (s)</th><th>CPU time (s, with workers)</th><th>Peak RSS (MB)</th>"
+            "<th>Throughput</th><th>Counters</th></tr>\n" + "\n".join(rows) + "\n</table>")
+
+# ---------------------------------------------------------------------
+# PART 2 : Complete report
+# ---------------------------------------------------------------------
+
+def generate_html_report(report_dir, path, result, export_top=0, figure_format="png", profile=None, plots=True,
+                         inline_figures=True, variable_genes=None, correlation=None, distribution=None):
+
+    """
+    Generate an HTML summary report for a gene expression matrix.
+
+    The report includes :
+    - Name and path of the input expression matrix file
+    - Number of tissues/cells and genes, density
+    - Minimum and maximum total counts of genes and tissues/cells
+    - Visualization of the top 10 tissues and genes by total read counts (unless 'plots' is False),
+      inlined in the report (or linked, with inline_figures=False)
+    - Sortable, searchable tables of the total counts of all tissues/cells and all genes
+    - Highly variable genes and their normalized dispersion ('variable_genes' : VariableGenes), if any
+    - Clustered heatmap of the tissue-by-tissue correlation and the most correlated pairs
+      ('correlation' : CorrelationResult), if any
+    - Distribution of all gene totals, and of the counts of each tissue/cell ('distribution' : DistributionResult), if any
+    - Links to the exported rankings (top 'export_top' genes and tissues/cells), if any
+    - Timing of the pipeline stages, if the run was profiled ('profile' : list of Profiler records)
+
+    The figures are generated separately by the plotting functions (files 'top_tissues.<format>' and
+    'top_genes.<format>' in 'report_dir'). All values come from the SummaryResult shared with the console output and the plots.
+
+    Returns
+    -------
+    str : path of the report file
+    """
+
+    summary = result.to_dict()
+
+    def extreme(axis, side):
+        names = ", ".join(escape(name) for name in summary[axis][side]["names"])
+        return f"{summary[axis][side]['value']:g} ({names})"
+
+    report_file = os.path.join(report_dir, "report.html")
+
+    # Sections are written one after the other ; the file is renamed when complete
+    with open(report_file + ".tmp", "w", encoding="utf-8") as f:
+        f.write(f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Expression Matrix Report</title>
+    <style>{REPORT_STYLE}</style>
+</head>
+<body>
+
+<div class="summary-box">
+    <h1>Expression Matrix — Summary Report</h1>
+
+    <p><strong>File:</strong> {escape(path)}</p>
+    <p><strong>Number of tissues / cells:</strong> {result.n_tissues}</p>
+    <p><strong>Number of genes:</strong> {result.n_genes}</p>
+    <p><strong>Density (nonzero counts):</strong> {result.density:.1%}</p>
+    <p><strong>Gene total counts:</strong> min {extreme("genes", "min")} — max {extreme("genes", "max")}</p>
+    <p><strong>Tissue / cell total counts:</strong> min {extreme("tissues", "min")} — max {extreme("tissues", "max")}</p>
+</div>
+""")
+
+        figures = [("top_tissues", "Top 10 tissues / cells by total read counts"),
+                   ("top_genes", "Top 10 genes by total read counts")]
+        if variable_genes is not None:
+            figures.append(("top_variable_genes", "Top 10 highly variable genes by normalized dispersion"))
+        if correlation is not None:
+            figures.append(("tissue_correlation", "Tissue / cell correlation (clustered)"))
+        figures.append(("gene_distribution", "Distribution of all gene total counts"))
+        if distribution is not None:
+            figures.append(("tissue_distribution", "Distribution of the counts of each tissue / cell"))
+
+        if plots:
+            for name, title in figures:
+                figure = f"{name}.{figure_format}"
+                figure_path = os.path.join(report_dir, figure)
+                if inline_figures and os.path.exists(figure_path):
+                    image = inline_figure(figure_path, alt=title)
+                else:
+                    image = f'<img alt="{escape(title)}" src="{figure}">'
+                f.write(f"""
+<h2>{title}</h2>
+<div class="figure-box">
+    {image}
+</div>
+""")
+
+        write_totals_table(f, "tissue-totals", "Total counts of all tissues / cells", "Tissue / cell",
+                           result.tissues, result.tissue_totals)
+        write_totals_table(f, "gene-totals", "Total counts of all genes", "Gene",
+                           result.genes, result.gene_totals)
+
+        if variable_genes is not None:
+            selected = variable_genes.selected
+            write_totals_table(f, "variable-genes", f"Highly variable genes ({len(selected)} selected)", "Gene",
+                               [variable_genes.genes[i] for i in selected], variable_genes.dispersions_norm[selected],
+                               value_label="Normalized dispersion")
+
+        if correlation is not None:
+            pairs = correlation.most_correlated(CORRELATED_PAIRS)
+            write_totals_table(f, "correlated-pairs", f"Most correlated tissue / cell pairs ({correlation.method.capitalize()})",
+                               "Tissue / cell pair", [f"{a} — {b}" for a, b, _ in pairs],
+                               np.array([value for _, _, value in pairs]),
+                               value_label="Correlation")
+
+        if export_top:
+            f.write(f"""
+<h2>Rankings</h2>
+<div class="figure-box">
+    <p><a href="top_tissues.tsv">Top {min(export_top, result.n_tissues)} tissues / cells</a> (tab-separated)</p>
+    <p><a href="top_genes.tsv">Top {min(export_top, result.n_genes)} genes</a> (tab-separated)</p>
+</div>
+""")
+
+        if profile:
+            f.write(f"""
+<h2>Timing</h2>
+<div class="figure-box">
+{profile_table(profile)}
+<p>read_seconds, split_seconds and convert_seconds split the time of the serial loader between reading
+(file reads, gzip decompression, decoding), tokenizing and float conversion ; with --workers, the worker
+processes are not broken down.</p>
+</div>
+""")
+
+        f.write(f"""
+<script>{TABLE_SCRIPT}</script>
+</body>
+</html>
+""")
+
+    os.replace(report_file + ".tmp", report_file)
+    return report_file
@@ -0,0 +1,429 @@
+"""
+Long-lived local query server holding a count matrix in memory.
+
+The matrix is loaded once (see io_utils.load_matrix, with its binary cache) and its summary computed once ;
+quick questions are then answered over a localhost HTTP server or a Unix socket, as JSON, without reparsing
+the file :
+
+    GET /gene?name=TP53                    counts of one gene in every tissue/cell and its total
+    GET /gene?name=TP53,BRCA1              several genes
+    GET /tissues                           total count of every tissue/cell (?name=liver,lung for a subset)
+    GET /top?axis=tissues&k=50             top-k genes or tissues/cells (&order=bottom for the lowest totals)
+    GET /summary                           min/max tie sets, numbers of genes and tissues/cells, density
+    GET /status                            input file, load time, generation and query cache counters
+
+Requests are handled concurrently (one thread per connection, keep-alive connections).
+Encoded responses are kept in an LRU cache : repeated queries skip the computation and the JSON encoding.
+
+Hot reload : a watcher thread checks the size and modification time of the input file every few seconds.
+When they change, the matrix is loaded again in the background while the previous one keeps answering ;
+the new matrix and summary then replace it at once and the query cache is cleared (its keys hold the
+generation of the matrix). A failed reload keeps the previous matrix and is reported by /status.
+
+Example
+-------
+service = QueryService("data/ARCHS4.tsv")
+server = make_server(service, port=8765)              # or make_server(service, unix_socket="/tmp/archs4.sock")
+server.serve_forever()
+
+curl -s "http://127.0.0.1:8765/top?axis=tissues&k=50"
+curl -s --unix-socket /tmp/archs4.sock "http://localhost/gene?name=TP53"
+
+The http.server and socketserver modules serve the requests, the threading module runs the watcher thread
+and the json module encodes the responses.
+"""
+
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from io_utils import load_matrix
+from stats_utils import compute_summary
+
+# Default number of encoded responses kept in the query cache
+CACHE_SIZE = 1024
+
+# Default interval (seconds) between two checks of the input file
+RELOAD_INTERVAL = 2.0
+
+class QueryError(Exception):
+
+    """
+    Invalid query : answered with an HTTP error status and a JSON message.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# ---------------------------------------------------------------------
+# PART 1 : LRU cache of encoded responses
+# ---------------------------------------------------------------------
+
+class LRUCache:
+
+    """
+    Thread-safe least-recently-used cache : once 'capacity' entries are held, the entry unused for the
+    longest time is evicted.
+    """
+
+    def __init__(self, capacity=CACHE_SIZE):
+        if capacity < 0:
+            raise ValueError("Cache capacity must be >= 0")
+        self.capacity = capacity
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+# ---------------------------------------------------------------------
+# PART 2 : Queries on the loaded matrix
+# ---------------------------------------------------------------------
+
+def file_state(path):
+
+    # Size and modification time : a cheap check of the input file, done by the watcher thread
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def split_names(values):
+    return [name for value in values for name in value.split(",") if name]
+
+class QueryService:
+
+    """
+    Matrix, summary and query cache of one input file.
+
+    Parameters
+    ----------
+    - path : str
+      Input matrix file (a regular file : it is watched for hot reload)
+    - loader : callable or None
+      loader(path) -> CountMatrix or SparseCountMatrix (default io_utils.load_matrix)
+    - cache_size : int
+      Number of encoded responses kept in the LRU cache (0 disables the cache)
+    - max_limit : int
+      Maximum number of names in the min/max tie sets of the summary
+
+    Attributes
+    ----------
+    - matrix, result : the loaded matrix and its SummaryResult (replaced together on reload)
+    - generation : int
+      Number of loads of the input file, part of the query cache keys
+    - loaded_at : float
+      Time of the last successful load
+    - last_error : str or None
+      Error of the last failed reload
+    """
+
+    def __init__(self, path, loader=None, cache_size=CACHE_SIZE, max_limit=10):
+        self.path = path
+        self.loader = loader or load_matrix
+        self.max_limit = max_limit
+        self.cache = LRUCache(cache_size)
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._failed_state = None
+
+        self._snapshot = None
+        self.reload()
+
+    @property
+    def matrix(self):
+        return self._snapshot[0]
+
+    @property
+    def result(self):
+        return self._snapshot[1]
+
+    @property
+    def loaded_at(self):
+        return self._snapshot[3]
+
+    @property
+    def generation(self):
+        return self._snapshot[4] if self._snapshot else 0
+
+    def reload(self):
+
+        """
+        Load the input file and replace the matrix, its summary and the query cache.
+        """
+
+        with self._reload_lock:
+            state = file_state(self.path)
+            matrix = self.loader(self.path)
+            result = compute_summary(matrix.tissues, matrix, self.max_limit)
+
+            # A single reference is replaced : concurrent queries see the old or the new matrix, never a mix
+            self._snapshot = (matrix, result, state, time.time(), self.generation + 1)
+            self.last_error = None
+            self.cache.clear()
+
+    def check(self):
+
+        """
+        Reload the input file if its size or modification time changed.
+
+        Returns
+        -------
+        bool : True if the matrix was reloaded
+        """
+
+        state = None
+        try:
+            state = file_state(self.path)
+            changed = state != self._snapshot[2] and state != self._failed_state
+            if changed:
+                self.reload()
+            return changed
+        except Exception as error:
+            # The file may be missing or half-written (truncated gzip stream, partial last line...) : keep answering
+            # with the previous matrix, and only try again once the file changes again
+            self.last_error = f"{type(error).__name__}: {error}"
+            self._failed_state = state
+            return False
+
+    def watch(self, interval=RELOAD_INTERVAL):
+
+        """
+        Start the watcher thread checking the input file every 'interval' seconds.
+        """
+
+        if self._watcher is None:
+            self._stop.clear()
+
+            def run():
+                while not self._stop.wait(interval):
+                    self.check()
+
+            self._watcher = threading.Thread(target=run, name="matrix-watcher", daemon=True)
+            self._watcher.start()
+        return self._watcher
+
+    def close(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    # ---------------------------------------------------------------------
+    # Query handlers
+    # ---------------------------------------------------------------------
+
+    def query(self, route, params=None):
+
+        """
+        Answer a query.
+
+        Parameters
+        ----------
+        - route : str
+          "/gene", "/tissues", "/top", "/summary" or "/status"
+        - params : dict[str, list[str]] or None
+          Query string parameters, as returned by urllib.parse.parse_qs
+
+        Returns
+        -------
+        bytes : the encoded JSON response (raises QueryError for an invalid query)
+        """
+
+        params = params or {}
+        if route == "/status":
+            return self.encode(self.status())
+
+        handler = self.ROUTES.get(route)
+        if handler is None:
+            raise QueryError(f"Unknown query: {route} (expected /gene, /tissues, /top, /summary or /status)",
+                             status=404)
+
+        # Responses depend on the loaded matrix only : the generation is part of the key
+        snapshot = self._snapshot
+        key = (snapshot[4], route, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        response = self.cache.get(key)
+        if response is None:
+            response = self.encode(handler(self, snapshot[0], snapshot[1], params))
+            self.cache.put(key, response)
+        return response
+
+    @staticmethod
+    def encode(payload):
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    def gene(self, matrix, result, params):
+        names = split_names(params.get("name", []))
+        if not names:
+            raise QueryError("Missing gene name (/gene?name=GENE)")
+
+        missing = [name for name in names if name not in matrix.gene_index]
+        if missing:
+            raise QueryError(f"Unknown gene: {', '.join(missing)}", status=404)
+
+        genes = {}
+        for name in names:
+            counts = matrix.row(name)
+            genes[name] = {"total": float(result.gene_totals[matrix.gene_index[name]]),
+                           "counts": dict(zip(matrix.tissues, counts.tolist()))}
+        return genes
+
+    def tissues(self, matrix, result, params):
+        totals = result.tissue_totals_dict()
+        names = split_names(params.get("name", []))
+        if not names:
+            return totals
+
+        missing = [name for name in names if name not in totals]
+        if missing:
+            raise QueryError(f"Unknown tissue/cell: {', '.join(missing)}", status=404)
+        return {name: totals[name] for name in names}
+
+    def top(self, matrix, result, params):
+        axis = params.get("axis", ["genes"])[-1]
+        order = params.get("order", ["top"])[-1]
+        if axis not in ("genes", "tissues"):
+            raise QueryError(f"Unknown axis: {axis} (expected genes or tissues)")
+        if order not in ("top", "bottom"):
+            raise QueryError(f"Unknown order: {order} (expected top or bottom)")
+        try:
+            k = int(params.get("k", ["10"])[-1])
+        except ValueError:
+            raise QueryError("k must be an integer") from None
+        if k < 1:
+            raise QueryError("k must be >= 1")
+
+        ranking = getattr(result, f"{order}_{axis}")(k)
+        return {"axis": axis, "order": order, "k": k, "items": [[name, value] for name, value in ranking]}
+
+    def summary(self, matrix, result, params):
+        return {"file": str(self.path), "n_genes": result.n_genes, "n_tissues": result.n_tissues,
+                "density": result.density, "summary": result.to_dict()}
+
+    def status(self):
+        return {"file": str(self.path), "generation": self.generation, "loaded_at": self.loaded_at,
+                "n_genes": self.result.n_genes, "n_tissues": self.result.n_tissues,
+                "last_error": self.last_error, "cache": self.cache.stats()}
+
+    ROUTES = {"/gene": gene, "/tissues": tissues, "/top": top, "/summary": summary}
+
+# ---------------------------------------------------------------------
+# PART 3 : HTTP server (TCP on localhost or Unix socket)
+# ---------------------------------------------------------------------
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive connections : a client sending many queries does not reconnect for each one
+    protocol_version = "HTTP/1.1"
+
+    # Buffered writes : headers and body leave in a single packet (separate small writes are delayed by the
+    # Nagle algorithm and delayed acknowledgements, about 40 ms per response on keep-alive connections)
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            body = self.server.service.query(url.path.rstrip("/") or "/", parse_qs(url.query))
+            status = 200
+        except QueryError as error:
+            body, status = QueryService.encode({"error": str(error)}), error.status
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        # No access log : it would cost more than most queries
+        pass
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+
+        # A socket file left by a previous server is replaced
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def make_server(service, host="127.0.0.1", port=8765, unix_socket=None):
+
+    """
+    HTTP server answering the queries of 'service' (see QueryService), one thread per connection.
+
+    Listens on 'unix_socket' if given, else on host:port (port 0 picks a free port, see server.server_address).
+    """
+
+    if unix_socket:
+        server = ThreadingUnixHTTPServer(unix_socket, QueryHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+def serve(path, host="127.0.0.1", port=8765, unix_socket=None, loader=None, cache_size=CACHE_SIZE,
+          reload_interval=RELOAD_INTERVAL):
+
+    """
+    Load 'path' and answer queries until interrupted (Ctrl+C).
+    """
+
+    service = QueryService(path, loader=loader, cache_size=cache_size)
+    if reload_interval:
+        service.watch(reload_interval)
+
+    server = make_server(service, host, port, unix_socket)
+    address = unix_socket or "http://{}:{}".format(*server.server_address[:2])
+    print(f"Serving {path} ({service.result.n_genes} genes, {service.result.n_tissues} tissues/cells) on {address}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
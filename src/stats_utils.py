@@ -6,12 +6,25 @@ This module provides functions to compute summary statistics from an expression
 - Total read counts per tissue/cell
 - Identification of minimum and maximum total counts
 - Structured summaries of statistical results
+- A fused summary engine computing all of the above in one traversal (compute_summary / SummaryResult)
+- Top-k / bottom-k selection by partial selection instead of full sorts (top_k, StreamingTopK)
+- Single-pass streaming aggregation of count rows (StreamingAggregator)
+
+All functions accept either the old 'data' dictionary (gene -> list of counts), a CountMatrix or a SparseCountMatrix
+(see matrix_utils). With a count matrix, totals and min/max detection are computed as vectorized NumPy reductions ;
+with a SparseCountMatrix they only read the nonzero counts.
 
 The math module is used to perform robust floating-point comparisons.
+The heapq module is used for bounded top-k selection.
 """
 
+import heapq
 import math
 
+import numpy as np
+
+from matrix_utils import MATRIX_TYPES
+
 def total_count_gene(data):
 
     """
@@ -27,6 +40,9 @@ def total_count_gene(data):
     {"GENE1" : 188.0, "GENE2" : ...}
     """
 
+    if isinstance(data, MATRIX_TYPES):
+        return dict(zip(data.genes, data.gene_totals().tolist()))
+
     return {gene: sum(counts) for gene, counts in data.items()}
 
 def total_count_tissue(tissues, data):
@@ -44,6 +60,11 @@ def total_count_tissue(tissues, data):
     {"tissue1": 145.0, "tissue2": 367.0, "tissue3": 12.0 ...}
     """
 
+    if isinstance(data, MATRIX_TYPES):
+        if len(tissues) != data.n_tissues:
+            raise ValueError("Counts length does not match number of tissues/cells")
+        return dict(zip(tissues, data.tissue_totals().tolist()))
+
     # Initialize a dictionary with all tissues/cells set to 0.0
     totals = {t: 0.0 for t in tissues}
 
@@ -98,6 +119,320 @@ def min_max_items(d: dict, max_limit: int = 10, rel_tol: float = 1e-9, abs_tol:
 
     return min_items, min_val, max_items, max_val
 
+def min_max_array(names, values, max_limit: int = 10, rel_tol: float = 1e-9, abs_tol: float = 1e-12):
+
+    """
+    Vectorized equivalent of 'min_max_items' for values stored in a NumPy array.
+
+    'names[i]' is the key associated with 'values[i]'.
+    Ties are detected with the same tolerance rule as math.isclose and returned in positional order.
+
+    Returns
+    ------
+    tuple: (min_items, min_val, max_items, max_val), as for 'min_max_items'
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        raise ValueError("Input array is empty")
+
+    min_val = float(values.min())
+    max_val = float(values.max())
+
+    def close_to(target):
+        # Same rule as math.isclose : |a - b| <= max(rel_tol * max(|a|, |b|), abs_tol)
+        tol = np.maximum(rel_tol * np.maximum(np.abs(values), abs(target)), abs_tol)
+        return (np.abs(values - target) <= tol) | (values == target)
+
+    min_items = [names[i] for i in np.flatnonzero(close_to(min_val))[:max_limit]]
+    max_items = [names[i] for i in np.flatnonzero(close_to(max_val))[:max_limit]]
+
+    return min_items, min_val, max_items, max_val
+
+# ---------------------------------------------------------------------
+# Top-k selection : partial selection instead of full sorts
+# ---------------------------------------------------------------------
+
+def top_k_indices(values, k, largest: bool = True):
+
+    """
+    Indices of the 'k' largest (or smallest) values of a NumPy array, in ranking order.
+
+    Uses np.argpartition, so only the k selected values are sorted.
+    Ties are ordered by position, exactly as a stable full sort would order them.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if k is None or k >= n:
+        order = np.argsort(-values if largest else values, kind="stable")
+        return order
+
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # k-th best value, then every value strictly better and the first positions equal to it
+    keys = -values if largest else values
+    threshold = np.partition(keys, k - 1)[k - 1]
+    better = np.flatnonzero(keys < threshold)
+    equal = np.flatnonzero(keys == threshold)[:k - len(better)]
+    selected = np.concatenate([better, equal])
+
+    # Sort the selection by value, then by position
+    return selected[np.lexsort((selected, keys[selected]))]
+
+def top_k(totals, k=10, largest: bool = True, names=None):
+
+    """
+    Select the 'k' items with the highest (or lowest) totals without sorting all of them.
+
+    'totals' can be a dictionary {name: value} (bounded heap, O(n log k))
+    or a NumPy array with the matching 'names' (np.argpartition, O(n)).
+    With k=None, all items are returned in ranking order.
+
+    Ties are ordered deterministically by original position,
+    as with sorted(totals.items(), key=lambda x: x[1], reverse=True)[:k].
+
+    Returns
+    -------
+    list[tuple[str, float]] : (name, value) pairs in ranking order
+    """
+
+    if isinstance(totals, dict):
+        items = totals.items()
+        if k is None:
+            return sorted(items, key=lambda x: x[1], reverse=largest)
+
+        # heapq.nlargest/nsmallest are equivalent to a stable sort truncated to k items
+        select = heapq.nlargest if largest else heapq.nsmallest
+        return select(k, items, key=lambda x: x[1])
+
+    if names is None:
+        raise ValueError("names are required when totals is an array")
+
+    values = np.asarray(totals, dtype=np.float64)
+    return [(names[i], float(values[i])) for i in top_k_indices(values, k, largest)]
+
+class StreamingTopK:
+
+    """
+    Keep the 'k' best (name, value) pairs of a stream in a bounded heap, in O(k) memory.
+
+    Ties are resolved by arrival order (the earliest pair wins), so the result is the same as 'top_k'
+    on the complete data.
+
+    Example
+    -------
+    best = StreamingTopK(50)
+    for gene, counts in rows:
+        best.push(gene, counts.sum())
+    best.result()
+    """
+
+    def __init__(self, k, largest: bool = True):
+        if k <= 0:
+            raise ValueError("k must be positive")
+        self.k = k
+        self.largest = largest
+        self._heap = []
+        self._seen = 0
+
+    def push(self, name, value):
+
+        # The heap root is the worst kept pair : lowest score, then latest arrival
+        score = value if self.largest else -value
+        entry = (score, -self._seen, name, value)
+        self._seen += 1
+
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def extend(self, pairs):
+        for name, value in pairs:
+            self.push(name, value)
+        return self
+
+    def result(self):
+
+        """
+        list[tuple[str, float]] : The kept (name, value) pairs in ranking order.
+        """
+
+        ranked = sorted(self._heap, key=lambda entry: (-entry[0], -entry[1]))
+        return [(name, value) for _, _, name, value in ranked]
+
+# ---------------------------------------------------------------------
+# Fused summary engine : totals, min/max and rankings computed once
+# ---------------------------------------------------------------------
+
+class SummaryResult:
+
+    """
+    Reusable result of the analysis of a count matrix.
+
+    Holds the total counts per gene and per tissue/cell (NumPy arrays), the min/max tie sets
+    and the top-N rankings. It is computed once and shared by the console output,
+    the plotting functions and the HTML report.
+
+    Attributes
+    ----------
+    - tissues, genes : list[str]
+    - tissue_totals, gene_totals : numpy.ndarray (float64)
+      Totals aligned with 'tissues' and 'genes'
+    - genes_min_max, tissues_min_max : tuple
+      (min_items, min_val, max_items, max_val), as returned by 'min_max_items'
+    - density : float or None
+      Fraction of nonzero counts in the matrix
+    """
+
+    def __init__(self, tissues, genes, tissue_totals, gene_totals, max_limit: int = 10,
+                 rel_tol: float = 1e-9, abs_tol: float = 1e-12, genes_min_max=None, density=None):
+        self.tissues = list(tissues)
+        self.genes = list(genes)
+        self.tissue_totals = np.asarray(tissue_totals, dtype=np.float64)
+        self.gene_totals = np.asarray(gene_totals, dtype=np.float64)
+        self.max_limit = max_limit
+        self.density = density
+
+        if len(self.tissue_totals) != len(self.tissues) or len(self.gene_totals) != len(self.genes):
+            raise ValueError("Totals length does not match number of genes or tissues/cells")
+
+        # Min/max tie sets (genes_min_max may already be known, e.g. from a streaming pass)
+        self.genes_min_max = genes_min_max or min_max_array(self.genes, self.gene_totals, max_limit, rel_tol, abs_tol)
+        self.tissues_min_max = min_max_array(self.tissues, self.tissue_totals, max_limit, rel_tol, abs_tol)
+
+        self._orders = {}
+
+    @property
+    def n_genes(self):
+        return len(self.genes)
+
+    @property
+    def n_tissues(self):
+        return len(self.tissues)
+
+    def gene_totals_dict(self):
+
+        """
+        dict[str, float] : Dictionary mapping each gene to its total count (as 'total_count_gene').
+        """
+
+        return dict(zip(self.genes, self.gene_totals.tolist()))
+
+    def tissue_totals_dict(self):
+
+        """
+        dict[str, float] : Dictionary mapping each tissue/cell to its total count (as 'total_count_tissue').
+        """
+
+        return dict(zip(self.tissues, self.tissue_totals.tolist()))
+
+    def _ranking(self, axis, n, largest=True):
+        names, values = (self.genes, self.gene_totals) if axis == "genes" else (self.tissues, self.tissue_totals)
+
+        # Rankings already computed for at least n items are reused
+        key = (axis, largest)
+        cached = self._orders.get(key)
+        if cached is None or (len(cached) < len(values) and (n is None or n > len(cached))):
+            cached = self._orders[key] = top_k_indices(values, n, largest)
+        order = cached if n is None else cached[:n]
+
+        return [(names[i], float(values[i])) for i in order]
+
+    def top_genes(self, n=10):
+
+        """
+        list[tuple[str, float]] : The 'n' genes with the highest total counts, in descending order.
+        """
+
+        return self._ranking("genes", n)
+
+    def top_tissues(self, n=10):
+
+        """
+        list[tuple[str, float]] : The 'n' tissues/cells with the highest total counts, in descending order.
+        """
+
+        return self._ranking("tissues", n)
+
+    def bottom_genes(self, n=10):
+
+        """
+        list[tuple[str, float]] : The 'n' genes with the lowest total counts, in ascending order.
+        """
+
+        return self._ranking("genes", n, largest=False)
+
+    def bottom_tissues(self, n=10):
+
+        """
+        list[tuple[str, float]] : The 'n' tissues/cells with the lowest total counts, in ascending order.
+        """
+
+        return self._ranking("tissues", n, largest=False)
+
+    def to_dict(self):
+
+        """
+        Returns
+        -------
+        dict : Structured summary dictionary, in the same format as 'summarize'
+        """
+
+        min_genes, min_gene_val, max_genes, max_gene_val = self.genes_min_max
+        min_tissues, min_tissue_val, max_tissues, max_tissue_val = self.tissues_min_max
+
+        return {
+            "genes": {
+                "min": {"names": min_genes, "value": min_gene_val},
+                "max": {"names": max_genes, "value": max_gene_val}
+            },
+            "tissues": {
+                "min": {"names": min_tissues, "value": min_tissue_val},
+                "max": {"names": max_tissues, "value": max_tissue_val}
+            }
+        }
+
+def compute_summary(tissues, data, max_limit=10, rel_tol: float = 1e-9, abs_tol: float = 1e-12):
+
+    """
+    Compute gene totals, tissue/cell totals, min/max tie sets and rankings in a single traversal of the matrix.
+
+    'data' can be a CountMatrix (blockwise NumPy reductions), a SparseCountMatrix (reductions over
+    the nonzero counts only) or the old dictionary (gene and tissue/cell totals accumulated in the same loop).
+
+    Returns
+    -------
+    SummaryResult
+    """
+
+    if isinstance(data, MATRIX_TYPES):
+        if len(tissues) != data.n_tissues:
+            raise ValueError("Counts length does not match number of tissues/cells")
+
+        gene_totals, tissue_totals = data.totals()
+        return SummaryResult(tissues, data.genes, tissue_totals, gene_totals, max_limit, rel_tol, abs_tol,
+                             density=data.density)
+
+    gene_totals = np.empty(len(data), dtype=np.float64)
+    tissue_totals = np.zeros(len(tissues), dtype=np.float64)
+    nnz = 0
+
+    for i, counts in enumerate(data.values()):
+        if len(counts) != len(tissues):
+            raise ValueError("Counts length does not match number of tissues/cells")
+
+        counts = np.asarray(counts, dtype=np.float64)
+        gene_totals[i] = counts.sum()
+        tissue_totals += counts
+        nnz += np.count_nonzero(counts)
+
+    size = len(data) * len(tissues)
+    return SummaryResult(tissues, list(data), tissue_totals, gene_totals, max_limit, rel_tol, abs_tol,
+                         density=nnz / size if size else 0.0)
+
 def summarize(tissues, data, max_limit=10):
 
     """
@@ -121,23 +456,167 @@ def summarize(tissues, data, max_limit=10):
         }
     """
     
-    gene_totals = total_count_gene(data)
+    return compute_summary(tissues, data, max_limit).to_dict()
 
-    # Identify genes with minimum and maximum total counts
-    min_genes, min_gene_val, max_genes, max_gene_val = min_max_items(gene_totals, max_limit) 
+# ---------------------------------------------------------------------
+# Streaming aggregation : one pass over the count rows, O(genes + tissues) memory
+# ---------------------------------------------------------------------
 
-    tissue_totals = total_count_tissue(tissues, data)
+class RunningExtremes:
 
-    # Identify tissues/cells with minimum and maximum total counts
-    min_tissues, min_tissue_val, max_tissues, max_tissue_val = min_max_items(tissue_totals, max_limit)
+    """
+    Track the minimum and maximum of a stream of (name, value) pairs, with tolerance-based tie sets.
 
-    return {
-        "genes": {
-            "min": {"names": min_genes, "value": min_gene_val},
-            "max": {"names": max_genes, "value": max_gene_val}
-        },
-        "tissues": {
-            "min": {"names": min_tissues, "value": min_tissue_val},
-            "max": {"names": max_tissues, "value": max_tissue_val}
-        }
-    }
\ No newline at end of file
+    Names whose value is numerically equal (math.isclose) to the current minimum or maximum are kept in arrival order.
+    When a new extreme is found, candidates that are no longer close to it are discarded,
+    so the final tie sets match those of 'min_max_items' on the complete dictionary.
+    """
+
+    def __init__(self, rel_tol: float = 1e-9, abs_tol: float = 1e-12):
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.min_val = None
+        self.max_val = None
+
+        # Candidate (name, value) pairs close to the current minimum / maximum
+        self._min_ties = []
+        self._max_ties = []
+
+    def _close(self, a, b):
+        return math.isclose(a, b, rel_tol=self.rel_tol, abs_tol=self.abs_tol)
+
+    def add(self, name, value):
+        if self.min_val is None:
+            self.min_val = self.max_val = value
+            self._min_ties.append((name, value))
+            self._max_ties.append((name, value))
+            return
+
+        # Minimum side
+        if value < self.min_val:
+            self.min_val = value
+            self._min_ties = [(n, v) for n, v in self._min_ties if self._close(v, value)]
+            self._min_ties.append((name, value))
+        elif self._close(value, self.min_val):
+            self._min_ties.append((name, value))
+
+        # Maximum side
+        if value > self.max_val:
+            self.max_val = value
+            self._max_ties = [(n, v) for n, v in self._max_ties if self._close(v, value)]
+            self._max_ties.append((name, value))
+        elif self._close(value, self.max_val):
+            self._max_ties.append((name, value))
+
+    def result(self, max_limit: int = 10):
+
+        """
+        Returns
+        ------
+        tuple: (min_items, min_val, max_items, max_val), as for 'min_max_items'
+        """
+
+        if self.min_val is None:
+            raise ValueError("No value was added")
+
+        min_items = [n for n, _ in self._min_ties[:max_limit]]
+        max_items = [n for n, _ in self._max_ties[:max_limit]]
+        return min_items, self.min_val, max_items, self.max_val
+
+class DuplicateGeneError(ValueError):
+
+    """
+    Raised by StreamingAggregator when a gene is added twice : the counts of its earlier row cannot be taken back.
+    """
+
+    def __init__(self, gene):
+        super().__init__(f"Duplicate gene {gene} is not supported in streaming mode")
+        self.gene = gene
+
+class StreamingAggregator:
+
+    """
+    Single-pass aggregation of count rows streamed from the file reader.
+
+    Per-gene and per-tissue/cell running totals are updated as rows arrive,
+    together with the min/max tie sets of gene totals.
+    The full matrix is never materialized: memory is O(genes + tissues).
+
+    Example
+    -------
+    tissues, rows = stream_matrix(path)
+    aggregator = StreamingAggregator(tissues).consume(rows)
+    summary = aggregator.summary()
+    """
+
+    def __init__(self, tissues, rel_tol: float = 1e-9, abs_tol: float = 1e-12):
+        self.tissues = list(tissues)
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.gene_totals = {}
+        self.tissue_sums = np.zeros(len(self.tissues), dtype=np.float64)
+        self.gene_extremes = RunningExtremes(rel_tol, abs_tol)
+        self.nnz = 0
+
+    @property
+    def n_genes(self):
+        return len(self.gene_totals)
+
+    def add(self, gene, counts):
+        if len(counts) != len(self.tissues):
+            raise ValueError("Counts length does not match number of tissues/cells")
+        if gene in self.gene_totals:
+            raise DuplicateGeneError(gene)
+
+        counts = np.asarray(counts, dtype=np.float64)
+        total = float(counts.sum())
+
+        self.gene_totals[gene] = total
+        self.tissue_sums += counts
+        self.gene_extremes.add(gene, total)
+        self.nnz += int(np.count_nonzero(counts))
+
+    def consume(self, rows):
+
+        """
+        Add every (gene, counts) pair of an iterable (typically the generator returned by 'stream_matrix').
+        """
+
+        for gene, counts in rows:
+            self.add(gene, counts)
+        return self
+
+    def tissue_totals(self):
+
+        """
+        Returns
+        -------
+        dict[str, float] : Dictionary mapping each tissue/cell to the total count across all genes.
+        """
+
+        return dict(zip(self.tissues, self.tissue_sums.tolist()))
+
+    def summary(self, max_limit: int = 10):
+
+        """
+        Returns
+        -------
+        dict : Structured summary dictionary, in the same format as 'summarize'
+        """
+
+        return self.result(max_limit).to_dict()
+
+    def result(self, max_limit: int = 10):
+
+        """
+        Returns
+        -------
+        SummaryResult : the same result object as 'compute_summary', built from the running totals
+        """
+
+        size = self.n_genes * len(self.tissues)
+        return SummaryResult(self.tissues, list(self.gene_totals), self.tissue_sums,
+                             np.fromiter(self.gene_totals.values(), dtype=np.float64, count=self.n_genes),
+                             max_limit, self.rel_tol, self.abs_tol,
+                             genes_min_max=self.gene_extremes.result(max_limit),
+                             density=self.nnz / size if size else 0.0)
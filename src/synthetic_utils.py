@@ -0,0 +1,98 @@
+"""
+Deterministic generator of synthetic count matrices in the ARCHS4 layout read by io_utils.
+
+Each gene has 8 statistics rows (count, mean, std, min, max, 25%, 50%, 75%), one column per tissue/cell:
+
+                 tissue1    tissue2    ...
+GENE1   count     63         0
+GENE1   mean      181.159    12.5
+...
+
+Counts are drawn from a negative binomial distribution (heavy-tailed, as real read counts),
+then a fraction 'sparsity' of them is set to 0. The other statistics rows are derived from the counts
+so that they look plausible, but are not meant to be consistent.
+
+The same parameters and seed always produce the same file (used for tests and benchmarks).
+"""
+
+import gzip
+import os
+
+import numpy as np
+
+from io_utils import STAT_NAMES
+from parallel_utils import bgzf_compress
+
+# Number of genes generated at once
+BLOCK_GENES = 1024
+
+def format_row(gene, stat, values, integer):
+    if integer:
+        text = "\t".join(map(str, values.astype(np.int64).tolist()))
+    else:
+        text = "\t".join(f"{v:.3f}" for v in values.tolist())
+    return f"{gene}\t{stat}\t{text}\n"
+
+def generate_matrix(path, n_genes, n_tissues, sparsity=0.5, seed=0, compress=None):
+
+    """
+    Write a synthetic count matrix to 'path'.
+
+    Parameters
+    ----------
+    - n_genes, n_tissues : int
+      Dimensions of the count matrix
+    - sparsity : float
+      Fraction of counts set to 0 (0.0 to 1.0)
+    - seed : int
+      Seed of the random generator
+    - compress : None, "gzip" or "bgzf"
+      Compression of the output file (block-gzipped BGZF files can be decompressed in parallel)
+
+    Returns
+    -------
+    str : path of the generated file
+    """
+
+    if not 0.0 <= sparsity <= 1.0:
+        raise ValueError("sparsity must be between 0 and 1")
+    if compress not in (None, "gzip", "bgzf"):
+        raise ValueError(f"Unsupported compression: {compress}")
+
+    rng = np.random.default_rng(seed)
+    text_path = path + ".tmp" if compress == "bgzf" else path
+    opener = gzip.open if compress == "gzip" else open
+
+    with opener(text_path, "wt", encoding="utf-8") as f:
+        f.write("\t\t" + "\t".join(f"tissue{j + 1}" for j in range(n_tissues)) + "\n")
+
+        for start in range(0, n_genes, BLOCK_GENES):
+            size = min(BLOCK_GENES, n_genes - start)
+
+            # Per-gene expression level, then counts around it
+            level = rng.lognormal(mean=3.0, sigma=1.5, size=(size, 1))
+            counts = rng.negative_binomial(2, 2 / (2 + level), size=(size, n_tissues))
+            counts[rng.random((size, n_tissues)) < sparsity] = 0
+
+            spread = rng.random((size, n_tissues)) + 0.5
+            derived = {
+                "mean": counts * spread,
+                "std": np.sqrt(counts) * spread,
+                "min": np.floor(counts * spread / 2),
+                "max": np.ceil(counts * spread * 2),
+                "25%": counts * spread * 0.5,
+                "50%": counts * spread * 0.9,
+                "75%": counts * spread * 1.5,
+            }
+
+            for i in range(size):
+                gene = f"GENE{start + i + 1}"
+                f.write(format_row(gene, "count", counts[i], integer=True))
+                for stat in STAT_NAMES[1:]:
+                    f.write(format_row(gene, stat, derived[stat][i], integer=stat in ("min", "max")))
+
+    if compress == "bgzf":
+        bgzf_compress(text_path, path)
+        os.remove(text_path)
+
+    return path
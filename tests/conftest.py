@@ -0,0 +1,44 @@
+"""
+Shared test data builders.
+
+- make_matrix : random zero-heavy CountMatrix (a Poisson number of reads times a random depth per count),
+  the same for the same parameters and seed
+- write_matrix : small matrix file written to the temporary directory of the test, one row per statistic
+  for each (gene, counts) pair
+"""
+
+import numpy as np
+import pytest
+
+from matrix_utils import CountMatrix
+
+def random_matrix(n_genes, n_tissues, rate=0.5, depth=50, dtype="float64", seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (n_genes, n_tissues)
+    counts = (rng.poisson(rate, shape) * rng.integers(1, depth, shape)).astype(dtype)
+    return CountMatrix([f"T{i}" for i in range(n_tissues)], [f"G{i}" for i in range(n_genes)], counts)
+
+@pytest.fixture
+def make_matrix():
+    return random_matrix
+
+@pytest.fixture
+def write_matrix(tmp_path):
+
+    """
+    Write a matrix file 'name' with the given tissues/cells and (gene, counts) rows, and return its path.
+
+    Statistics other than "count" are written as 1.5.
+    """
+
+    def write(name, tissues, rows, stats=("count",), newline="\n"):
+        lines = ["\t\t" + "\t".join(tissues)]
+        for gene, counts in rows:
+            for stat in stats:
+                values = map(str, counts) if stat == "count" else ["1.5"] * len(counts)
+                lines.append(f"{gene}\t{stat}\t" + "\t".join(values))
+        path = tmp_path / name
+        path.write_bytes((newline.join(lines) + newline).encode("utf-8"))
+        return str(path)
+
+    return write
@@ -0,0 +1,75 @@
+"""
+Unit tests for the persisted aggregate state updated from delta files.
+
+A base matrix, a delta of new tissues/cells and a delta of new genes are written to a temporary directory.
+
+Checks that:
+- Folding the base and both deltas gives the same summary as the full matrix
+- The state is saved and loaded back unchanged
+- A file already folded is skipped by 'update_state' and rejected by 'fold'
+- Counts of an existing gene in an existing tissue/cell and duplicate genes are rejected, the state unchanged
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_aggregate_utils.py
+"""
+
+import numpy as np
+import pytest
+
+from aggregate_utils import AggregateState, update_state
+from io_utils import load_matrix
+from stats_utils import compute_summary
+
+@pytest.fixture
+def inputs(write_matrix):
+    base = write_matrix("base.tsv", ["t1", "t2"], [("A", [1, 0]), ("B", [3, 4])])
+    columns = write_matrix("columns.tsv", ["t3"], [("B", [2]), ("C", [7]), ("A", [0])])
+    rows = write_matrix("rows.tsv", ["t3", "t1", "t2"], [("D", [1, 1, 0])])
+    full = write_matrix("full.tsv", ["t1", "t2", "t3"],
+                        [("A", [1, 0, 0]), ("B", [3, 4, 2]), ("C", [0, 0, 7]), ("D", [1, 0, 1])])
+    return base, columns, rows, full
+
+def test_fold_deltas(inputs, tmp_path):
+    base, columns, rows, full = inputs
+    state_path = str(tmp_path / "state.npz")
+
+    state, folded = update_state(state_path, [base, columns, rows])
+    assert [source["new_tissues"] for source in folded] == [2, 1, 0]
+    assert [source["new_genes"] for source in folded] == [2, 1, 1]
+
+    matrix = load_matrix(full)
+    expected = compute_summary(matrix.tissues, matrix)
+    result = state.result()
+    assert result.to_dict() == expected.to_dict()
+    assert dict(zip(state.genes, state.gene_totals)) == {"A": 1, "B": 9, "C": 7, "D": 2}
+    assert dict(zip(state.tissues, state.tissue_totals)) == {"t1": 5, "t2": 4, "t3": 10}
+    assert state.density == pytest.approx(7 / 12)
+
+    loaded = AggregateState.load(state_path)
+    assert loaded.genes == state.genes and loaded.tissues == state.tissues and loaded.nnz == state.nnz
+    assert np.array_equal(loaded.gene_totals, state.gene_totals)
+    assert loaded.sources == state.sources
+
+def test_fold_twice(inputs, tmp_path):
+    base, columns, _, _ = inputs
+    state_path = str(tmp_path / "state.npz")
+
+    update_state(state_path, [base, columns])
+    state, folded = update_state(state_path, [base, columns])
+    assert folded == [] and state.n_tissues == 3
+    with pytest.raises(ValueError, match="already folded"):
+        state.fold(base)
+
+def test_fold_errors(inputs, write_matrix, tmp_path):
+    base, _, _, _ = inputs
+    state = AggregateState.build(base)
+
+    overlap = write_matrix("overlap.tsv", ["t2", "t4"], [("E", [1, 1]), ("A", [5, 1])])
+    duplicate = write_matrix("duplicate.tsv", ["t4"], [("E", [1]), ("E", [2])])
+    for path, message in ((overlap, "already in the state"), (duplicate, "Duplicate gene E")):
+        with pytest.raises(ValueError, match=message):
+            state.fold(path)
+
+    assert state.genes == ["A", "B"] and state.tissues == ["t1", "t2"] and len(state.sources) == 1
+    assert state.gene_index == {"A": 0, "B": 1} and list(state.tissue_totals) == [4, 4]
@@ -0,0 +1,92 @@
+"""
+Unit tests for the binary cache of loaded matrices.
+
+A small matrix is written to a temporary directory.
+
+Checks that:
+- A first load writes the cache and a second load memory-maps it
+- The cache is invalidated when the input file changes
+- A separate cache directory can be used
+- The cache can be rebuilt or disabled
+- A sparse matrix is cached in CSR form
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_cache_utils.py
+"""
+
+import os
+import numpy as np
+from cache_utils import cache_location, read_cache
+from io_utils import load_matrix
+from matrix_utils import SparseCountMatrix
+
+MATRIX = (
+    "\t\ttissue1\ttissue2\n"
+    "GENE1\tcount\t63\t120\n"
+    "GENE1\tmean\t181.159\t2.5\n"
+    "GENE2\tcount\t0\t2\n"
+    )
+
+def write_matrix(tmp_path, content=MATRIX):
+    path = tmp_path / "matrix.tsv"
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+def test_cache_round_trip(tmp_path):
+    path = write_matrix(tmp_path)
+
+    assert read_cache(path) is None
+    matrix = load_matrix(path)
+    assert os.path.isdir(cache_location(path))
+
+    cached = read_cache(path)
+    assert cached.genes == matrix.genes
+    assert cached.tissues == matrix.tissues
+    assert np.array_equal(cached.counts, matrix.counts)
+
+    # The cached counts are memory-mapped in read-only mode
+    assert not cached.counts.flags.writeable
+
+    # Each dtype is cached separately
+    assert read_cache(path, dtype="float32") is None
+    load_matrix(path, dtype="float32")
+    assert read_cache(path, dtype="float32").dtype == np.float32
+    assert read_cache(path) is not None
+
+def test_cache_invalidation(tmp_path):
+    path = write_matrix(tmp_path)
+    load_matrix(path)
+
+    write_matrix(tmp_path, MATRIX + "GENE3\tcount\t5\t5\n")
+    assert read_cache(path) is None
+    assert load_matrix(path).genes == ["GENE1", "GENE2", "GENE3"]
+
+def test_cache_dir_and_switches(tmp_path):
+    path = write_matrix(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+
+    load_matrix(path, cache=False)
+    assert not os.path.exists(cache_location(path))
+
+    load_matrix(path, cache_dir=cache_dir)
+    assert not os.path.exists(cache_location(path))
+    assert read_cache(path, cache_dir=cache_dir) is not None
+
+    matrix = load_matrix(path, cache_dir=cache_dir, rebuild_cache=True)
+    assert matrix.counts.flags.writeable
+    assert read_cache(path, cache_dir=cache_dir) is not None
+
+def test_cache_sparse(tmp_path):
+    path = write_matrix(tmp_path)
+    matrix = load_matrix(path, storage="sparse")
+    assert isinstance(matrix, SparseCountMatrix)
+    assert os.path.exists(os.path.join(cache_location(path), "csr-values-float64.npy"))
+
+    cached = read_cache(path, sparse=True)
+    assert isinstance(cached, SparseCountMatrix)
+    assert not cached.values.flags.writeable
+    assert cached.gene_totals().tolist() == [183, 2]
+
+    # A dense load of the same file is converted from the sparse cache
+    assert load_matrix(path, storage="dense").counts.tolist() == [[63, 120], [0, 2]]
@@ -0,0 +1,91 @@
+"""
+Unit tests for the tissue-by-tissue correlation and the clustering of the tissues/cells.
+
+A random zero-heavy matrix (many ties) is correlated with dense and sparse storage,
+with several tiles and threads.
+
+Checks that:
+- Pearson correlation matches NumPy, whatever the blocks, tiles, threads and storage
+- Spearman correlation matches the Pearson correlation of the average ranks
+- Constant tissues/cells get NaN correlations and are skipped by the most correlated pairs
+- The clustering merges every tissue/cell once and its leaf order groups correlated tissues/cells
+- The clustered heatmap spec is downsampled for large matrices
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_correlation_utils.py
+"""
+
+import numpy as np
+
+from correlation_utils import tissue_correlation, average_ranks
+from matrix_utils import CountMatrix, SparseCountMatrix
+from plotting import correlation_heatmap_spec, MAX_HEATMAP_CELLS
+
+def ranks(counts):
+    # Average ranks of each column, from the sorted unique values
+    result = np.empty_like(counts)
+    for j, column in enumerate(counts.T):
+        _, inverse, sizes = np.unique(column, return_inverse=True, return_counts=True)
+        ends = np.cumsum(sizes)
+        result[:, j] = (ends - (sizes - 1) / 2)[inverse]
+    return result
+
+def test_pearson(make_matrix):
+    matrix = make_matrix(2000, 40, rate=0.7, depth=20)
+    reference = np.corrcoef(matrix.counts, rowvar=False)
+
+    dense = tissue_correlation(matrix)
+    tiled = tissue_correlation(SparseCountMatrix.from_dense(matrix), block_rows=300, block_columns=16, workers=3)
+    single = tissue_correlation(matrix, block_rows=128, workers=2, dtype="float32")
+
+    assert np.allclose(dense.values, reference)
+    assert np.allclose(tiled.values, reference)
+    assert np.allclose(single.values, reference, atol=1e-5)
+
+def test_spearman(make_matrix):
+    matrix = make_matrix(2000, 40, rate=0.7, depth=20)
+    assert np.array_equal(average_ranks(matrix.counts[:, :5]), ranks(matrix.counts[:, :5]))
+
+    reference = np.corrcoef(ranks(matrix.counts), rowvar=False)
+    dense = tissue_correlation(matrix, method="spearman", block_rows=500, block_columns=16, workers=2)
+    sparse = tissue_correlation(SparseCountMatrix.from_dense(matrix), method="spearman")
+
+    assert dense.method == "spearman"
+    assert np.allclose(dense.values, reference)
+    assert np.allclose(sparse.values, reference)
+
+def test_constant_tissue(make_matrix):
+    matrix = make_matrix(2000, 6, rate=0.7, depth=20)
+    matrix.counts[:, 2] = 0
+    matrix.counts[:, 4] = matrix.counts[:, 1] * 3
+
+    correlation = tissue_correlation(matrix)
+    assert np.isnan(correlation.values[2]).all()
+    (first, second, value), = correlation.most_correlated(1)
+    assert (first, second) == ("T1", "T4") and np.isclose(value, 1)
+    assert all("T2" not in pair[:2] for pair in correlation.most_correlated(20))
+
+def test_clustering():
+    # Three groups of tissues/cells sharing a profile, interleaved
+    rng = np.random.default_rng(2)
+    profiles = rng.poisson(20, (500, 3)).astype(np.float64)
+    counts = np.column_stack([profiles[:, i % 3] + rng.poisson(1, 500) for i in range(12)])
+    matrix = CountMatrix([f"T{i}" for i in range(12)], [f"G{i}" for i in range(500)], counts)
+
+    correlation = tissue_correlation(matrix)
+    assert sorted(correlation.order.tolist()) == list(range(12))
+    assert correlation.linkage[-1, 3] == 12
+    assert np.all(np.diff(correlation.linkage[:, 2]) >= -1e-12)
+
+    groups = [i % 3 for i in correlation.order]
+    assert sum(a != b for a, b in zip(groups, groups[1:])) == 2
+
+    tissues, values = correlation.clustered()
+    assert tissues[0] == f"T{correlation.order[0]}" and np.allclose(np.diag(values), 1)
+
+def test_heatmap_spec(make_matrix):
+    matrix = make_matrix(300, MAX_HEATMAP_CELLS + 100, rate=0.7, depth=20)
+    spec = correlation_heatmap_spec(tissue_correlation(matrix, block_columns=128, workers=2))
+    assert spec["kind"] == "heatmap"
+    assert len(spec["values"]) <= MAX_HEATMAP_CELLS
@@ -0,0 +1,80 @@
+"""
+Unit tests for the one-pass distribution statistics.
+
+A random zero-heavy matrix is analyzed in memory (dense and sparse storage), streamed row by row
+and split into chunks whose statistics are merged.
+
+Checks that:
+- Means, variances, detection rates and extremes match NumPy on both axes
+- Gene quantiles are exact, tissue/cell quantiles within the relative accuracy of the sketch
+- Dense, sparse and streamed inputs give the same statistics
+- Merged chunks give the same sketch as the whole matrix, and the same moments
+- Variances stay accurate for large values with a small spread
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_distribution_utils.py
+"""
+
+import numpy as np
+
+from distribution_utils import compute_distribution, DistributionStats, QuantileSketch
+from matrix_utils import CountMatrix, SparseCountMatrix
+
+def test_compute_distribution(make_matrix):
+    matrix = make_matrix(3000, 12, rate=0.4, depth=500)
+    counts = matrix.counts
+    result = compute_distribution(matrix, block_rows=700).result()
+
+    for axis, stats in ((0, result.tissues), (1, result.genes)):
+        assert np.allclose(stats["mean"], counts.mean(axis=axis))
+        assert np.allclose(stats["var"], counts.var(axis=axis))
+        assert np.allclose(stats["detection"], np.count_nonzero(counts, axis=axis) / counts.shape[axis])
+        assert np.array_equal(stats["min"], counts.min(axis=axis))
+        assert np.array_equal(stats["max"], counts.max(axis=axis))
+
+    assert np.array_equal(result.genes["quantiles"], np.quantile(counts, (0.25, 0.5, 0.75), axis=1, method="lower").T)
+    exact = np.quantile(counts, (0.25, 0.5, 0.75), axis=0, method="lower").T
+    assert np.all(np.abs(result.tissues["quantiles"] - exact) <= 0.01 * exact)
+
+    row = result.to_dict()["tissues"][0]
+    assert row["name"] == "T0" and set(row["quantiles"]) == {"0.25", "0.5", "0.75"}
+
+def test_sparse_and_streamed_inputs(make_matrix):
+    matrix = make_matrix(3000, 12, rate=0.4, depth=500)
+    dense = compute_distribution(matrix).result()
+    sparse = compute_distribution(SparseCountMatrix.from_dense(matrix), block_rows=500).result()
+    streamed = DistributionStats(matrix.tissues).consume(zip(matrix.genes, matrix.counts.tolist())).result()
+
+    for other in (sparse, streamed):
+        assert other.gene_names == dense.gene_names
+        for key in dense.tissues:
+            assert np.allclose(other.tissues[key], dense.tissues[key])
+            assert np.allclose(other.genes[key], dense.genes[key])
+
+def test_merge_chunks(make_matrix):
+    matrix = make_matrix(3000, 12, rate=0.4, depth=500)
+    whole = compute_distribution(matrix)
+
+    merged = DistributionStats(matrix.tissues)
+    for start in range(0, matrix.n_genes, 1100):
+        part = CountMatrix(matrix.tissues, matrix.genes[start:start + 1100], matrix.counts[start:start + 1100])
+        merged.merge(compute_distribution(part, block_rows=300))
+
+    assert merged.nonzero.tolist() == whole.nonzero.tolist()
+    assert np.array_equal(merged.sketch.quantiles(), whole.sketch.quantiles())
+    assert np.allclose(merged.mean, whole.mean) and np.allclose(merged.m2, whole.m2)
+    assert merged.result().gene_names == matrix.genes
+
+def test_stable_variance():
+    rng = np.random.default_rng(1)
+    counts = 1e9 + rng.random((5000, 3))
+    result = compute_distribution(CountMatrix(["a", "b", "c"], [str(i) for i in range(5000)], counts),
+                                  block_rows=64).result()
+    assert np.allclose(result.tissues["var"], (counts - 1e9).var(axis=0), rtol=1e-6)
+
+def test_sketch_negative_values():
+    sketch = QuantileSketch(1)
+    sketch.add_block(np.array([[-100.0], [-1.0], [0.0], [0.0], [5.0]]))
+    low, median, high = sketch.quantiles((0.0, 0.5, 1.0))[0]
+    assert abs(low + 100) <= 1 and median == 0 and abs(high - 5) <= 0.05
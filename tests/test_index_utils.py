@@ -0,0 +1,83 @@
+"""
+Unit tests for the gene index and random-access gene lookups.
+
+Synthetic matrices (plain, gzip and BGZF, see synthetic_utils) are written to a temporary directory.
+
+Checks that:
+- get_gene / get_genes return the same counts as load_matrix, for every file type
+- Prefix lookups return every matching gene
+- The index is stored and reused, and rebuilt when the file changes
+- Unknown genes raise a KeyError
+- A BGZF lookup decompresses only the blocks holding the row
+- Files with CRLF line endings give the same tissue/cell names and counts as load_matrix
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_index_utils.py
+"""
+
+import os
+import zlib
+
+import numpy as np
+import pytest
+from index_utils import get_gene, get_genes, load_gene_index, read_gene_index
+from io_utils import load_matrix
+from synthetic_utils import generate_matrix
+
+@pytest.mark.parametrize("name, compress", [("m.tsv", None), ("m.tsv.gz", "gzip"), ("m.bgz.tsv.gz", "bgzf")])
+def test_get_genes(tmp_path, name, compress):
+    # 600 genes x 40 tissues : several BGZF blocks, rows crossing block boundaries
+    path = generate_matrix(str(tmp_path / name), 600, 40, seed=2, compress=compress)
+    reference = load_matrix(path, cache=False, storage="dense")
+
+    matrix = get_genes(path, ["GENE600", "GENE1", "GENE311"])
+    assert matrix.genes == ["GENE600", "GENE1", "GENE311"]
+    assert matrix.tissues == reference.tissues
+    for gene in matrix.genes:
+        assert np.array_equal(matrix.row(gene), reference.row(gene))
+
+    assert np.array_equal(get_gene(path, "GENE42"), reference.row("GENE42"))
+
+    # Prefix lookup : GENE59, GENE590 ... GENE599, sorted
+    assert get_genes(path, prefix="GENE59").genes == ["GENE59"] + [f"GENE{i}" for i in range(590, 600)]
+
+    with pytest.raises(KeyError):
+        get_gene(path, "GENE601")
+
+def test_bgzf_blocks_per_lookup(tmp_path, monkeypatch):
+    path = generate_matrix(str(tmp_path / "m.tsv.gz"), 3000, 50, compress="bgzf")
+    index = load_gene_index(path)
+    assert len(index.blocks) > 20
+
+    calls = []
+    decompress = zlib.decompress
+    monkeypatch.setattr(zlib, "decompress", lambda *args: calls.append(1) or decompress(*args))
+    for gene in ("GENE5", "GENE1500", "GENE3000"):
+        calls.clear()
+        assert get_gene(path, gene).shape == (50,)
+        assert len(calls) <= 2
+
+def test_index_reuse_and_invalidation(tmp_path):
+    path = generate_matrix(str(tmp_path / "m.tsv"), 20, 5)
+
+    assert read_gene_index(path) is None
+    index = load_gene_index(path)
+    assert len(index) == 20
+    assert read_gene_index(path).offsets == index.offsets
+
+    # A new version of the file invalidates the index
+    generate_matrix(path, 30, 5, seed=1)
+    os.utime(path, ns=(index.mtime_ns + 10**9, index.mtime_ns + 10**9))
+    assert read_gene_index(path) is None
+    assert get_gene(path, "GENE30").shape == (5,)
+
+def test_crlf_line_endings(tmp_path):
+    path = tmp_path / "crlf.tsv"
+    path.write_bytes(b"\t\tt1\tt6\r\nGENE1\tcount\t1\t2\r\nGENE1\tmean\t1\t2\r\nGENE2\tcount\t3\t4\r\n")
+    reference = load_matrix(str(path), cache=False, storage="dense")
+
+    assert load_gene_index(str(path)).tissues == reference.tissues == ["t1", "t6"]
+    matrix = get_genes(str(path), ["GENE2", "GENE1"])
+    assert matrix.tissues == reference.tissues
+    assert np.array_equal(matrix.row("GENE2"), reference.row("GENE2"))
@@ -9,12 +9,37 @@ Checks that:
 - Matrix dimensions are consistent
 - All counts are stored as floats
 
+A small matrix written to a temporary directory is also used to check
+the CountMatrix returned by load_matrix (dtype selection, invalid values, parsing counters and timings)
+and the other input sources (standard input, file objects, gzip data without .gz extension),
+as well as the gene and tissue/cell filters applied while the file is read or to the cached matrix.
+
 Run
 ---
 PYTHONPATH=src pytest -s -q tests/test_io_utils.py
 """
 
-from io_utils import load_matrix
+import gzip
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from io_utils import load_matrix, load_stats, stream_matrix, new_counters, iter_line_batches, LoadFilter
+
+SMALL_MATRIX = (
+    "\t\ttissue1\ttissue2\ttissue3\n"
+    "GENE1\tcount\t63\t120\t5\n"
+    "GENE1\tmean\t181.159\t2.5\t1\n"
+    "GENE2\tcount\t0\tNA\t2\n"
+    "GENE2\tstd\t423.159\t3\t1\n"
+    )
+
+def write_small_matrix(tmp_path, name="small.tsv"):
+    path = tmp_path / name
+    path.write_text(SMALL_MATRIX, encoding="utf-8")
+    return str(path)
 
 def test_load_matrix():
 
@@ -36,4 +61,125 @@ def test_load_matrix():
     for gene, counts in data.items():
         assert isinstance(gene, str)
         assert len(counts) == len(tissues)
-        assert all(isinstance(x, float) for x in counts)
\ No newline at end of file
+        assert all(isinstance(x, float) for x in counts)
+
+def test_load_matrix_count_matrix(tmp_path):
+    matrix = load_matrix(write_small_matrix(tmp_path), dtype="float32")
+
+    assert matrix.tissues == ["tissue1", "tissue2", "tissue3"]
+    assert matrix.genes == ["GENE1", "GENE2"]
+    assert matrix.counts.dtype == np.float32
+
+    # Invalid values are replaced with 0.0
+    assert matrix.counts.tolist() == [[63, 120, 5], [0, 0, 2]]
+
+def test_load_matrix_counters(tmp_path):
+    counters = new_counters()
+    load_matrix(write_small_matrix(tmp_path), cache=False, counters=counters)
+
+    # 4 data lines, 2 non-count lines skipped, the "NA" cell replaced with 0.0
+    assert counters == {"lines": 4, "skipped_lines": 2, "invalid_cells": 1}
+
+    # With timings, the reading, tokenizing and conversion times are recorded as well
+    counters = new_counters(timings=True)
+    load_matrix(write_small_matrix(tmp_path), cache=False, counters=counters)
+    assert counters["lines"] == 4
+    assert all(counters[name] > 0 for name in ("read_seconds", "split_seconds", "convert_seconds"))
+
+
+def test_stream_matrix(tmp_path):
+    tissues, rows = stream_matrix(write_small_matrix(tmp_path))
+    rows = list(rows)
+
+    assert tissues == ["tissue1", "tissue2", "tissue3"]
+    assert [gene for gene, _ in rows] == ["GENE1", "GENE2"]
+    assert rows[1][1].tolist() == [0.0, 0.0, 2.0]
+
+def test_load_matrix_filter(tmp_path):
+    path = write_small_matrix(tmp_path)
+
+    # Excluded genes are skipped before their line is split, kept columns stay in file order
+    counters = new_counters()
+    matrix = load_matrix(path, cache=False, counters=counters,
+                         row_filter=LoadFilter(genes=["GENE2", "GENE9"], tissues=["tissue3", "tissue2"]))
+    assert matrix.tissues == ["tissue2", "tissue3"]
+    assert matrix.genes == ["GENE2"]
+    assert matrix.counts.tolist() == [[0, 2]]
+    assert counters == {"lines": 4, "skipped_lines": 3, "invalid_cells": 1}
+
+    # Regular expression and minimum total over the kept columns
+    row_filter = LoadFilter(gene_pattern="^GENE", tissues=["tissue1"], min_total=1)
+    tissues, rows = stream_matrix(path, row_filter=row_filter)
+    assert tissues == ["tissue1"]
+    assert [(gene, counts.tolist()) for gene, counts in rows] == [("GENE1", [63.0])]
+
+    # A filtered load does not write the cache ; the subset is taken from an existing cache
+    cache_dir = tmp_path / "cache"
+    load_matrix(path, cache_dir=str(cache_dir), row_filter=row_filter)
+    assert not cache_dir.exists() or not any(cache_dir.iterdir())
+    load_matrix(path, cache_dir=str(cache_dir))
+    for storage in ("dense", "sparse"):
+        cached = load_matrix(path, cache_dir=str(cache_dir), storage=storage, row_filter=row_filter)
+        assert cached.genes == ["GENE1"] and cached.tissues == ["tissue1"]
+        assert cached.gene_totals().tolist() == [63]
+
+    with pytest.raises(ValueError):
+        load_matrix(path, cache=False, row_filter=LoadFilter(tissues=["tissue4"]))
+
+def test_load_stats(tmp_path):
+    store = load_stats(write_small_matrix(tmp_path), stats=("count", "mean", "std"))
+
+    assert store.genes == ["GENE1", "GENE2"]
+    assert store.stats == ["count", "mean", "std"]
+    assert store["count"].tolist() == [[63, 120, 5], [0, 0, 2]]
+    assert store["mean"][0].tolist() == pytest.approx([181.159, 2.5, 1])
+
+    # Statistics missing for a gene are stored as NaN
+    assert np.isnan(store["mean"][1]).all()
+    assert store["std"][1].tolist() == [423.159, 3, 1]
+
+    # The count statistic is available as a CountMatrix
+    assert store.matrix("count").gene_totals().tolist() == [188, 2]
+
+    with pytest.raises(ValueError):
+        load_stats(write_small_matrix(tmp_path), stats=("median",))
+
+
+def test_load_matrix_sources(tmp_path, monkeypatch):
+    expected = [[63, 120, 5], [0, 0, 2]]
+    packed = gzip.compress(SMALL_MATRIX.encode("utf-8"))
+
+    # Gzip data is detected from its magic bytes, whatever the file name
+    path = tmp_path / "small.data"
+    path.write_bytes(packed)
+    assert load_matrix(str(path), cache=False).counts.tolist() == expected
+
+    # File objects, compressed or not, are not closed by the loader
+    source = io.BytesIO(packed)
+    assert load_matrix(source).counts.tolist() == expected
+    assert not source.closed
+    source = io.StringIO(SMALL_MATRIX)
+    assert load_matrix(source).counts.tolist() == expected
+    assert not source.closed
+
+    # Standard input
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(packed)))
+    counters = new_counters()
+    assert load_matrix("-", counters=counters).counts.tolist() == expected
+    assert counters["lines"] == 4
+    assert not os.path.exists("-.cache")
+
+def test_iter_line_batches():
+    lines = [f"line{i}\n" for i in range(1000)]
+    batches = list(iter_line_batches(io.StringIO("".join(lines)), batch_bytes=100, queue_size=2))
+
+    assert len(batches) > 1
+    assert sum(batches, []) == lines
+
+    # Errors of the producer thread are raised in the consumer
+    class Broken(io.StringIO):
+        def readlines(self, hint=-1):
+            raise OSError("broken pipe")
+
+    with pytest.raises(OSError):
+        list(iter_line_batches(Broken()))
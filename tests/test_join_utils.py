@@ -0,0 +1,92 @@
+"""
+Unit tests for the column-wise join of several count matrices on the gene name.
+
+Two small matrices sharing some genes and one tissue/cell name are written to a temporary directory,
+sorted by gene or not, with a duplicate gene in the second one.
+
+Checks that:
+- Inner and outer joins give the same rows with the sorted-merge and the hash join
+- Without the sorted_inputs flag, the sorted-merge join falls back to the hash join on unsorted inputs,
+  even when the disorder comes after the end of the inner join, and the parsing counters are not counted twice
+- Duplicate genes are summed, kept at their first occurrence or rejected
+- A tissue/cell name shared by several inputs is prefixed with the name of its input
+- An input declared sorted but not sorted is rejected
+- Gene filters are applied to each input and the minimum total to the joined counts
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_join_utils.py
+"""
+
+import numpy as np
+import pytest
+
+from io_utils import LoadFilter, new_counters
+from join_utils import consume_joined, join_rows, load_joined
+
+STATS = ("count", "mean")
+
+@pytest.fixture
+def inputs(write_matrix):
+    first = write_matrix("batch1.tsv", ["t1", "t2"], [("A", [1, 2]), ("B", [3, 4]), ("D", [5, 6])], STATS)
+    rows = [("B", [10, 20]), ("C", [30, 40]), ("D", [50, 60]), ("D", [1, 1])]
+    second = write_matrix("batch2.tsv", ["t2", "t3"], rows, STATS)
+    unsorted = write_matrix("batch3.tsv", ["t2", "t3"], [rows[2], rows[1], rows[0], rows[3]], STATS)
+    return first, second, unsorted
+
+def joined(sources, **options):
+    return consume_joined(sources, lambda tissues, rows: (tissues, {gene: counts.tolist() for gene, counts in rows}),
+                          **options)
+
+def test_join_types(inputs):
+    first, second, unsorted = inputs
+
+    tissues, rows = joined([first, second], how="outer", duplicates="sum")
+    assert tissues == ["t1", "batch1:t2", "batch2:t2", "t3"]
+    assert list(rows) == ["A", "B", "C", "D"]
+    assert rows["A"] == [1, 2, 0, 0] and rows["C"] == [0, 0, 30, 40] and rows["D"] == [5, 6, 51, 61]
+
+    for how in ("inner", "outer"):
+        for duplicates in ("sum", "first"):
+            _, merged = joined([first, second], how=how, duplicates=duplicates)
+            for sorted_inputs in (None, False):
+                _, hashed = joined([first, unsorted], how=how, duplicates=duplicates, sorted_inputs=sorted_inputs)
+                assert hashed == merged
+
+    _, rows = joined([first, second], how="inner", duplicates="first")
+    assert rows == {"B": [3, 4, 10, 20], "D": [5, 6, 50, 60]}
+
+def test_join_errors(inputs):
+    first, second, unsorted = inputs
+
+    for sources in ([first, second], [first, unsorted]):
+        with pytest.raises(ValueError, match="Duplicate gene D"):
+            joined(sources)
+    with pytest.raises(ValueError, match="not sorted"):
+        joined([first, unsorted], duplicates="first", sorted_inputs=True)
+    with pytest.raises(ValueError):
+        joined([first, second], how="left")
+
+def test_unsorted_fallback(write_matrix):
+    first = write_matrix("a.tsv", ["t1"], [("A", [1]), ("B", [2])], STATS)
+    second = write_matrix("b.tsv", ["t2"], [("C", [3]), ("A", [4])], STATS)
+
+    # The inner join ends with the first input : the disorder of the second one is found afterwards
+    with pytest.raises(ValueError, match="not sorted"):
+        dict(join_rows([first, second], sorted_inputs=True)[1])
+    counters = new_counters()
+    assert joined([first, second], counters=counters) == (["t1", "t2"], {"A": [1, 4]})
+    assert counters["lines"] == 8
+
+def test_load_joined(inputs):
+    first, second, unsorted = inputs
+    counters = new_counters()
+    row_filter = LoadFilter(gene_pattern="[BCD]", min_total=50)
+
+    for source in (second, unsorted):
+        matrix = load_joined([first, source], how="outer", duplicates="sum", row_filter=row_filter,
+                             counters=counters, storage="dense")
+        assert matrix.genes in (["C", "D"], ["D", "C"])
+        assert np.array_equal(matrix.row("D"), [5, 6, 51, 61])
+
+    assert counters["lines"] == 2 * (6 + 8)
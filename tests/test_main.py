@@ -0,0 +1,157 @@
+"""
+Unit tests for the batch and headless modes of the main script.
+
+Two small matrices and one invalid file are written to a temporary directory.
+
+Checks that:
+- Each matrix gets its own report directory
+- A failing matrix is reported without stopping the other ones
+- The index page links to every report
+- The headless mode writes the summary and all totals as JSON or TSV, without importing matplotlib
+  and without creating the report directory (the summary is cached with the matrix cache of the input file)
+- Totals are written with full precision (no rounding of totals above 1e6) in the TSV output and rankings
+- Importing the script does not import NumPy or the profiler (Unix-only resource module)
+- With --streaming, a repeated gene keeps its last row, as in the default mode
+- With --normalize, the report lists the highly variable genes
+- With --correlation, the report lists the most correlated tissues/cells
+- With --join, several files are summarized as a single joined matrix
+- With --state, a delta file is folded into the persisted totals and later runs fold nothing
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_main.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from main import main, parse_args, report_dirs, run_batch, generate_index, write_ranking
+
+MATRIX = (
+    "\t\ttissue1\ttissue2\n"
+    "GENE1\tcount\t1\t2\n"
+    "GENE1\tmean\t1\t2\n"
+    "GENE2\tcount\t3\t4\n"
+    )
+
+def test_report_dirs():
+    dirs = report_dirs(["a/x.tsv", "b/x.tsv.gz", "y.tsv"], "out")
+    assert dirs == [os.path.join("out", "x"), os.path.join("out", "x_2"), os.path.join("out", "y")]
+
+def test_run_batch(tmp_path):
+    paths = []
+    for name, content in (("a.tsv", MATRIX), ("bad.tsv", "not a matrix\n"), ("b.tsv", MATRIX.replace("4", "40"))):
+        (tmp_path / name).write_text(content, encoding="utf-8")
+        paths.append(str(tmp_path / name))
+
+    output_dir = str(tmp_path / "reports")
+    args = parse_args(paths + ["--no-cache", "--output-dir", output_dir])
+    entries = run_batch(args, paths, output_dir, workers=2)
+
+    assert [entry["path"] for entry in entries] == paths
+    assert "error" in entries[1]
+    assert entries[0]["total"] == 10
+    assert entries[2]["total"] == 46
+    assert os.path.exists(os.path.join(output_dir, "a", "report.html"))
+    assert os.path.exists(os.path.join(output_dir, "b", "report.html"))
+
+    index = open(generate_index(output_dir, entries), encoding="utf-8").read()
+    assert 'href="a/report.html"' in index and 'href="b/report.html"' in index
+    assert "failed" in index
+
+def test_headless_output(tmp_path, monkeypatch, capsys):
+    (tmp_path / "a.tsv").write_text(MATRIX, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    main(["a.tsv", "--format", "json"])
+    output = json.loads(capsys.readouterr().out)
+    assert output["n_genes"] == 2
+    assert output["gene_totals"] == {"GENE1": 3, "GENE2": 7}
+    assert output["summary"]["tissues"]["max"] == {"names": ["tissue2"], "value": 6}
+
+    main(["a.tsv", "--format", "tsv", "--output", "totals.tsv"])
+    assert capsys.readouterr().out == ""
+    lines = open("totals.tsv", encoding="utf-8").read().splitlines()
+    assert "# n_tissues\t2" in lines
+    assert lines[-3:] == ["tissue\ttissue2\t6.0", "gene\tGENE1\t3.0", "gene\tGENE2\t7.0"]
+    assert not os.path.exists("web_report")
+    assert os.path.isdir(os.path.join("a.tsv.cache", "pipeline"))
+
+def test_headless_full_precision(tmp_path, monkeypatch):
+    (tmp_path / "a.tsv").write_text(MATRIX.replace("\t3\t4", "\t12345678\t0.1"), encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    main(["a.tsv", "--format", "tsv", "--output", "totals.tsv"])
+    rows = [line.split("\t") for line in open("totals.tsv", encoding="utf-8").read().splitlines()]
+    totals = {row[1]: float(row[2]) for row in rows if row[0] in ("tissue", "gene")}
+    assert totals["GENE2"] == 12345678.1 and totals["tissue1"] == 12345679.0
+    assert ["# genes_max", "12345678.1", "GENE2"] in rows
+
+def test_ranking_full_precision(tmp_path):
+    path = write_ranking(str(tmp_path / "top.tsv"), [("GENE2", 12345678.1), ("GENE1", 12345677.9)], "gene")
+    lines = open(path, encoding="utf-8").read().splitlines()
+    assert lines == ["rank\tgene\ttotal_count", "1\tGENE2\t12345678.1", "2\tGENE1\t12345677.9"]
+
+def test_headless_does_not_import_matplotlib(tmp_path):
+    (tmp_path / "a.tsv").write_text(MATRIX, encoding="utf-8")
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    code = ("import sys, main; assert not {'numpy', 'profiling_utils'} & set(sys.modules); main.main(['a.tsv', '--format', 'json']); "
+            "assert not {'matplotlib', 'plotting', 'correlation_utils', 'report_utils'} & set(sys.modules)")
+
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, check=True, capture_output=True,
+                   env={**os.environ, "PYTHONPATH": src})
+
+def test_streaming_duplicate_gene(tmp_path, monkeypatch, capsys):
+    (tmp_path / "a.tsv").write_text(MATRIX + "GENE1\tcount\t5\t0\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    outputs = []
+    for mode in ([], ["--streaming"]):
+        main(["a.tsv", "--format", "json", "--no-cache"] + mode)
+        outputs.append(json.loads(capsys.readouterr().out))
+    assert outputs[0]["gene_totals"] == outputs[1]["gene_totals"] == {"GENE1": 5, "GENE2": 7}
+    assert outputs[0]["tissue_totals"] == outputs[1]["tissue_totals"] == {"tissue1": 8, "tissue2": 4}
+
+def test_normalized_report(tmp_path, monkeypatch):
+    (tmp_path / "a.tsv").write_text(MATRIX, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    main(["a.tsv", "--normalize", "--no-plots", "--no-browser", "--no-cache"])
+    report = open(os.path.join("web_report", "report.html"), encoding="utf-8").read()
+    assert 'id="variable-genes"' in report and "Normalized dispersion" in report
+
+def test_correlation_report(tmp_path, monkeypatch):
+    (tmp_path / "a.tsv").write_text(MATRIX, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    main(["a.tsv", "--correlation", "spearman", "--no-plots", "--no-browser", "--no-cache"])
+    report = open(os.path.join("web_report", "report.html"), encoding="utf-8").read()
+    assert 'id="correlated-pairs"' in report and "tissue1 \\u2014 tissue2" in report
+
+def test_joined_inputs(tmp_path, monkeypatch, capsys):
+    (tmp_path / "a.tsv").write_text(MATRIX, encoding="utf-8")
+    (tmp_path / "b.tsv").write_text(MATRIX.replace("GENE2", "GENE3"), encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    for streaming in ([], ["--streaming"]):
+        main(["a.tsv", "b.tsv", "--join", "outer", "--format", "json"] + streaming)
+        output = json.loads(capsys.readouterr().out)
+        assert output["file"] == "a.tsv + b.tsv"
+        assert output["gene_totals"] == {"GENE1": 6, "GENE2": 7, "GENE3": 7}
+        assert list(output["tissue_totals"]) == ["a:tissue1", "a:tissue2", "b:tissue1", "b:tissue2"]
+
+def test_state_inputs(tmp_path, monkeypatch, capsys):
+    (tmp_path / "base.tsv").write_text(MATRIX, encoding="utf-8")
+    (tmp_path / "delta.tsv").write_text("\t\ttissue3\nGENE1\tcount\t5\nGENE2\tcount\t0\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    main(["base.tsv", "--state", "state.npz", "--format", "json"])
+    assert json.loads(capsys.readouterr().out)["gene_totals"] == {"GENE1": 3, "GENE2": 7}
+
+    for _ in range(2):
+        main(["base.tsv", "delta.tsv", "--state", "state.npz", "--format", "json"])
+        output = json.loads(capsys.readouterr().out)
+        assert output["gene_totals"] == {"GENE1": 8, "GENE2": 7}
+        assert output["tissue_totals"] == {"tissue1": 4, "tissue2": 6, "tissue3": 5}
@@ -0,0 +1,155 @@
+"""
+Unit tests for the columnar count matrix (CountMatrix) and its sparse storage (SparseCountMatrix).
+
+An artificial dataset is used.
+
+Checks that:
+- The count array has the expected shape and dtype
+- The old '(tissues, data)' representation is available as a view
+- Totals per gene and per tissue/cell are correct
+- Duplicate genes overwrite the earlier row, as in load_matrix, with dense, sparse and "auto" storage
+- The sparse storage gives the same rows and totals as the dense one
+- Sub-matrices of selected genes and tissues/cells are the same for both storages
+- The "auto" storage switches to sparse storage below the density threshold
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_matrix_utils.py
+"""
+
+import numpy as np
+import pytest
+from matrix_utils import CountMatrix, CountMatrixBuilder, SparseCountMatrix, MatrixBuilder
+
+TISSUES = ["tissue1", "tissue2", "tissue3", "tissue4"]
+DATA = {
+    "GENE1": [150.3, 25.0, 7.1, 5.0],
+    "GENE2": [734.9, 36.0, 2.0, 4.5],
+    "GENE3": [333.0, 54.2, 5.0, 4.6],
+    }
+
+def test_from_dict_shape_and_dtype():
+    matrix = CountMatrix.from_dict(TISSUES, DATA, dtype="float32")
+
+    assert matrix.counts.shape == (3, 4)
+    assert matrix.dtype == np.float32
+    assert matrix.counts.flags["C_CONTIGUOUS"]
+    assert matrix.genes == ["GENE1", "GENE2", "GENE3"]
+    assert matrix.gene_index["GENE2"] == 1
+
+def test_tuple_view():
+    matrix = CountMatrix.from_dict(TISSUES, DATA)
+    tissues, data = matrix
+
+    assert tissues == TISSUES
+    assert isinstance(data, dict)
+    assert list(data) == list(DATA)
+
+    # Rows are views of the count array, not copies
+    assert np.shares_memory(data["GENE1"], matrix.counts)
+    assert data["GENE3"].tolist() == pytest.approx(DATA["GENE3"])
+
+def test_totals():
+    matrix = CountMatrix.from_dict(TISSUES, DATA)
+
+    assert matrix.gene_totals().tolist() == pytest.approx([187.4, 777.4, 396.8])
+    assert matrix.tissue_totals().tolist() == pytest.approx([1218.2, 115.2, 14.1, 14.1])
+
+def test_builder_duplicate_and_length():
+    builder = CountMatrixBuilder(TISSUES, capacity=1)
+    builder.append("GENE1", [1, 2, 3, 4])
+    builder.append("GENE2", [5, 6, 7, 8])
+    builder.append("GENE1", [0, 0, 0, 1])
+    matrix = builder.build()
+
+    assert matrix.genes == ["GENE1", "GENE2"]
+    assert matrix.row("GENE1").tolist() == [0, 0, 0, 1]
+
+    with pytest.raises(ValueError):
+        builder.append("GENE3", [1, 2])
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        CountMatrix.from_dict(TISSUES, DATA, dtype="int8")
+
+SPARSE_DATA = {
+    "GENE1": [0, 0, 7, 0],
+    "GENE2": [0, 0, 0, 0],
+    "GENE3": [3, 0, 0, 1],
+    "GENE4": [0, 0, 0, 0],
+    }
+
+def test_sparse_matches_dense():
+    dense = CountMatrix.from_dict(TISSUES, SPARSE_DATA)
+    sparse = SparseCountMatrix.from_dense(dense, block_rows=3)
+
+    assert sparse.nnz == 3
+    assert sparse.density == pytest.approx(3 / 16)
+    assert sparse.indptr.tolist() == [0, 1, 1, 3, 3]
+    assert sparse.gene_totals().tolist() == dense.gene_totals().tolist()
+    assert sparse.tissue_totals().tolist() == dense.tissue_totals().tolist()
+    assert sparse.row("GENE3").tolist() == [3, 0, 0, 1]
+    assert sparse.nbytes < dense.nbytes
+
+    tissues, data = sparse
+    assert list(data) == list(SPARSE_DATA)
+    assert data["GENE1"].tolist() == [0, 0, 7, 0]
+    assert sparse.to_dense().counts.tolist() == dense.counts.tolist()
+
+def test_select():
+    dense = CountMatrix.from_dict(TISSUES, SPARSE_DATA)
+    sparse = SparseCountMatrix.from_dense(dense)
+
+    for rows, columns in ((None, None), ([2, 0], None), (None, [3, 0, 2]), ([2, 3], [0, 3])):
+        expected = dense.counts[rows if rows is not None else slice(None)]
+        if columns is not None:
+            expected = expected[:, columns]
+
+        for matrix in (dense.select(rows, columns), sparse.select(rows, columns)):
+            assert matrix.genes == [dense.genes[i] for i in (rows if rows is not None else range(4))]
+            assert matrix.tissues == [TISSUES[j] for j in (columns if columns is not None else range(4))]
+            if isinstance(matrix, SparseCountMatrix):
+                matrix = matrix.to_dense()
+            assert np.array_equal(matrix.counts, expected)
+
+def test_matrix_builder_storage():
+    def build(storage, data=SPARSE_DATA, sample_rows=2):
+        builder = MatrixBuilder(TISSUES, storage=storage, sample_rows=sample_rows)
+        for gene, counts in data.items():
+            builder.append(gene, counts)
+        return builder.build()
+
+    # Density measured on the first 2 rows (1/8) : sparse storage for the rest of the rows
+    matrix = build("auto")
+    assert isinstance(matrix, SparseCountMatrix)
+    assert matrix.gene_totals().tolist() == [7, 0, 4, 0]
+
+    assert isinstance(build("auto", DATA), CountMatrix)
+    assert isinstance(build("dense"), CountMatrix)
+    assert isinstance(build("sparse", DATA), SparseCountMatrix)
+
+    # Fewer rows than the sample : the whole matrix is measured when it is built
+    assert isinstance(build("auto", sample_rows=100), SparseCountMatrix)
+
+    with pytest.raises(ValueError):
+        MatrixBuilder(TISSUES, storage="csr")
+
+@pytest.mark.parametrize("storage", ["auto", "dense", "sparse"])
+def test_matrix_builder_duplicate(storage):
+    # Duplicate before the density sample (dense rows) and after it (sparse rows with "auto")
+    for data, sparse in ((DATA, False), (SPARSE_DATA, True)):
+        builder = MatrixBuilder(TISSUES, storage=storage, sample_rows=2)
+        genes = list(data)
+        for gene in genes:
+            builder.append(gene, data[gene])
+        builder.append(genes[0], [0, 0, 0, 1])
+        builder.append(genes[-1], [0, 2, 0, 0])
+        matrix = builder.build()
+
+        if storage == "auto":
+            assert isinstance(matrix, SparseCountMatrix) == sparse
+        assert matrix.genes == genes and len(builder) == len(genes)
+        assert matrix.row(genes[0]).tolist() == [0, 0, 0, 1]
+        assert matrix.row(genes[-1]).tolist() == [0, 2, 0, 0]
+        for gene in genes[1:-1]:
+            assert matrix.row(gene).tolist() == pytest.approx(data[gene])
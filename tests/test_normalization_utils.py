@@ -0,0 +1,85 @@
+"""
+Unit tests for the library-size normalization and the selection of highly variable genes.
+
+A random zero-heavy matrix is normalized with dense and sparse storage, in a new array and in place.
+
+Checks that:
+- Normalized counts are log1p of the counts per million of each tissue/cell
+- Sparse normalization gives the same values and keeps the matrix sparse
+- In-place normalization reuses a writable float32 array and copies a read-only one once
+- Highly variable genes are the same for dense, sparse and already normalized matrices,
+  and a gene expressed in a few tissues/cells only is ranked first
+- Genes never expressed are never selected
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_normalization_utils.py
+"""
+
+import numpy as np
+import pytest
+
+from matrix_utils import SparseCountMatrix
+from normalization_utils import normalize_counts, highly_variable_genes
+
+@pytest.fixture
+def random_matrix(make_matrix):
+
+    # Random float32 matrix whose first gene is never expressed
+    def make():
+        matrix = make_matrix(2000, 30, dtype="float32")
+        matrix.counts[0] = 0
+        return matrix
+
+    return make
+
+def expected(matrix):
+    counts = matrix.counts.astype(np.float64)
+    return np.log1p(counts / counts.sum(axis=0) * 1e6)
+
+def test_normalize_counts(random_matrix):
+    matrix = random_matrix()
+    normalized = normalize_counts(matrix, block_rows=300)
+    assert normalized.counts.dtype == np.float32
+    assert np.allclose(normalized.counts, expected(matrix), rtol=1e-5)
+
+    sparse = normalize_counts(SparseCountMatrix.from_dense(matrix))
+    assert isinstance(sparse, SparseCountMatrix)
+    assert np.allclose(sparse.to_dense().counts, expected(matrix), rtol=1e-5)
+
+def test_normalize_in_place(random_matrix):
+    matrix = random_matrix()
+    reference = expected(matrix)
+    counts = matrix.counts
+
+    assert normalize_counts(matrix, inplace=True) is matrix
+    assert matrix.counts is counts
+    assert np.allclose(counts, reference, rtol=1e-5)
+
+    read_only = random_matrix()
+    read_only.counts.flags.writeable = False
+    normalized = normalize_counts(read_only, inplace=True)
+    assert normalized is not read_only and normalized.counts.dtype == np.float32
+    assert np.allclose(normalized.counts, reference, rtol=1e-5)
+
+def test_highly_variable_genes(random_matrix):
+    matrix = random_matrix()
+    # Genes of steady expression at various levels, except one missing in a third of the tissues/cells
+    rng = np.random.default_rng(1)
+    levels = rng.uniform(5, 500, (matrix.n_genes - 1, 1))
+    matrix.counts[1:] = rng.poisson(levels, (matrix.n_genes - 1, matrix.n_tissues))
+    matrix.counts[1] = rng.poisson(2000, matrix.n_tissues)
+    matrix.counts[1, ::3] = 0
+
+    dense = highly_variable_genes(matrix, n_top=100, block_rows=256)
+    sparse = highly_variable_genes(SparseCountMatrix.from_dense(matrix), n_top=100, block_rows=100)
+    normalized = highly_variable_genes(normalize_counts(matrix, dtype="float64"), n_top=100, normalize=False)
+
+    assert dense.n_selected == 100
+    assert dense.top(1)[0][0] == "G1"
+    assert 0 not in dense.selected
+    assert np.isnan(dense.dispersions_norm[0])
+    assert np.array_equal(dense.selected, sparse.selected)
+    assert np.array_equal(dense.selected, normalized.selected)
+    assert np.allclose(dense.means, expected(matrix).mean(axis=1))
+    assert [row["name"] for row in dense.to_dict()["genes"]] == [name for name, _ in dense.top()]
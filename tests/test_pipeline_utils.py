@@ -0,0 +1,83 @@
+"""
+Unit tests for the incremental pipeline (stages and artifact cache).
+
+A small input file and counting stage functions are used.
+
+Checks that:
+- A first run executes every stage
+- A rerun with the same inputs and parameters reuses the cached artifacts
+- Changing a parameter only reruns the affected stage
+- Changing the input file invalidates every downstream stage
+- A missing output file triggers the stage again
+- Stages depending on a non-cacheable source (standard input, pipe) always run
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_pipeline_utils.py
+"""
+
+import os
+from pipeline_utils import Pipeline, Stage
+
+def build(tmp_path, calls, scale=1, force=False):
+    report = str(tmp_path / "report.txt")
+
+    def total(path):
+        calls.append("total")
+        return sum(int(x) for x in open(path).read().split())
+
+    def write_report(value, scale):
+        calls.append("report")
+        with open(report, "w") as f:
+            f.write(str(value * scale))
+        return report
+
+    pipeline = Pipeline(str(tmp_path / "cache"), force=force)
+    pipeline.source("input", str(tmp_path / "input.txt"))
+    pipeline.add(Stage("total", total, inputs=["input"]))
+    pipeline.add(Stage("report", write_report, inputs=["total"], params={"scale": scale}, outputs=[report]))
+    return pipeline
+
+def test_pipeline_incremental(tmp_path):
+    (tmp_path / "input.txt").write_text("1 2 3")
+    calls = []
+
+    assert open(build(tmp_path, calls).run("report")).read() == "6"
+    assert calls == ["total", "report"]
+
+    # Same inputs and parameters : everything comes from the cache
+    calls.clear()
+    pipeline = build(tmp_path, calls)
+    pipeline.run("report")
+    assert calls == []
+    assert pipeline.status == {"report": "cached"}
+
+    # New parameter : only the report stage runs, the total is not recomputed
+    calls.clear()
+    assert open(build(tmp_path, calls, scale=2).run("report")).read() == "12"
+    assert calls == ["report"]
+
+    # Missing output file or forced run : the stage runs again
+    calls.clear()
+    os.remove(tmp_path / "report.txt")
+    build(tmp_path, calls, scale=2).run("report")
+    assert calls == ["report"]
+    calls.clear()
+    build(tmp_path, calls, scale=2, force=True).run("report")
+    assert calls == ["total", "report"]
+
+    # New input file : every stage runs again
+    calls.clear()
+    (tmp_path / "input.txt").write_text("1 2 3 4")
+    assert open(build(tmp_path, calls, scale=2).run("report")).read() == "20"
+    assert calls == ["total", "report"]
+
+def test_pipeline_uncacheable_source(tmp_path):
+    (tmp_path / "input.txt").write_text("1 2 3")
+    calls = []
+
+    for _ in range(2):
+        pipeline = build(tmp_path, calls)
+        pipeline.source("input", str(tmp_path / "input.txt"), cacheable=False)
+        pipeline.run("report")
+    assert calls == ["total", "report", "total", "report"]
@@ -0,0 +1,75 @@
+"""
+Unit tests for the figure rendering pipeline.
+
+Figures are rendered to a temporary directory with a low resolution.
+
+Checks that:
+- PNG and SVG figures are written
+- A figure is not rendered again when its data and options are unchanged
+- A change of data or options triggers a new rendering
+- The log-binned histogram counts every positive total once and the zeros apart
+- Distribution figures are drawn from the precomputed bins and quantiles, with at most MAX_BOXES boxes
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_plotting.py
+"""
+
+import os
+
+import numpy as np
+
+from distribution_utils import compute_distribution
+from matrix_utils import CountMatrix
+from plotting import (gene_total_spec, tissue_total_spec, gene_distribution_spec, tissue_distribution_spec,
+                      log_histogram, render_figures, BOX_QUANTILES)
+
+GENE_TOTALS = {"GENE1": 187.4, "GENE2": 777.4, "GENE3": 396.8}
+TISSUE_TOTALS = {"tissue1": 1398.2, "tissue2": 115.2}
+
+def test_render_figures(tmp_path):
+    png = str(tmp_path / "top_genes.png")
+    svg = str(tmp_path / "top_tissues.svg")
+    specs = [gene_total_spec(GENE_TOTALS, output_path=png, dpi=30),
+             tissue_total_spec(TISSUE_TOTALS, output_path=svg, dpi=30)]
+
+    assert render_figures(specs, workers=1) == {png: True, svg: True}
+    assert os.path.getsize(png) > 0
+    assert open(svg, encoding="utf-8").read().lstrip().startswith("<?xml")
+
+    # Unchanged data and options : nothing is rendered again
+    assert render_figures(specs, workers=1) == {png: False, svg: False}
+
+    # New data or options : the figure is rendered again
+    changed = gene_total_spec({**GENE_TOTALS, "GENE4": 5.0}, output_path=png, dpi=30)
+    assert render_figures([changed], workers=1) == {png: True}
+    changed = gene_total_spec({**GENE_TOTALS, "GENE4": 5.0}, output_path=png, dpi=40)
+    assert render_figures([changed], workers=1) == {png: True}
+
+def test_log_histogram():
+    values = np.array([0, 0, 1, 10, 100, 1000, 1000])
+    edges, counts, zeros = log_histogram(values, bins=3)
+    assert zeros == 2 and counts.tolist() == [1, 1, 3]
+    assert np.allclose(edges, [1, 10, 100, 1000])
+
+    edges, counts, zeros = log_histogram([5.0, 5.0], bins=4)
+    assert counts.sum() == 2 and edges[0] < 5 < edges[-1]
+    assert log_histogram([0, 0])[1].size == 0
+
+def test_distribution_figures(tmp_path):
+    rng = np.random.default_rng(0)
+    counts = rng.poisson(5, size=(200, 80)).astype(np.float64)
+    matrix = CountMatrix([f"tissue{j}" for j in range(80)], [f"GENE{i}" for i in range(200)], counts)
+    distribution = compute_distribution(matrix, quantiles=BOX_QUANTILES).result()
+
+    histogram = gene_distribution_spec(dict(zip(matrix.genes, counts.sum(axis=1))), bins=20,
+                                       output_path=str(tmp_path / "gene_distribution.png"), dpi=30)
+    assert sum(histogram["counts"]) + histogram["zeros"] == 200
+
+    boxplot = tissue_distribution_spec(distribution, max_boxes=10, output_path=str(tmp_path / "tissue_distribution.svg"),
+                                       dpi=30)
+    assert len(boxplot["names"]) == 10
+    medians = [row[2] for row in boxplot["stats"]]
+    assert medians == sorted(medians) and all(row == sorted(row) for row in boxplot["stats"])
+
+    assert all(render_figures([histogram, boxplot], workers=1).values())
@@ -0,0 +1,91 @@
+"""
+Unit tests for the per-stage profiler.
+
+Checks that:
+- A measured stage records its wall time, CPU time and peak memory
+- Throughput is derived from the processed quantities
+- Cached stages of a pipeline are recorded as cached
+- The "cprofile" and "sample" hooks write their output files
+- Unknown hooks are rejected
+- Without the (Unix-only) resource module, the peak memory is recorded as None
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_profiling_utils.py
+"""
+
+import json
+import os
+
+import pytest
+
+import profiling_utils
+from pipeline_utils import Pipeline, Stage
+from profiling_utils import Profiler
+
+def busy():
+    return sum(i * i for i in range(200000))
+
+def test_profiler_stage(tmp_path):
+    profiler = Profiler(str(tmp_path))
+
+    with profiler.stage("load") as record:
+        busy()
+        record["counters"]["lines"] = 100
+
+    profiler.add_throughput("load", lines=100)
+    record = profiler.records["load"]
+
+    assert record["wall_seconds"] > 0
+    assert record["cpu_seconds"] >= 0
+    assert record["peak_rss_mb"] > 0
+    assert record["counters"] == {"lines": 100}
+    assert record["lines_per_sec"] == pytest.approx(100 / record["wall_seconds"])
+
+    stages = json.load(open(profiler.write(str(tmp_path / "profile.json"))))["stages"]
+    assert [s["stage"] for s in stages] == ["load"]
+
+def test_profiler_pipeline(tmp_path):
+    (tmp_path / "input.txt").write_text("1 2 3")
+
+    def build(profiler):
+        pipeline = Pipeline(str(tmp_path / "cache"), profiler=profiler)
+        pipeline.source("input", str(tmp_path / "input.txt"))
+        pipeline.add(Stage("total", lambda path: sum(map(int, open(path).read().split())), inputs=["input"]))
+        return pipeline
+
+    profiler = Profiler(str(tmp_path))
+    assert build(profiler).run("total") == 6
+    assert "wall_seconds" in profiler.records["total"]
+
+    # Second run : the stage is reused from the cache and not measured
+    profiler = Profiler(str(tmp_path))
+    assert build(profiler).run("total") == 6
+    assert profiler.records["total"].get("cached") is True
+    assert "wall_seconds" not in profiler.records["total"]
+
+def test_profiler_hooks(tmp_path):
+    profiler = Profiler(str(tmp_path), hooks={"load": "cprofile", "summary": "sample"})
+
+    with profiler.stage("load"):
+        busy()
+    with profiler.stage("summary"):
+        busy()
+
+    assert os.path.exists(tmp_path / "load.prof")
+    assert os.path.exists(tmp_path / "summary.samples.txt")
+    assert profiler.records["load"]["hook"] == "cprofile"
+
+    with pytest.raises(ValueError):
+        Profiler(str(tmp_path), hooks={"load": "perf"})
+
+def test_profiler_without_resource(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling_utils, "resource", None)
+    profiler = Profiler(str(tmp_path))
+
+    with profiler.stage("load"):
+        busy()
+
+    record = profiler.records["load"]
+    assert record["peak_rss_mb"] is None and record["children_cpu_seconds"] is None
+    assert record["wall_seconds"] > 0
@@ -0,0 +1,71 @@
+"""
+Unit tests for the HTML report generation.
+
+A summary of 25 000 genes (more than one JSON chunk) and a small PNG figure are written to a temporary directory.
+
+Checks that:
+- The full gene and tissue/cell totals are embedded as JSON, in order and without truncation
+- Names that could close the data block are escaped
+- Non-finite totals are embedded as null (valid JSON for JSON.parse)
+- Figures are inlined as base64 data URIs (the report does not reference any image file)
+- Figures can still be linked with inline_figures=False
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_report_utils.py
+"""
+
+import base64
+import json
+import re
+
+import numpy as np
+
+from report_utils import generate_html_report, JSON_CHUNK
+from stats_utils import SummaryResult
+
+PNG = b"\x89PNG\r\n\x1a\nfake"
+
+def make_result(n_genes):
+    genes = [f"GENE{i}" for i in range(n_genes - 1)] + ["</script><b>"]
+    return SummaryResult(["tissue1", "tissue2"], genes, np.array([3.0, 4.5]),
+                         np.arange(n_genes, dtype=np.float64), density=0.5)
+
+def embedded_totals(html, element_id):
+    match = re.search(f'<script type="application/json" id="{element_id}">(.*?)</script>', html, re.S)
+    return json.loads(match.group(1))
+
+def test_embedded_totals(tmp_path):
+    result = make_result(JSON_CHUNK * 2 + 5000)
+    html = open(generate_html_report(str(tmp_path), "m.tsv", result, plots=False), encoding="utf-8").read()
+
+    genes = embedded_totals(html, "gene-totals")
+    assert genes["names"] == result.genes
+    assert genes["totals"] == result.gene_totals.tolist()
+    assert embedded_totals(html, "tissue-totals") == {"names": ["tissue1", "tissue2"], "totals": [3.0, 4.5]}
+    assert "</script><b>" not in html
+    assert not (tmp_path / "report.html.tmp").exists()
+
+def test_non_finite_totals(tmp_path):
+    result = SummaryResult(["tissue1", "tissue2", "tissue3"], ["GENE1", "GENE2"], np.array([np.nan, np.inf, 1.0]),
+                           np.array([2.0, -np.inf]), density=1.0)
+    html = open(generate_html_report(str(tmp_path), "m.tsv", result, plots=False), encoding="utf-8").read()
+
+    def reject(constant):
+        raise ValueError(f"Invalid JSON constant: {constant}")
+
+    for element_id, expected in (("tissue-totals", [None, None, 1.0]), ("gene-totals", [2.0, None])):
+        block = re.search(f'<script type="application/json" id="{element_id}">(.*?)</script>', html, re.S).group(1)
+        assert json.loads(block, parse_constant=reject)["totals"] == expected
+
+def test_inline_figures(tmp_path):
+    for axis in ("tissues", "genes"):
+        (tmp_path / f"top_{axis}.png").write_bytes(PNG)
+    result = make_result(3)
+
+    html = open(generate_html_report(str(tmp_path), "m.tsv", result), encoding="utf-8").read()
+    assert html.count(f'src="data:image/png;base64,{base64.b64encode(PNG).decode("ascii")}"') == 2
+    assert 'src="top_' not in html
+
+    html = open(generate_html_report(str(tmp_path), "m.tsv", result, inline_figures=False), encoding="utf-8").read()
+    assert 'src="top_tissues.png"' in html and 'src="top_genes.png"' in html
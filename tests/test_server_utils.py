@@ -0,0 +1,159 @@
+"""
+Unit tests for the local query server holding the matrix in memory.
+
+A small matrix is written to a temporary directory and served on a free localhost port (and a Unix socket).
+
+Checks that:
+- Gene lookups, tissue/cell totals, top-k rankings and the summary are answered as JSON
+- Invalid queries get a 400 or 404 status with an error message
+- The LRU cache evicts the least recently used response and is cleared on reload
+- A change of the input file reloads the matrix, a broken or truncated (gzip) file keeps the previous one
+  and does not stop the watcher thread
+- Queries over a Unix socket give the same answers
+
+Run
+---
+PYTHONPATH=src pytest -s -q tests/test_server_utils.py
+"""
+
+import functools
+import gzip
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from io_utils import load_matrix
+from server_utils import LRUCache, QueryService, make_server
+
+MATRIX = (
+    "\t\ttissue1\ttissue2\ttissue3\n"
+    "GENE1\tcount\t1\t2\t0\n"
+    "GENE1\tmean\t1\t2\t0\n"
+    "GENE2\tcount\t3\t4\t5\n"
+    "GENE3\tcount\t0\t0\t1\n"
+    )
+
+class UnixConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+@pytest.fixture
+def service(tmp_path):
+    path = tmp_path / "matrix.tsv"
+    path.write_text(MATRIX, encoding="utf-8")
+    return QueryService(str(path), cache_size=2)
+
+def running(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def get(connection, url):
+    connection.request("GET", url)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "capacity": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+def test_queries(service):
+    server = running(make_server(service, port=0))
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    try:
+        status, genes = get(connection, "/gene?name=GENE1,GENE3")
+        assert status == 200
+        assert genes["GENE1"] == {"total": 3, "counts": {"tissue1": 1, "tissue2": 2, "tissue3": 0}}
+        assert genes["GENE3"]["total"] == 1
+
+        assert get(connection, "/tissues") == (200, {"tissue1": 4, "tissue2": 6, "tissue3": 6})
+        assert get(connection, "/tissues?name=tissue2") == (200, {"tissue2": 6})
+        _, top = get(connection, "/top?axis=genes&k=2")
+        assert top["items"] == [["GENE2", 12], ["GENE1", 3]]
+        _, bottom = get(connection, "/top?axis=tissues&k=1&order=bottom")
+        assert bottom["items"] == [["tissue1", 4]]
+
+        _, summary = get(connection, "/summary")
+        assert summary["n_genes"] == 3 and summary["n_tissues"] == 3
+        assert summary["summary"]["genes"]["max"] == {"names": ["GENE2"], "value": 12}
+        assert summary["summary"]["tissues"]["max"]["names"] == ["tissue2", "tissue3"]
+
+        for url, expected in (("/gene?name=GENE9", 404), ("/gene", 400), ("/top?k=0", 400),
+                              ("/top?axis=cells", 400), ("/tissues?name=liver", 404), ("/plot", 404)):
+            status, body = get(connection, url)
+            assert status == expected and "error" in body
+
+        _, status = get(connection, "/status")
+        assert status["generation"] == 1 and status["cache"]["evictions"] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_reload(service):
+    assert service.query("/top", {"k": ["1"]}) == service.query("/top", {"k": ["1"]})
+    assert service.cache.hits == 1 and not service.check()
+
+    with open(service.path, "a", encoding="utf-8") as f:
+        f.write("GENE4\tcount\t10\t10\t10\n")
+    assert service.check()
+    assert service.generation == 2 and len(service.cache) == 0
+    assert json.loads(service.query("/top", {"k": ["1"]}))["items"] == [["GENE4", 30]]
+
+    with open(service.path, "w", encoding="utf-8") as f:
+        f.write("GENE1\tcount\t1\n")
+    assert not service.check()
+    assert service.generation == 2 and service.last_error is not None
+    assert service.result.n_genes == 4
+
+def test_reload_truncated_gzip(tmp_path):
+    path = tmp_path / "matrix.tsv.gz"
+    lines = MATRIX + "".join(f"GENE{i}\tcount\t{i}\t{i}\t{i}\n" for i in range(4, 2000))
+    path.write_bytes(gzip.compress(lines.encode("utf-8")))
+    service = QueryService(str(path), loader=functools.partial(load_matrix, cache=False))
+
+    # Half-written file : the reload fails, the watcher keeps running and the previous matrix keeps answering
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    watcher = service.watch(interval=0.01)
+    try:
+        assert not service.check()
+        assert service.last_error.startswith("EOFError") and service.generation == 1
+        assert watcher.is_alive() and service.result.n_genes == 1999
+
+        # Complete file : reloaded by the watcher thread
+        path.write_bytes(data)
+        os.utime(path, ns=(0, 0))
+        deadline = time.monotonic() + 10
+        while service.generation == 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert service.generation == 2 and service.last_error is None
+    finally:
+        service.close()
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix sockets are not available")
+def test_unix_socket(service, tmp_path):
+    path = str(tmp_path / "query.sock")
+    server = running(make_server(service, unix_socket=path))
+    try:
+        connection = UnixConnection(path)
+        assert get(connection, "/tissues?name=tissue1") == (200, {"tissue1": 4})
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not os.path.exists(path)
@@ -8,6 +8,10 @@ Functions tested
 - total_count_gene : computation of the total number of counts per gene
 - total_count_tissue : computation of the total number of counts per tissue/cell
 - min_max_items : verification of minimum and maximum values and associated keys
+- summarize : identical results on the old dictionary and on a CountMatrix
+- StreamingAggregator : single-pass aggregation gives the same summary as summarize
+- compute_summary : fused totals, min/max and rankings shared in a SummaryResult
+- top_k / StreamingTopK : partial selection gives the same ranking as a full sort
 
 This validates:
 - Correct computation of total counts per gene
@@ -21,7 +25,10 @@ PYTHONPATH=src pytest -s -q tests/test_stats_utils.py
 """
 
 import pytest
-from stats_utils import total_count_gene, total_count_tissue, min_max_items
+from matrix_utils import CountMatrix
+from stats_utils import total_count_gene, total_count_tissue, min_max_items, summarize, StreamingAggregator, compute_summary
+from stats_utils import top_k, StreamingTopK
+import numpy as np
 
 def test_total_count_gene():
     data = {
@@ -92,4 +99,94 @@ def test_min_max_items_genes():
     assert min_val == pytest.approx(187.4)
     assert set(min_items) == {"GENE1", "GENE4"}
     assert max_val == pytest.approx(777.4)
-    assert set(max_items) == {"GENE2"}
\ No newline at end of file
+    assert set(max_items) == {"GENE2"}
+
+def test_summarize_count_matrix():
+    tissues = ["tissue1", "tissue2", "tissue3", "tissue4"]
+    data = {
+        "GENE1": [150.3, 25.0, 7.1, 5.0],
+        "GENE2": [734.9, 36.0, 2.0, 4.5],
+        "GENE3": [333.0, 54.2, 5.0, 4.6],
+        "GENE4": [180.0, 0.0, 7.4, 0.0],
+        }
+    matrix = CountMatrix.from_dict(tissues, data)
+
+    assert total_count_gene(matrix) == pytest.approx(total_count_gene(data))
+    assert total_count_tissue(tissues, matrix) == pytest.approx(total_count_tissue(tissues, data))
+
+    expected = summarize(tissues, data)
+    result = summarize(tissues, matrix)
+
+    assert set(result["genes"]["min"]["names"]) == set(expected["genes"]["min"]["names"])
+    assert result["genes"]["max"]["value"] == pytest.approx(expected["genes"]["max"]["value"])
+    assert result["tissues"]["min"]["names"] == expected["tissues"]["min"]["names"]
+    assert result["tissues"]["max"]["value"] == pytest.approx(expected["tissues"]["max"]["value"])
+
+
+def test_streaming_aggregator():
+    tissues = ["tissue1", "tissue2", "tissue3", "tissue4"]
+    data = {
+        "GENE1": [150.3, 25.0, 7.1, 5.0],      # total = 187.4
+        "GENE2": [734.9, 36.0, 2.0, 4.5],      # total = 777.4
+        "GENE3": [0.0, 0.0, 0.0, 0.0],         # total = 0.0
+        "GENE4": [180.0, 0.0, 7.4, 0.0],       # total = 187.4
+        "GENE5": [0.0, 0.0, 0.0, 0.0],         # total = 0.0
+        }
+
+    aggregator = StreamingAggregator(tissues).consume(data.items())
+
+    assert aggregator.gene_totals == pytest.approx(total_count_gene(data))
+    assert aggregator.tissue_totals() == pytest.approx(total_count_tissue(tissues, data))
+
+    # Tie sets are identical to those computed on the full matrix
+    expected = summarize(tissues, data)
+    result = aggregator.summary()
+    assert result["genes"]["min"]["names"] == expected["genes"]["min"]["names"] == ["GENE3", "GENE5"]
+    assert result["genes"]["max"]["names"] == expected["genes"]["max"]["names"]
+    assert result["tissues"] == expected["tissues"]
+
+    with pytest.raises(ValueError):
+        aggregator.add("GENE1", [1.0, 2.0, 3.0, 4.0])
+
+
+def test_compute_summary():
+    tissues = ["tissue1", "tissue2", "tissue3", "tissue4"]
+    data = {
+        "GENE1": [150.3, 25.0, 7.1, 5.0],      # total = 187.4
+        "GENE2": [734.9, 36.0, 2.0, 4.5],      # total = 777.4
+        "GENE3": [333.0, 54.2, 5.0, 4.6],      # total = 396.8
+        "GENE4": [180.0, 0.0, 7.4, 0.0],       # total = 187.4
+        }
+
+    for source in (data, CountMatrix.from_dict(tissues, data)):
+        result = compute_summary(tissues, source)
+
+        assert result.gene_totals_dict() == pytest.approx(total_count_gene(data))
+        assert result.tissue_totals_dict() == pytest.approx(total_count_tissue(tissues, data))
+        assert set(result.to_dict()["genes"]["min"]["names"]) == {"GENE1", "GENE4"}
+
+        # Rankings in descending order, ties in original order
+        assert [name for name, _ in result.top_genes(3)] == ["GENE2", "GENE3", "GENE1"]
+        assert [name for name, _ in result.top_tissues(None)] == ["tissue1", "tissue2", "tissue3", "tissue4"]
+
+    # The streaming aggregator builds the same result object
+    streamed = StreamingAggregator(tissues).consume(data.items()).result()
+    assert streamed.top_genes(2) == result.top_genes(2)
+    assert streamed.to_dict()["tissues"] == result.to_dict()["tissues"]
+
+
+def test_top_k():
+    totals = {"GENE1": 5.0, "GENE2": 9.0, "GENE3": 5.0, "GENE4": 1.0, "GENE5": 9.0, "GENE6": 5.0}
+    names = list(totals)
+    values = np.array(list(totals.values()))
+
+    for k in (1, 3, 4, 6, 10):
+        expected = sorted(totals.items(), key=lambda x: x[1], reverse=True)[:k]
+
+        # Ties are kept in their original order, whatever the selection method
+        assert top_k(totals, k) == expected
+        assert top_k(values, k, names=names) == expected
+        assert StreamingTopK(k).extend(totals.items()).result() == expected
+
+    assert top_k(values, 2, largest=False, names=names) == [("GENE4", 1.0), ("GENE1", 5.0)]
+    assert StreamingTopK(2, largest=False).extend(totals.items()).result() == [("GENE4", 1.0), ("GENE1", 5.0)]